@@ -3,6 +3,8 @@ Networking module - All packet classes and network utilities.
 
 This module provides:
 - Packet base class and all packet types
+- Binary codec for telemetry, stats and command packets
+- Topics for the telemetry PUB socket
 - Network interface utilities
 """
 import logging
@@ -17,6 +19,7 @@ from .packets import (
     HeartbeatResponse,
     CLIENT,
     SERVER,
+    HEARTBEAT_REJECTED,
     # Commands
     CommandPacket,
     GoForward,
@@ -28,6 +31,9 @@ from .packets import (
     TurretLeft,
     TurretRight,
     TurretReset,
+    RequestKeyframe,
+    SetRegionOfInterest,
+    VelocityCommand,
     GO_FORWARD,
     GO_BACKWARD,
     GO_LEFT,
@@ -37,13 +43,52 @@ from .packets import (
     TURRET_LEFT,
     TURRET_RIGHT,
     TURRET_RESET,
+    REQUEST_KEYFRAME,
+    SET_ROI,
+    SET_VELOCITY,
+    ROI_VIDEO,
+    ROI_DEPTH,
     # Telemetry
     SystemStats,
     LegoMotor,
     LegoSensor,
     TelemetryPacket,
+    StatsPacket,
     # Kinect
     KinectPacket,
+    VIDEO_RGB,
+    VIDEO_BAYER,
+    DEPTH_RAW,
+    DEPTH_MM,
+    DEPTH_REGISTERED,
+)
+from .codec import (
+    MSG_TELEMETRY,
+    MSG_COMMAND,
+    MSG_STATS,
+    MSG_ROI,
+    MSG_VELOCITY,
+    can_encode,
+    is_encoded,
+    encode_packet,
+    decode_packet,
+)
+from .topics import (
+    TOPIC_TELEMETRY,
+    TOPIC_STATS,
+    TOPIC_VIDEO,
+    TOPIC_DEPTH,
+    ALL_TOPICS,
+    KINECT_TOPICS,
+    DEFAULT_TOPICS,
+    PYRAMID_LEVELS,
+    level_topic,
+    topic_stream,
+    roi_topic,
+    is_roi_topic,
+    STREAM_TOPICS,
+    STREAM_ACK,
+    STREAM_BYE,
 )
 
 # Backward compatibility aliases (old Hello* names)
@@ -77,17 +122,29 @@ __all__ = [
     # Heartbeat
     'HeartbeatPacket', 'HeartbeatRequest', 'HeartbeatResponse',
     'HelloPacket', 'HelloClientPacket', 'HelloServerPacket',  # Backward compat
-    'CLIENT', 'SERVER',
+    'CLIENT', 'SERVER', 'HEARTBEAT_REJECTED',
     # Commands
     'CommandPacket',
     'GoForward', 'GoBackward', 'GoLeft', 'GoRight',
     'TurnLeft', 'TurnRight', 'TurretLeft', 'TurretRight', 'TurretReset',
+    'RequestKeyframe', 'SetRegionOfInterest', 'VelocityCommand',
     'GO_FORWARD', 'GO_BACKWARD', 'GO_LEFT', 'GO_RIGHT',
     'TURN_LEFT', 'TURN_RIGHT', 'TURRET_LEFT', 'TURRET_RIGHT', 'TURRET_RESET',
+    'REQUEST_KEYFRAME', 'SET_ROI', 'SET_VELOCITY', 'ROI_VIDEO', 'ROI_DEPTH',
     # Telemetry
-    'SystemStats', 'LegoMotor', 'LegoSensor', 'TelemetryPacket',
+    'SystemStats', 'LegoMotor', 'LegoSensor', 'TelemetryPacket', 'StatsPacket',
     # Kinect
     'KinectPacket',
+    'VIDEO_RGB', 'VIDEO_BAYER', 'DEPTH_RAW', 'DEPTH_MM', 'DEPTH_REGISTERED',
+    # Binary codec
+    'MSG_TELEMETRY', 'MSG_COMMAND', 'MSG_STATS', 'MSG_ROI', 'MSG_VELOCITY',
+    'can_encode', 'is_encoded', 'encode_packet', 'decode_packet',
+    # Topics
+    'TOPIC_TELEMETRY', 'TOPIC_STATS', 'TOPIC_VIDEO', 'TOPIC_DEPTH',
+    'ALL_TOPICS', 'KINECT_TOPICS', 'DEFAULT_TOPICS',
+    'PYRAMID_LEVELS', 'level_topic', 'topic_stream', 'roi_topic', 'is_roi_topic',
+    # Stream sessions
+    'STREAM_TOPICS', 'STREAM_ACK', 'STREAM_BYE',
     # Utilities
     'get_available_interfaces',
 ]
@@ -0,0 +1,372 @@
+"""
+Fixed-layout binary codec for small, frequent packets.
+
+TelemetryPacket, StatsPacket and CommandPacket (SetRegionOfInterest and
+VelocityCommand have their own layouts) are encoded with struct instead of
+pickle, so each message is a few dozen bytes and does not depend on the
+Python/numpy versions on either side.
+
+Layout:
+    byte 0: message type (MSG_TELEMETRY, MSG_COMMAND, MSG_STATS, MSG_ROI, MSG_VELOCITY)
+    byte 1: schema version
+    rest:   fields in schema order, network byte order
+
+Message type values never collide with 0x78 (first byte of a legacy zlib
+payload), so receivers can tell the formats apart by the first byte.
+Earlier schema versions stay decodable (OLDER_SCHEMAS); fields they lack
+take their default.
+"""
+import struct
+
+from .packets import (
+    CommandPacket, GoForward, GoBackward, GoLeft, GoRight,
+    TurnLeft, TurnRight, TurretLeft, TurretRight, TurretReset, RequestKeyframe,
+    SetRegionOfInterest, VelocityCommand,
+    GO_FORWARD, GO_BACKWARD, GO_LEFT, GO_RIGHT,
+    TURN_LEFT, TURN_RIGHT, TURRET_LEFT, TURRET_RIGHT, TURRET_RESET, REQUEST_KEYFRAME,
+    LegoMotor, LegoSensor, SystemStats, TelemetryPacket, StatsPacket,
+)
+
+# Message type bytes
+MSG_TELEMETRY = 0x10
+MSG_COMMAND = 0x20
+MSG_STATS = 0x30
+MSG_ROI = 0x40
+MSG_VELOCITY = 0x50
+
+# Port value used on the wire for motors/sensors without a BrickPi port
+_NO_PORT = -1
+
+# Command constant -> packet class (decoded commands keep their subclass,
+# CommandReceiver dispatches on the exact type)
+COMMAND_CLASSES = {
+    GO_FORWARD: GoForward,
+    GO_BACKWARD: GoBackward,
+    GO_LEFT: GoLeft,
+    GO_RIGHT: GoRight,
+    TURN_LEFT: TurnLeft,
+    TURN_RIGHT: TurnRight,
+    TURRET_LEFT: TurretLeft,
+    TURRET_RIGHT: TurretRight,
+    TURRET_RESET: TurretReset,
+    REQUEST_KEYFRAME: RequestKeyframe,
+}
+
+
+class Schema:
+    """
+    Versioned field layout for one message type.
+
+    Fields are (dotted attribute path, struct format[, scale]) tuples;
+    encoding reads each path from the packet, decoding returns a
+    {path: value} dict. Scaled fields are sent as fixed-point integers
+    (round(value * scale)) and divided back on decode.
+    """
+
+    def __init__(self, message_type: int, version: int, fields: tuple):
+        self.message_type = message_type
+        self.version = version
+        self.fields = tuple((field[0], field[1], field[2] if len(field) > 2 else None) for field in fields)
+        self.struct = struct.Struct('!BB' + ''.join(fmt for _, fmt, _ in self.fields))
+
+    @property
+    def size(self) -> int:
+        return self.struct.size
+
+    def pack(self, packet) -> bytes:
+        values = []
+        for path, _, scale in self.fields:
+            value = _read_field(packet, path)
+            values.append(value if scale is None else int(round(float(value) * scale)))
+        return self.struct.pack(self.message_type, self.version, *values)
+
+    def unpack(self, data) -> dict:
+        _, _, *values = self.struct.unpack_from(data)
+        return {
+            path: value if scale is None else value / scale
+            for (path, _, scale), value in zip(self.fields, values)
+        }
+
+
+def _motor_fields(name: str) -> tuple:
+    return (
+        (name + '.port', 'b'),
+        (name + '.speed', 'h'),
+        (name + '.desired_speed', 'h'),
+        (name + '.angle', 'i'),
+    )
+
+
+def _sensor_fields(name: str) -> tuple:
+    return (
+        (name + '.port', 'b'),
+        (name + '.raw', 'i'),
+    )
+
+
+# Voltage, temperature and system stats
+_SLOW_SENSOR_FIELDS = (
+    ('voltage', 'H', 1000),                         # mV
+    ('temperature', 'h', 10),                       # 0.1 °C
+    ('system_stats.cpu_percent', 'H', 10),
+    ('system_stats.ram_percent', 'H', 10),
+    ('system_stats.ram_used_mb', 'I', 10),
+    ('system_stats.ram_total_mb', 'I', 10),
+    ('system_stats.net_bytes_sent', 'Q'),
+    ('system_stats.net_bytes_recv', 'Q'),
+    ('system_stats.net_bandwidth_mbps', 'I', 100),
+)
+
+_TELEMETRY_FIELDS = (
+    ('sequence', 'I'),
+    ('time', 'd'),
+    *_motor_fields('left_motor'),
+    *_motor_fields('right_motor'),
+    *_motor_fields('turret_motor'),
+    *_sensor_fields('ultrasound_sensor'),
+    *_sensor_fields('color_sensor'),
+)
+
+# Version 2: voltage, temperature and system stats moved to STATS_SCHEMA
+TELEMETRY_SCHEMA = Schema(MSG_TELEMETRY, 2, _TELEMETRY_FIELDS)
+
+_STATS_FIELDS = (
+    ('sequence', 'I'),
+    ('time', 'd'),
+    *_SLOW_SENSOR_FIELDS,
+)
+_TICK_FIELDS = (
+    ('tick_jitter_ms', 'I', 100),                   # 0.01 ms
+    ('tick_jitter_max_ms', 'I', 100),
+    ('tick_overruns', 'I'),
+)
+
+# Version 2: control loop tick jitter and overruns
+# Version 3: coalesced motor commands
+# Version 4: expired commands and deadman stops
+STATS_SCHEMA = Schema(MSG_STATS, 4, (
+    *_STATS_FIELDS,
+    *_TICK_FIELDS,
+    ('commands_coalesced', 'I'),
+    ('commands_expired', 'I'),
+    ('deadman_stops', 'I'),
+))
+
+# Version 2: time to live (time is the send time on the server's clock)
+COMMAND_SCHEMA = Schema(MSG_COMMAND, 2, (
+    ('time', 'd'),
+    ('ttl_ms', 'H'),
+    ('command', 'B'),
+    ('value', 'h'),
+))
+
+ROI_SCHEMA = Schema(MSG_ROI, 1, (
+    ('time', 'd'),
+    ('roi_id', 'I'),
+    ('x', 'H'),
+    ('y', 'H'),
+    ('width', 'H'),
+    ('height', 'H'),
+    ('streams', 'B'),
+))
+
+# Version 2: time to live
+VELOCITY_SCHEMA = Schema(MSG_VELOCITY, 2, (
+    ('time', 'd'),
+    ('ttl_ms', 'H'),
+    ('linear', 'h', 10000),                         # 1/10000 of full speed
+    ('angular', 'h', 10000),
+    ('turret_rate', 'h', 10000),
+))
+
+# Message type -> current schema
+SCHEMAS = {schema.message_type: schema
+           for schema in (TELEMETRY_SCHEMA, COMMAND_SCHEMA, STATS_SCHEMA, ROI_SCHEMA, VELOCITY_SCHEMA)}
+
+# (message type, version) -> earlier schema, decoded but never sent
+OLDER_SCHEMAS = {(schema.message_type, schema.version): schema for schema in (
+    Schema(MSG_TELEMETRY, 1, _TELEMETRY_FIELDS + _SLOW_SENSOR_FIELDS),
+    Schema(MSG_STATS, 1, _STATS_FIELDS),
+    Schema(MSG_STATS, 2, _STATS_FIELDS + _TICK_FIELDS),
+    Schema(MSG_STATS, 3, _STATS_FIELDS + _TICK_FIELDS + (('commands_coalesced', 'I'),)),
+    Schema(MSG_COMMAND, 1, (
+        ('time', 'd'),
+        ('command', 'B'),
+        ('value', 'h'),
+    )),
+    Schema(MSG_VELOCITY, 1, (
+        ('time', 'd'),
+        ('linear', 'h', 10000),
+        ('angular', 'h', 10000),
+        ('turret_rate', 'h', 10000),
+    )),
+)}
+
+
+def _read_field(packet, path: str):
+    """Read a dotted attribute path, normalising values for struct."""
+    value = packet
+    for name in path.split('.'):
+        value = getattr(value, name)
+
+    if path.endswith('.port'):
+        return _NO_PORT if value is None else value
+    return value
+
+
+def _schema_for(packet) -> Schema:
+    if isinstance(packet, TelemetryPacket):
+        return TELEMETRY_SCHEMA
+    if isinstance(packet, StatsPacket):
+        return STATS_SCHEMA
+    if isinstance(packet, SetRegionOfInterest):
+        return ROI_SCHEMA
+    if isinstance(packet, VelocityCommand):
+        return VELOCITY_SCHEMA
+    if isinstance(packet, CommandPacket):
+        return COMMAND_SCHEMA
+    return None
+
+
+def can_encode(packet) -> bool:
+    """True if the packet type has a binary schema."""
+    return _schema_for(packet) is not None
+
+
+def is_encoded(data) -> bool:
+    """True if data starts with a known binary message type byte."""
+    return len(data) > 0 and data[0] in SCHEMAS
+
+
+def encode_packet(packet) -> bytes:
+    """
+    Encode a TelemetryPacket, StatsPacket or CommandPacket to bytes.
+
+    Args:
+        packet: Packet with a binary schema (see can_encode())
+
+    Returns:
+        Encoded message (type byte, version byte, fields)
+    """
+    schema = _schema_for(packet)
+    if schema is None:
+        raise TypeError("No binary schema for {}".format(packet.__class__.__name__))
+    return schema.pack(packet)
+
+
+def decode_packet(data):
+    """
+    Decode bytes produced by encode_packet() back into packet classes.
+
+    Args:
+        data: Encoded message (bytes or buffer)
+
+    Returns:
+        TelemetryPacket, StatsPacket or CommandPacket subclass instance
+        (SetRegionOfInterest for MSG_ROI, VelocityCommand for MSG_VELOCITY)
+
+    Raises:
+        ValueError: Unknown message type, or a schema version newer than
+            this side's
+    """
+    message_type, version = data[0], data[1]
+    schema = SCHEMAS.get(message_type)
+    if schema is None:
+        raise ValueError("Unknown message type: {:#x}".format(message_type))
+    if version != schema.version:
+        schema = OLDER_SCHEMAS.get((message_type, version))
+        if schema is None:
+            raise ValueError("Unsupported schema version {} for message type {:#x}".format(
+                version, message_type))
+
+    fields = schema.unpack(data)
+    if message_type == MSG_TELEMETRY:
+        return _build_telemetry(fields)
+    if message_type == MSG_STATS:
+        return _build_stats(fields)
+    if message_type == MSG_ROI:
+        return _build_roi(fields)
+    if message_type == MSG_VELOCITY:
+        return _build_velocity(fields)
+    return _build_command(fields)
+
+
+def _port(value: int):
+    return None if value == _NO_PORT else value
+
+
+def _build_motor(fields: dict, name: str) -> LegoMotor:
+    return LegoMotor(
+        port=_port(fields[name + '.port']),
+        speed=fields[name + '.speed'],
+        desired_speed=fields[name + '.desired_speed'],
+        angle=fields[name + '.angle'])
+
+
+def _build_sensor(fields: dict, name: str) -> LegoSensor:
+    sensor = LegoSensor(port=_port(fields[name + '.port']))
+    sensor.raw = fields[name + '.raw']
+    return sensor
+
+
+def _build_system_stats(fields: dict) -> SystemStats:
+    stats = SystemStats()
+    for path, value in fields.items():
+        if path.startswith('system_stats.'):
+            setattr(stats, path.split('.', 1)[1], value)
+    return stats
+
+
+def _build_telemetry(fields: dict) -> TelemetryPacket:
+    packet = TelemetryPacket(
+        fields['sequence'],
+        left_motor=_build_motor(fields, 'left_motor'),
+        right_motor=_build_motor(fields, 'right_motor'),
+        turret_motor=_build_motor(fields, 'turret_motor'),
+        ultrasound_sensor=_build_sensor(fields, 'ultrasound_sensor'),
+        color_sensor=_build_sensor(fields, 'color_sensor'),
+        timestamp=fields['time'])
+    # Version 1 carried the slow sensors in every packet
+    if 'voltage' in fields:
+        packet.voltage = fields['voltage']
+        packet.temperature = fields['temperature']
+        packet.system_stats = _build_system_stats(fields)
+    return packet
+
+
+def _build_stats(fields: dict) -> StatsPacket:
+    return StatsPacket(
+        fields['sequence'],
+        voltage=fields['voltage'],
+        temperature=fields['temperature'],
+        system_stats=_build_system_stats(fields),
+        timestamp=fields['time'],
+        tick_jitter_ms=fields.get('tick_jitter_ms', 0.0),
+        tick_jitter_max_ms=fields.get('tick_jitter_max_ms', 0.0),
+        tick_overruns=fields.get('tick_overruns', 0),
+        commands_coalesced=fields.get('commands_coalesced', 0),
+        commands_expired=fields.get('commands_expired', 0),
+        deadman_stops=fields.get('deadman_stops', 0))
+
+
+def _build_command(fields: dict) -> CommandPacket:
+    command = fields['command']
+    cls = COMMAND_CLASSES.get(command, CommandPacket)
+    # Bypass subclass constructors (TurretReset takes no value) but keep the type
+    packet = cls.__new__(cls)
+    CommandPacket.__init__(packet, command, fields['value'])
+    # Version 1 has no time to live: the command never expires
+    packet.stamp(fields['time'], fields.get('ttl_ms', 0))
+    return packet
+
+
+def _build_roi(fields: dict) -> SetRegionOfInterest:
+    return SetRegionOfInterest(
+        fields['roi_id'], fields['x'], fields['y'], fields['width'], fields['height'],
+        fields['streams'], timestamp=fields['time'])
+
+
+def _build_velocity(fields: dict) -> VelocityCommand:
+    packet = VelocityCommand(fields['linear'], fields['angular'], fields['turret_rate'])
+    packet.stamp(fields['time'], fields.get('ttl_ms', 0))
+    return packet
@@ -18,9 +18,9 @@ import time
 class Packet:
     """Base packet class with sequence number and timestamp."""
 
-    def __init__(self, sequence: int):
+    def __init__(self, sequence: int, timestamp: float = None):
         self._sequence = sequence
-        self._time = time.time()
+        self._time = time.time() if timestamp is None else timestamp
 
     @property
     def sequence(self) -> int:
@@ -38,6 +38,10 @@ class Packet:
 CLIENT = 1
 SERVER = 2
 
+# Reply to a request that is not a valid heartbeat (REQ clients need a
+# reply before they can send again)
+HEARTBEAT_REJECTED = b''
+
 
 class HeartbeatPacket(Packet):
     """Base heartbeat packet for connection keepalive."""
@@ -72,17 +76,49 @@ class HeartbeatPacket(Packet):
 class HeartbeatRequest(HeartbeatPacket):
     """Client heartbeat request (formerly HelloClientPacket)."""
 
-    def __init__(self, sequence: int, running: bool, network: dict, sleep: float):
+    def __init__(self, sequence: int, running: bool, network: dict, sleep: float,
+                 session: int = 0, rtt_ms: float = 0.0, capabilities: dict = None):
         HeartbeatPacket.__init__(
             self, sequence, role=CLIENT, running=running, network=network, sleep=sleep)
+        self._session = session
+        self._rtt_ms = rtt_ms
+        self._capabilities = capabilities
+
+    @property
+    def session(self) -> int:
+        """Client session id, the same for every heartbeat of a connection (0 = none)."""
+        return getattr(self, '_session', 0)
+
+    @property
+    def rtt_ms(self) -> float:
+        """Round trip of the previous heartbeat as measured by the client (milliseconds, 0 = none yet)."""
+        return getattr(self, '_rtt_ms', 0.0)
+
+    @property
+    def capabilities(self) -> dict:
+        """Features the client supports (see HandshakeServer), empty for older clients."""
+        return getattr(self, '_capabilities', None) or {}
 
 
 class HeartbeatResponse(HeartbeatPacket):
     """Server heartbeat response (formerly HelloServerPacket)."""
 
-    def __init__(self, sequence: int, running: bool, network: dict, sleep: float):
+    def __init__(self, sequence: int, running: bool, network: dict, sleep: float,
+                 capabilities: dict = None, clients: int = 0):
         HeartbeatPacket.__init__(
             self, sequence=sequence, role=SERVER, running=running, network=network, sleep=sleep)
+        self._capabilities = capabilities
+        self._clients = clients
+
+    @property
+    def capabilities(self) -> dict:
+        """Features both sides support, as negotiated by the server."""
+        return getattr(self, '_capabilities', None) or {}
+
+    @property
+    def clients(self) -> int:
+        """Clients connected to the server, this one included."""
+        return getattr(self, '_clients', 0)
 
 
 # =============================================================================
@@ -99,13 +135,23 @@ TURN_RIGHT = 6
 TURRET_RIGHT = 7
 TURRET_LEFT = 8
 TURRET_RESET = 9
+REQUEST_KEYFRAME = 10
+SET_ROI = 11
+SET_VELOCITY = 12
+
+# SetRegionOfInterest stream flags
+ROI_VIDEO = 0x1
+ROI_DEPTH = 0x2
+
+# Longest command time to live (16 bits on the wire)
+MAX_TTL_MS = 0xFFFF
 
 
 class CommandPacket(Packet):
     """Base command packet for robot control."""
 
-    def __init__(self, command: int, value: int):
-        Packet.__init__(self, 0)
+    def __init__(self, command: int, value: int, timestamp: float = None):
+        Packet.__init__(self, 0, timestamp)
         self._command = command
         self._value = value
 
@@ -117,6 +163,23 @@ class CommandPacket(Packet):
     def value(self) -> int:
         return self._value
 
+    @property
+    def ttl_ms(self) -> int:
+        """Milliseconds after `time` (server clock) the server discards the command (0 = never)."""
+        return getattr(self, '_ttl_ms', 0)
+
+    def stamp(self, timestamp: float, ttl_ms: int):
+        """
+        Set the send time and time to live, just before sending.
+
+        Args:
+            timestamp: Send time on the server's clock (time.time() there)
+            ttl_ms: Milliseconds the command stays valid (0 = never expires),
+                clamped to MAX_TTL_MS
+        """
+        self._time = timestamp
+        self._ttl_ms = max(0, min(int(ttl_ms), MAX_TTL_MS))
+
     def __repr__(self):
         return repr("command: {}, value: {}".format(self._command, self._value))
 
@@ -175,6 +238,106 @@ class TurretReset(CommandPacket):
         CommandPacket.__init__(self, TURRET_RESET, 0)
 
 
+class RequestKeyframe(CommandPacket):
+    """Ask the server for a Kinect keyframe (temporal decoder lost its reference)."""
+    def __init__(self):
+        CommandPacket.__init__(self, REQUEST_KEYFRAME, 0)
+
+
+class SetRegionOfInterest(CommandPacket):
+    """
+    Ask the server for full-resolution crops of the Kinect streams.
+
+    The crops are published under roi_topic(stream, roi_id) while the
+    client keeps re-sending the request (see Config.ROI_TIMEOUT). A zero
+    width or height clears the region.
+
+    Args:
+        roi_id: Client-chosen id, part of the crop topics
+        x, y: Top-left corner in full-resolution pixels
+        width, height: Size in full-resolution pixels (0 = clear)
+        streams: ROI_VIDEO and/or ROI_DEPTH
+    """
+    def __init__(self, roi_id: int, x: int, y: int, width: int, height: int,
+                 streams: int = ROI_VIDEO | ROI_DEPTH, timestamp: float = None):
+        CommandPacket.__init__(self, SET_ROI, 0, timestamp)
+        self._roi_id = roi_id
+        self._x = x
+        self._y = y
+        self._width = width
+        self._height = height
+        self._streams = streams
+
+    @property
+    def roi_id(self) -> int:
+        return self._roi_id
+
+    @property
+    def x(self) -> int:
+        return self._x
+
+    @property
+    def y(self) -> int:
+        return self._y
+
+    @property
+    def width(self) -> int:
+        return self._width
+
+    @property
+    def height(self) -> int:
+        return self._height
+
+    @property
+    def streams(self) -> int:
+        return self._streams
+
+    def __repr__(self):
+        return repr("roi {:08x}: {}x{} at ({}, {}), streams {}".format(
+            self._roi_id, self._width, self._height, self._x, self._y, self._streams))
+
+
+class VelocityCommand(CommandPacket):
+    """
+    Drive the robot by velocity (a twist), streamed while the operator drives.
+
+    All rates are fractions of full speed; the server mixes them into
+    track speeds (see app/server/differential_mixer.py).
+
+    Args:
+        linear: Forward (+) / backward (-) speed, -1 to 1
+        angular: Turn rate, -1 to 1 (+ turns the way TurnLeft does)
+        turret_rate: Turret rate, -1 to 1 (+ turns the way TurretLeft does)
+    """
+    def __init__(self, linear: float = 0.0, angular: float = 0.0, turret_rate: float = 0.0,
+                 timestamp: float = None):
+        CommandPacket.__init__(self, SET_VELOCITY, 0, timestamp)
+        self._linear = _unit(linear)
+        self._angular = _unit(angular)
+        self._turret_rate = _unit(turret_rate)
+
+    @property
+    def linear(self) -> float:
+        return self._linear
+
+    @property
+    def angular(self) -> float:
+        return self._angular
+
+    @property
+    def turret_rate(self) -> float:
+        return self._turret_rate
+
+    def __repr__(self):
+        return repr("velocity: linear {:.2f}, angular {:.2f}, turret {:.2f}".format(
+            self._linear, self._angular, self._turret_rate))
+
+
+def _unit(value: float) -> float:
+    """Clamp a rate to -1..1."""
+    return max(-1.0, min(1.0, float(value)))
+
+
 # =============================================================================
 # Telemetry Data Classes
 # =============================================================================
@@ -319,8 +482,9 @@ class TelemetryPacket(Packet):
             right_motor: LegoMotor = None,
             turret_motor: LegoMotor = None,
             ultrasound_sensor: LegoSensor = None,
-            color_sensor: LegoSensor = None):
-        Packet.__init__(self, sequence)
+            color_sensor: LegoSensor = None,
+            timestamp: float = None):
+        Packet.__init__(self, sequence, timestamp)
         self._left_motor = left_motor or LegoMotor()
         self._right_motor = right_motor or LegoMotor()
         self._turret_motor = turret_motor or LegoMotor()
@@ -395,30 +559,180 @@ class TelemetryPacket(Packet):
         self._system_stats = stats
 
 
+class StatsPacket(Packet):
+    """Slow-changing robot state (battery, temperature, system stats), sent ~1 Hz."""
+
+    def __init__(
+            self,
+            sequence: int,
+            voltage: float = 0,
+            temperature: float = 0,
+            system_stats: SystemStats = None,
+            timestamp: float = None,
+            tick_jitter_ms: float = 0.0,
+            tick_jitter_max_ms: float = 0.0,
+            tick_overruns: int = 0,
+            commands_coalesced: int = 0,
+            commands_expired: int = 0,
+            deadman_stops: int = 0):
+        Packet.__init__(self, sequence, timestamp)
+        self._voltage = voltage
+        self._temperature = temperature
+        self._system_stats = system_stats or SystemStats()
+        self._tick_jitter_ms = tick_jitter_ms
+        self._tick_jitter_max_ms = tick_jitter_max_ms
+        self._tick_overruns = tick_overruns
+        self._commands_coalesced = commands_coalesced
+        self._commands_expired = commands_expired
+        self._deadman_stops = deadman_stops
+
+    @property
+    def voltage(self) -> float:
+        return self._voltage
+
+    @voltage.setter
+    def voltage(self, voltage: float):
+        self._voltage = voltage
+
+    @property
+    def temperature(self) -> float:
+        return self._temperature
+
+    @temperature.setter
+    def temperature(self, temperature: float):
+        self._temperature = temperature
+
+    @property
+    def system_stats(self) -> SystemStats:
+        return self._system_stats
+
+    @system_stats.setter
+    def system_stats(self, stats: SystemStats):
+        self._system_stats = stats
+
+    @property
+    def tick_jitter_ms(self) -> float:
+        """Mean lateness of the BrickPi control loop ticks since the last StatsPacket."""
+        return getattr(self, '_tick_jitter_ms', 0.0)
+
+    @property
+    def tick_jitter_max_ms(self) -> float:
+        """Largest control loop tick lateness since the last StatsPacket."""
+        return getattr(self, '_tick_jitter_max_ms', 0.0)
+
+    @property
+    def tick_overruns(self) -> int:
+        """Control loop ticks that ran past the next deadline, since the server started."""
+        return getattr(self, '_tick_overruns', 0)
+
+    @property
+    def commands_coalesced(self) -> int:
+        """Motor commands replaced by a newer one before the control loop applied them, since start."""
+        return getattr(self, '_commands_coalesced', 0)
+
+    @property
+    def commands_expired(self) -> int:
+        """Commands discarded because they arrived after their TTL, since start."""
+        return getattr(self, '_commands_expired', 0)
+
+    @property
+    def deadman_stops(self) -> int:
+        """Moving actuators stopped by the deadman (no command for DEADMAN_MS), since start."""
+        return getattr(self, '_deadman_stops', 0)
+
+
 # =============================================================================
 # Kinect Packet
 # =============================================================================
 
+# Video frame formats
+VIDEO_RGB = 'rgb'        # (H, W, 3) uint8 RGB888
+VIDEO_BAYER = 'bayer'    # (H, W) uint8 GRBG Bayer mosaic (debayered by the client)
+
+# Depth units
+DEPTH_RAW = 'raw'                  # 11-bit disparity (0-2047, 2047 = invalid)
+DEPTH_MM = 'mm'                    # millimetres, depth camera view (0 = invalid)
+DEPTH_REGISTERED = 'registered'    # millimetres, aligned to the RGB camera (0 = invalid)
+
+
 class KinectPacket(Packet):
     """Video and depth data from Kinect sensor."""
 
-    def __init__(self, sequence: int, video_frame, depth, tilt_state, tilt_degs):
-        Packet.__init__(self, sequence)
+    def __init__(self, sequence: int, video_frame, depth, tilt_state, tilt_degs, timestamp: float = None,
+                 video_format: str = VIDEO_RGB, depth_format: str = DEPTH_RAW, level: int = 1,
+                 roi: tuple = None, capture_fps: float = 0.0, skipped_frames: int = 0,
+                 encode_ms: float = 0.0, video_timestamp: int = 0, depth_timestamp: int = 0):
+        Packet.__init__(self, sequence, timestamp)
         self._video_frame = video_frame
         self._depth = depth
         self._tilt_state = tilt_state
         self._tilt_degs = tilt_degs
+        self._video_format = video_format
+        self._depth_format = depth_format
+        self._level = level
+        self._roi = roi
+        self._capture_fps = capture_fps
+        self._skipped_frames = skipped_frames
+        self._encode_ms = encode_ms
+        self._video_timestamp = video_timestamp
+        self._depth_timestamp = depth_timestamp
 
     @property
     def video_frame(self):
-        """RGB video frame from Kinect."""
+        """Video frame from Kinect, layout given by video_format."""
         return self._video_frame
 
+    @property
+    def video_format(self) -> str:
+        """VIDEO_RGB or VIDEO_BAYER."""
+        # Packets pickled by older servers have no format attribute
+        return getattr(self, '_video_format', VIDEO_RGB)
+
     @property
     def depth(self):
-        """Depth array from Kinect."""
+        """Depth array from Kinect, units given by depth_format."""
         return self._depth
 
+    @property
+    def depth_format(self) -> str:
+        """DEPTH_RAW, DEPTH_MM or DEPTH_REGISTERED."""
+        return getattr(self, '_depth_format', DEPTH_RAW)
+
+    @property
+    def level(self) -> int:
+        """Pyramid level (downscale factor) of the frames, 1 = full resolution."""
+        return getattr(self, '_level', 1)
+
+    @property
+    def roi(self) -> tuple:
+        """(x, y) full-resolution origin of a region-of-interest crop, None for whole frames."""
+        return getattr(self, '_roi', None)
+
+    @property
+    def capture_fps(self) -> float:
+        """Rate the server captures this stream at (frames per second)."""
+        return getattr(self, '_capture_fps', 0.0)
+
+    @property
+    def skipped_frames(self) -> int:
+        """Captures of this stream the server skipped for backpressure since start."""
+        return getattr(self, '_skipped_frames', 0)
+
+    @property
+    def encode_ms(self) -> float:
+        """Server time to scale and encode one capture of this stream (milliseconds)."""
+        return getattr(self, '_encode_ms', 0.0)
+
+    @property
+    def video_timestamp(self) -> int:
+        """Kinect device timestamp of the video frame of this capture (0 = unknown)."""
+        return getattr(self, '_video_timestamp', 0)
+
+    @property
+    def depth_timestamp(self) -> int:
+        """Kinect device timestamp of the depth frame of this capture (0 = unknown)."""
+        return getattr(self, '_depth_timestamp', 0)
+
     @property
     def tilt_state(self):
         """Current tilt motor state."""
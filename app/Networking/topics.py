@@ -0,0 +1,93 @@
+"""
+Topics on the telemetry PUB socket.
+
+Every published message is multipart with its topic as the first frame.
+Clients subscribe only to the topics they display, and the server
+(an XPUB socket) tracks the subscriptions so the Kinect process can stop
+capturing streams nobody receives.
+
+Kinect streams are published at several pyramid levels (downscale
+factors). Their topics carry the level, e.g. b'video/1' (640x480) or
+b'depth/4' (160x120); no level topic is a prefix of another, so a client
+receives exactly the levels it subscribes to.
+
+Region-of-interest crops (SetRegionOfInterest) are published per client
+under b'roi/<stream>/<roi id>', e.g. b'roi/video/0000beef'.
+
+A client can receive the same topics through a stream session instead
+(app/server/stream_sessions.py); the STREAM_* values are the commands it
+sends on its DEALER socket.
+"""
+TOPIC_TELEMETRY = b'telemetry'   # TelemetryPacket, every BrickPi cycle
+TOPIC_STATS = b'stats'           # StatsPacket, ~1 Hz
+TOPIC_VIDEO = b'video'           # KinectPacket with only the video frame
+TOPIC_DEPTH = b'depth'           # KinectPacket with only the depth frame
+
+# Pyramid levels as downscale factors (1 = full resolution)
+PYRAMID_LEVELS = (1, 2, 4)
+
+_ROI_PREFIX = b'roi/'
+
+
+def level_topic(stream: bytes, level: int = 1) -> bytes:
+    """
+    Topic of a Kinect stream at a pyramid level.
+
+    Args:
+        stream: TOPIC_VIDEO or TOPIC_DEPTH
+        level: Downscale factor from PYRAMID_LEVELS
+
+    Returns:
+        Topic bytes, e.g. b'depth/2'
+    """
+    return stream + b'/%d' % level
+
+
+def roi_topic(stream: bytes, roi_id: int) -> bytes:
+    """
+    Topic of a client's region-of-interest crops of a Kinect stream.
+
+    Args:
+        stream: TOPIC_VIDEO or TOPIC_DEPTH
+        roi_id: SetRegionOfInterest.roi_id
+
+    Returns:
+        Topic bytes, e.g. b'roi/depth/0000beef'
+    """
+    return _ROI_PREFIX + stream + b'/%08x' % roi_id
+
+
+def is_roi_topic(topic: bytes) -> bool:
+    """True for a topic made by roi_topic()."""
+    return bytes(topic).startswith(_ROI_PREFIX)
+
+
+def topic_stream(topic: bytes) -> tuple:
+    """
+    Split a Kinect level topic into (stream, level).
+
+    Topics without a level (telemetry, stats) return level 1, as do
+    region-of-interest topics (crops are full resolution).
+    """
+    topic = bytes(topic)
+    if is_roi_topic(topic):
+        return topic[len(_ROI_PREFIX):].partition(b'/')[0], 1
+    stream, _, level = topic.partition(b'/')
+    return stream, int(level) if level else 1
+
+
+# Kinect topics, one per stream and level
+KINECT_TOPICS = tuple(level_topic(stream, level)
+                      for stream in (TOPIC_VIDEO, TOPIC_DEPTH)
+                      for level in PYRAMID_LEVELS)
+
+ALL_TOPICS = (TOPIC_TELEMETRY, TOPIC_STATS) + KINECT_TOPICS
+
+# Subscriptions of a client that displays everything at full resolution
+DEFAULT_TOPICS = (TOPIC_TELEMETRY, TOPIC_STATS,
+                  level_topic(TOPIC_VIDEO), level_topic(TOPIC_DEPTH))
+
+# Stream session commands (client -> server)
+STREAM_TOPICS = b'TOPICS'   # [STREAM_TOPICS, topic, ...]: the full set of topics to receive
+STREAM_ACK = b'ACK'         # [STREAM_ACK, consumed, window]: messages consumed and allowed in flight
+STREAM_BYE = b'BYE'         # [STREAM_BYE]: close the session
@@ -1,15 +1,19 @@
 """
 CommandClient - Sends commands to the robot.
 
-Connects to the robot's CommandReceiver via ZMQ PUSH socket.
+Connects to the robot's CommandReceiver via ZMQ PUSH socket. Every command
+is stamped with its send time on the robot's clock and COMMAND_TTL_MS, so
+the robot discards commands that spent too long in this socket's queue
+(e.g. during a Wi-Fi dropout).
 """
 import logging
+import time
 
 import zmq
 from PyQt5 import QtCore
 
 from app.common.config import Config
-from app.common.serialization import compress
+from app.common.serialization import encode
 from app.networking import CommandPacket
 
 
@@ -19,9 +23,17 @@ class CommandClient(QtCore.QThread):
 
     Connects to the robot's CommandReceiver (PULL socket).
     This is the inverse of the old design where the robot connected to the client.
+
+    Args:
+        robot_ip: Robot address
+        port: Command port (defaults to COMMAND_PORT)
+        parent: Qt parent
+        clock_offset: clock_offset() returning the robot clock minus this
+            client's clock (seconds), or None while unknown; commands sent
+            before it is known carry no time to live
     """
 
-    def __init__(self, robot_ip: str, port: int = None, parent=None):
+    def __init__(self, robot_ip: str, port: int = None, parent=None, clock_offset=None):
         if port is None:
             port = Config.COMMAND_PORT
         QtCore.QThread.__init__(self, parent)
@@ -29,6 +41,7 @@ class CommandClient(QtCore.QThread):
         self._running = True
         self._robot_ip = robot_ip
         self._port = port
+        self._clock_offset = clock_offset
         self._context = zmq.Context()
         self._sender = self._context.socket(zmq.PUSH)
 
@@ -38,9 +51,12 @@ class CommandClient(QtCore.QThread):
         self._logger.info("CommandClient connected to {}".format(address))
 
     def on_command_packet(self, packet: CommandPacket):
-        """Send a command packet to the robot."""
+        """Send a command packet to the robot, stamped with its send time and time to live."""
         try:
-            self._sender.send(compress(packet))
+            offset = self._clock_offset() if self._clock_offset is not None else None
+            if offset is not None:
+                packet.stamp(time.time() + offset, Config.COMMAND_TTL_MS)
+            self._sender.send(encode(packet))
         except Exception as e:
             self._logger.exception(e)
 
@@ -6,13 +6,18 @@ Provides:
 - Clean connect/disconnect support
 - Signals for UI binding
 - Centralized error handling
+- Region-of-interest requests, refreshed while set
 """
 import logging
+import random
 from enum import Enum
 
-from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
 
 from app.common.config import Config
+from app.networking import (
+    RequestKeyframe, SetRegionOfInterest, DEFAULT_TOPICS, TOPIC_VIDEO, TOPIC_DEPTH, roi_topic
+)
 
 
 class ConnectionState(Enum):
@@ -31,6 +36,7 @@ class ConnectionManager(QObject):
         state_changed: Emitted when connection state changes
         error_occurred: Emitted when an error occurs (with message)
         telemetry_received: Forwarded from TelemetryClient
+        stats_received: Forwarded from TelemetryClient
         kinect_received: Forwarded from TelemetryClient
     """
 
@@ -40,6 +46,7 @@ class ConnectionManager(QObject):
 
     # Data signals (forwarded from clients)
     telemetry_received = pyqtSignal(object)  # TelemetryPacket
+    stats_received = pyqtSignal(object)      # StatsPacket
     kinect_received = pyqtSignal(object)     # KinectPacket
 
     def __init__(self, parent=None):
@@ -52,6 +59,16 @@ class ConnectionManager(QObject):
         self._telemetry_client = None
         self._command_client = None
 
+        # Topics the GUI currently displays (kept across reconnects)
+        self._topics = frozenset(DEFAULT_TOPICS)
+
+        # Region of interest (x, y, width, height) in full-resolution pixels,
+        # resent periodically because the robot expires stale regions
+        self._roi = None
+        self._roi_id = random.getrandbits(32)
+        self._roi_timer = QTimer(self)
+        self._roi_timer.timeout.connect(self._send_roi)
+
     @property
     def state(self) -> ConnectionState:
         """Current connection state."""
@@ -100,17 +117,24 @@ class ConnectionManager(QObject):
             # Start telemetry client
             self._telemetry_client = TelemetryClient()
             self._telemetry_client.set_robot_ip_address(robot_ip)
+            self._telemetry_client.set_topics(self._subscribed_topics())
             self._telemetry_client.telemetry_packet_signal.connect(self._on_telemetry)
-            self._telemetry_client.kinect_packet_signal.connect(self._on_kinect)
+            self._telemetry_client.stats_packet_signal.connect(self._on_stats)
+            self._telemetry_client.kinect_ready_signal.connect(self._on_kinect_ready)
             self._telemetry_client.connection_timeout_signal.connect(self._on_connection_timeout)
+            self._telemetry_client.keyframe_request_signal.connect(self._on_keyframe_request)
             self._telemetry_client.start()
 
             # Start command client
-            self._command_client = CommandClient(robot_ip=robot_ip)
+            # Commands are stamped on the robot's clock, as measured by the heartbeats
+            telemetry_client = self._telemetry_client
+            self._command_client = CommandClient(
+                robot_ip=robot_ip, clock_offset=lambda: telemetry_client.clock_offset)
             self._command_client.start()
 
             self._set_state(ConnectionState.CONNECTED)
             self._logger.info(f"Connected to robot at {robot_ip}")
+            self._send_roi()
 
         except Exception as e:
             self._logger.exception(f"Failed to connect: {e}")
@@ -151,9 +175,15 @@ class ConnectionManager(QObject):
         """Forward telemetry packet."""
         self.telemetry_received.emit(packet)
 
-    def _on_kinect(self, packet):
-        """Forward kinect packet."""
-        self.kinect_received.emit(packet)
+    def _on_stats(self, packet):
+        """Forward stats packet."""
+        self.stats_received.emit(packet)
+
+    def _on_kinect_ready(self):
+        """Forward the newest kinect packets (older ones were superseded)."""
+        if self._telemetry_client:
+            for packet in self._telemetry_client.take_kinect_packets():
+                self.kinect_received.emit(packet)
 
     def _on_connection_timeout(self):
         """Handle connection timeout from telemetry client."""
@@ -162,6 +192,59 @@ class ConnectionManager(QObject):
             self._set_state(ConnectionState.ERROR)
             self.error_occurred.emit("Connection timeout - robot may be offline")
 
+    def _on_keyframe_request(self):
+        """Ask the robot for a keyframe after Kinect frame loss."""
+        if self._command_client:
+            self._command_client.on_command_packet(RequestKeyframe())
+
+    def set_topics(self, topics):
+        """
+        Select the telemetry topics to receive.
+
+        Args:
+            topics: Iterable of TOPIC_* values the GUI displays
+        """
+        self._topics = frozenset(topics)
+        if self._telemetry_client:
+            self._telemetry_client.set_topics(self._subscribed_topics())
+
+    def set_roi(self, roi):
+        """
+        Request full-resolution crops of a region of the Kinect streams.
+
+        The crops arrive as KinectPackets with a roi origin, next to the
+        pyramid levels selected with set_topics().
+
+        Args:
+            roi: (x, y, width, height) in 640x480 pixels, or None to stop
+        """
+        roi = tuple(int(value) for value in roi) if roi else None
+        if roi == self._roi:
+            return
+        clear = self._roi is not None and roi is None
+        self._roi = roi
+        if self._telemetry_client:
+            self._telemetry_client.set_topics(self._subscribed_topics())
+        if clear and self.is_connected and self._command_client:
+            # Release the region now instead of waiting for it to expire
+            self._command_client.on_command_packet(SetRegionOfInterest(self._roi_id, 0, 0, 0, 0))
+        self._send_roi()
+
+    def _subscribed_topics(self) -> frozenset:
+        """Topics selected with set_topics() plus the region-of-interest crops."""
+        if self._roi is None:
+            return self._topics
+        return self._topics | {roi_topic(TOPIC_VIDEO, self._roi_id), roi_topic(TOPIC_DEPTH, self._roi_id)}
+
+    def _send_roi(self):
+        """Send (or refresh) the region of interest, stop refreshing once cleared."""
+        if self._roi is None or not self.is_connected or not self._command_client:
+            self._roi_timer.stop()
+            return
+        self._command_client.on_command_packet(SetRegionOfInterest(self._roi_id, *self._roi))
+        if not self._roi_timer.isActive():
+            self._roi_timer.start(int(Config.ROI_REFRESH_INTERVAL * 1000))
+
     def send_command(self, command):
         """
         Send a command to the robot.
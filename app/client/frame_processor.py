@@ -8,12 +8,20 @@ Separates image processing from GUI code for:
 
 Note on Kinect depth:
     Raw Kinect v1 depth values are DISPARITY (inversely proportional to distance),
-    NOT metric distance. Use raw_depth_to_meters() for conversion.
+    NOT metric distance. Use raw_depth_to_meters() for conversion. Servers
+    running KINECT_DEPTH_MODE=mm/registered send millimetres instead
+    (KinectPacket.depth_format); depth_to_meters() handles every format.
 """
 import numpy as np
 from PyQt5.QtGui import QImage
 
 from app.common.config import Config
+from app.networking import VIDEO_BAYER, DEPTH_RAW, DEPTH_REGISTERED
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
 
 
 # =============================================================================
@@ -68,6 +76,73 @@ def raw_depth_to_meters(raw_depth: np.ndarray) -> np.ndarray:
     return distance_m
 
 
+def depth_to_meters(depth: np.ndarray, depth_format: str = DEPTH_RAW) -> np.ndarray:
+    """
+    Convert depth in any KinectPacket.depth_format to meters.
+
+    Millimetre depth (DEPTH_MM, DEPTH_REGISTERED) only needs a scale;
+    raw disparity goes through raw_depth_to_meters().
+
+    Args:
+        depth: Depth array as received
+        depth_format: KinectPacket.depth_format
+
+    Returns:
+        Distance in meters. Invalid pixels return np.nan.
+    """
+    if depth_format == DEPTH_RAW:
+        return raw_depth_to_meters(depth)
+
+    distance_m = depth.astype(np.float32)
+    distance_m *= 0.001
+    # libfreenect reports 0 for pixels without a depth reading
+    distance_m[depth == 0] = np.nan
+    return distance_m
+
+
+def debayer(mosaic: np.ndarray) -> np.ndarray:
+    """
+    Demosaic a Kinect Bayer frame to RGB with bilinear interpolation.
+
+    The Kinect sensor uses a GRBG layout (G R / B G). OpenCV is used when
+    installed; otherwise each missing colour is the mean of its two or four
+    nearest same-colour neighbours, computed with whole-array slicing.
+
+    Args:
+        mosaic: (H, W) uint8 Bayer frame, H and W even
+
+    Returns:
+        (H, W, 3) uint8 RGB array
+    """
+    if cv2 is not None:
+        # OpenCV names the pattern by the second row, so GRBG is "BayerGB"
+        return cv2.cvtColor(mosaic, cv2.COLOR_BayerGB2RGB)
+
+    height, width = mosaic.shape
+    # Reflection keeps the colour pattern at the borders
+    padded = np.pad(mosaic.astype(np.uint16), 1, mode='reflect')
+    centre = padded[1:-1, 1:-1]
+    horizontal = padded[1:-1, :-2] + padded[1:-1, 2:]
+    vertical = padded[:-2, 1:-1] + padded[2:, 1:-1]
+    cross = horizontal + vertical
+    diagonal = padded[:-2, :-2] + padded[:-2, 2:] + padded[2:, :-2] + padded[2:, 2:]
+
+    rgb = np.empty((height, width, 3), dtype=np.uint8)
+    red, green, blue = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    sites = {
+        # (row, col) parity: green on red rows, red, blue, green on blue rows
+        (0, 0): (horizontal // 2, centre, vertical // 2),
+        (0, 1): (centre, cross // 4, diagonal // 4),
+        (1, 0): (diagonal // 4, cross // 4, centre),
+        (1, 1): (vertical // 2, centre, horizontal // 2),
+    }
+    for (row, col), (r, g, b) in sites.items():
+        red[row::2, col::2] = r[row::2, col::2]
+        green[row::2, col::2] = g[row::2, col::2]
+        blue[row::2, col::2] = b[row::2, col::2]
+    return rgb
+
+
 def get_valid_depth_mask(raw_depth: np.ndarray) -> np.ndarray:
     """
     Get mask of valid depth pixels.
@@ -88,6 +163,57 @@ class FrameProcessor:
     All methods are static for easy use without instantiation.
     """
 
+    @staticmethod
+    def video_to_rgb(video_frame: np.ndarray, video_format: str) -> np.ndarray:
+        """
+        Convert a received video frame to RGB888.
+
+        Args:
+            video_frame: Frame as sent by the robot
+            video_format: KinectPacket.video_format (VIDEO_RGB or VIDEO_BAYER)
+
+        Returns:
+            numpy array of shape (H, W, 3) in RGB format
+        """
+        if video_format == VIDEO_BAYER:
+            return debayer(video_frame)
+        return video_frame
+
+    @staticmethod
+    def composite_roi(
+        base: np.ndarray,
+        crop: np.ndarray,
+        origin: tuple,
+        level: int = 1,
+        full_shape: tuple = (480, 640)
+    ) -> np.ndarray:
+        """
+        Paste a full-resolution region-of-interest crop over a context frame.
+
+        Args:
+            base: Context frame at a pyramid level, or None for a blank frame
+            crop: Crop from a KinectPacket with a roi origin (same dtype and
+                channels as base)
+            origin: KinectPacket.roi (x, y) of the crop
+            level: Pyramid level of base
+            full_shape: (H, W) of the full-resolution frame
+
+        Returns:
+            Full-resolution frame (a new array)
+        """
+        if base is None:
+            frame = np.zeros(tuple(full_shape) + crop.shape[2:], dtype=crop.dtype)
+        elif level > 1:
+            frame = np.repeat(np.repeat(base, level, axis=0), level, axis=1)
+        else:
+            frame = base.copy()
+
+        x, y = origin
+        height = max(0, min(crop.shape[0], frame.shape[0] - y))
+        width = max(0, min(crop.shape[1], frame.shape[1] - x))
+        frame[y:y + height, x:x + width] = crop[:height, :width]
+        return frame
+
     @staticmethod
     def video_to_qimage(video_frame: np.ndarray) -> QImage:
         """
@@ -112,20 +238,23 @@ class FrameProcessor:
     @staticmethod
     def depth_to_qimage(
         depth_array: np.ndarray,
-        colormap: str = 'grayscale'
+        colormap: str = 'grayscale',
+        depth_format: str = DEPTH_RAW
     ) -> QImage:
         """
         Convert depth array to displayable QImage.
 
         Args:
             depth_array: numpy array of shape (H, W) with 11-bit depth values
+                (or millimetres, see depth_format)
             colormap: 'grayscale' (default), 'jet', or 'viridis'
+            depth_format: KinectPacket.depth_format
 
         Returns:
             QImage ready for display
         """
         # Normalize depth to 8-bit
-        depth_8bit = FrameProcessor.normalize_depth(depth_array)
+        depth_8bit = FrameProcessor.normalize_depth(depth_array, depth_format)
 
         if colormap == 'grayscale':
             return FrameProcessor._depth_grayscale(depth_8bit)
@@ -137,16 +266,24 @@ class FrameProcessor:
             return FrameProcessor._depth_grayscale(depth_8bit)
 
     @staticmethod
-    def normalize_depth(depth_array: np.ndarray) -> np.ndarray:
+    def normalize_depth(depth_array: np.ndarray, depth_format: str = DEPTH_RAW) -> np.ndarray:
         """
         Normalize 11-bit Kinect depth to 8-bit for display.
 
         Args:
-            depth_array: Raw 11-bit depth values (0-2047)
+            depth_array: Raw 11-bit depth values (0-2047), or millimetres
+            depth_format: KinectPacket.depth_format
 
         Returns:
             8-bit normalized depth array
         """
+        if depth_format != DEPTH_RAW:
+            # Millimetres: scale 0..DEPTH_MAX_METERS to 0..255
+            max_mm = int(Config.DEPTH_MAX_METERS * 1000)
+            depth_normalized = np.minimum(depth_array, max_mm).astype(np.uint32)
+            depth_8bit = (depth_normalized * 255 // max_mm).astype(np.uint8)
+            return np.ascontiguousarray(depth_8bit)
+
         # Clip to 10 bits and shift to 8 bits
         depth_normalized = np.clip(depth_array, 0, 2 ** Config.DEPTH_DISPLAY_BITS - 1)
         depth_8bit = (depth_normalized >> 2).astype(np.uint8)
@@ -214,13 +351,32 @@ class FrameProcessor:
         bytes_per_line = 3 * width
         return QImage(rgb.data, width, height, bytes_per_line, QImage.Format_RGB888)
 
+    @staticmethod
+    def _intrinsics(depth_format: str, fx: float, fy: float, cx: float, cy: float, level: int = 1) -> tuple:
+        """
+        Fill missing intrinsics from Config for the camera the depth is in.
+
+        Intrinsics are full-resolution values; for a pyramid level they are
+        scaled to the binned pixel grid (pixel centres move by half a pixel).
+        """
+        if depth_format == DEPTH_REGISTERED:
+            defaults = (Config.KINECT_RGB_FX, Config.KINECT_RGB_FY, Config.KINECT_RGB_CX, Config.KINECT_RGB_CY)
+        else:
+            defaults = (Config.KINECT_FX, Config.KINECT_FY, Config.KINECT_CX, Config.KINECT_CY)
+        fx, fy, cx, cy = (value or default for value, default in zip((fx, fy, cx, cy), defaults))
+        if level == 1:
+            return fx, fy, cx, cy
+        return fx / level, fy / level, (cx + 0.5) / level - 0.5, (cy + 0.5) / level - 0.5
+
     @staticmethod
     def depth_to_pointcloud(
         depth_array: np.ndarray,
         fx: float = None,
         fy: float = None,
         cx: float = None,
-        cy: float = None
+        cy: float = None,
+        depth_format: str = DEPTH_RAW,
+        level: int = 1
     ) -> np.ndarray:
         """
         Convert depth image to XYZ point cloud.
@@ -230,17 +386,17 @@ class FrameProcessor:
 
         Args:
             depth_array: Raw depth values from Kinect (11-bit, 0-2047)
+                or millimetres, see depth_format
             fx, fy: Focal lengths in pixels (default from Config)
             cx, cy: Principal point in pixels (default from Config)
+            depth_format: KinectPacket.depth_format
+            level: KinectPacket.level (pyramid downscale factor)
 
         Returns:
             numpy array of shape (N, 3) containing XYZ points in METERS
         """
         # Use config defaults if not specified
-        fx = fx or Config.KINECT_FX
-        fy = fy or Config.KINECT_FY
-        cx = cx or Config.KINECT_CX
-        cy = cy or Config.KINECT_CY
+        fx, fy, cx, cy = FrameProcessor._intrinsics(depth_format, fx, fy, cx, cy, level)
 
         height, width = depth_array.shape
 
@@ -249,8 +405,8 @@ class FrameProcessor:
         v = np.arange(height)
         u, v = np.meshgrid(u, v)
 
-        # Convert raw depth to meters (Kinect raw values are disparity, not distance!)
-        z = raw_depth_to_meters(depth_array)
+        # Convert to meters (Kinect raw values are disparity, not distance!)
+        z = depth_to_meters(depth_array, depth_format)
 
         # Filter invalid depth values (NaN from conversion + metric range)
         valid_mask = (
@@ -277,7 +433,9 @@ class FrameProcessor:
         fx: float = None,
         fy: float = None,
         cx: float = None,
-        cy: float = None
+        cy: float = None,
+        depth_format: str = DEPTH_RAW,
+        level: int = 1
     ) -> tuple:
         """
         Convert depth to point cloud with colors.
@@ -285,28 +443,31 @@ class FrameProcessor:
         By default uses depth-based coloring (blue=near, red=far) because
         Kinect RGB and depth cameras have a physical offset (~25mm) that
         makes direct pixel alignment inaccurate without proper calibration.
+        Registered depth is already aligned to the RGB image, so it is
+        colored from the video frame by default.
 
         Args:
-            depth_array: Raw depth values (11-bit, 0-2047)
+            depth_array: Raw depth values (11-bit, 0-2047) or millimetres
             video_frame: RGB video frame (optional, for RGB coloring attempt)
             use_depth_coloring: True for depth gradient, False for RGB (default: Config)
-            fx, fy, cx, cy: Camera intrinsics in pixels
+            fx, fy, cx, cy: Camera intrinsics in pixels (full resolution)
+            depth_format: KinectPacket.depth_format
+            level: KinectPacket.level (pyramid downscale factor); the
+                video frame must be at the same level for RGB coloring
 
         Returns:
             Tuple of (points, colors) where:
             - points: (N, 3) XYZ coordinates in METERS
             - colors: (N, 4) RGBA values (0-255)
         """
-        fx = fx or Config.KINECT_FX
-        fy = fy or Config.KINECT_FY
-        cx = cx or Config.KINECT_CX
-        cy = cy or Config.KINECT_CY
+        fx, fy, cx, cy = FrameProcessor._intrinsics(depth_format, fx, fy, cx, cy, level)
 
         if use_depth_coloring is None:
-            use_depth_coloring = Config.POINTCLOUD_DEPTH_COLORING
+            use_depth_coloring = Config.POINTCLOUD_DEPTH_COLORING and depth_format != DEPTH_REGISTERED
 
         height, width = depth_array.shape
-        stride = Config.POINTCLOUD_STRIDE
+        # Stride is in full-resolution pixels, a pyramid level already subsampled
+        stride = max(1, Config.POINTCLOUD_STRIDE // level)
 
         # Subsample for performance
         u = np.arange(0, width, stride)
@@ -316,8 +477,8 @@ class FrameProcessor:
         # Get raw depth values at subsampled positions
         raw_depth_subsampled = depth_array[::stride, ::stride]
 
-        # Convert raw depth to meters (Kinect raw values are disparity, not distance!)
-        z = raw_depth_to_meters(raw_depth_subsampled)
+        # Convert to meters (Kinect raw values are disparity, not distance!)
+        z = depth_to_meters(raw_depth_subsampled, depth_format)
 
         # Filter invalid depth values (NaN from conversion + metric range)
         valid_mask = (
@@ -340,7 +501,7 @@ class FrameProcessor:
             return np.zeros((0, 3)), np.zeros((0, 4), dtype=np.uint8)
 
         # Generate colors
-        if use_depth_coloring or video_frame is None:
+        if use_depth_coloring or video_frame is None or video_frame.shape[:2] != depth_array.shape:
             # Depth-based coloring: blue (near) -> cyan -> green -> yellow -> red (far)
             z_valid = z[valid_mask]
             z_min, z_max = z_valid.min(), z_valid.max()
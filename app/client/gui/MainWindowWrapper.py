@@ -6,19 +6,23 @@ the networking layer (ConnectionManager) and handles all user interactions.
 """
 import logging
 import time
+from collections import deque
 
-from PyQt5.QtCore import pyqtSignal
-from PyQt5.QtGui import QPixmap
-from PyQt5.QtWidgets import QMainWindow, QDialog
+from PyQt5.QtCore import QEvent, QRect, QSize, Qt, pyqtSignal
+from PyQt5.QtGui import QKeySequence, QPixmap
+from PyQt5.QtWidgets import QMainWindow, QDialog, QLineEdit, QRubberBand
 
 from app.client.connection_manager import ConnectionManager, ConnectionState
 from app.client.frame_processor import FrameProcessor
 from app.client.pointcloud_widget import PointCloudWidget
+from app.client.velocity_control import KEY_AXES, VelocityControl
 from app.client.gui.main_window import Ui_MainWindow
+from app.common.config import Config
 from app.networking import (
     CommandPacket, TurnLeft, TurnRight, TurretLeft, TurretRight,
     GoForward, GoBackward, GoLeft, GoRight, TurretReset,
-    KinectPacket, TelemetryPacket
+    KinectPacket, TelemetryPacket, StatsPacket, DEPTH_RAW, DEPTH_REGISTERED,
+    TOPIC_TELEMETRY, TOPIC_STATS, TOPIC_VIDEO, TOPIC_DEPTH, level_topic
 )
 
 
@@ -30,7 +34,9 @@ class MainWindowWrapper(QDialog):
     - Connection management (connect/disconnect)
     - Telemetry display updates
     - Kinect frame display (video, depth, point cloud)
+    - Region-of-interest selection (drag on a stream, right-click clears)
     - Command button handling
+    - Continuous drive (held keys and drive sliders stream VelocityCommand)
     """
 
     command_packet_signal = pyqtSignal(CommandPacket)
@@ -39,6 +45,9 @@ class MainWindowWrapper(QDialog):
     TAB_STREAMS = 0
     TAB_POINTCLOUD = 1
 
+    # Full-resolution Kinect frame (width, height) shown by the stream labels
+    FRAME_SIZE = (640, 480)
+
     def __init__(self, app, main_window: QMainWindow, default_robot_ip: str = ''):
         QDialog.__init__(self)
         self._logger = logging.getLogger(__name__)
@@ -61,8 +70,13 @@ class MainWindowWrapper(QDialog):
         self._connection_manager.state_changed.connect(self._on_connection_state_changed)
         self._connection_manager.error_occurred.connect(self._on_connection_error)
         self._connection_manager.telemetry_received.connect(self.update_telemetry)
+        self._connection_manager.stats_received.connect(self.update_stats)
         self._connection_manager.kinect_received.connect(self.update_kinect)
 
+        # Continuous drive; the button shortcuts are put aside while it is on
+        self._velocity = VelocityControl(parent=self)
+        self._shortcuts = {}
+
         # Set default robot IP from environment if provided
         if default_robot_ip:
             self._main_window.robot_ip_address.setText(default_robot_ip)
@@ -75,13 +89,31 @@ class MainWindowWrapper(QDialog):
         # Store last kinect data for point cloud generation
         self._last_video_frame = None
         self._last_depth_array = None
+        self._last_depth_format = DEPTH_RAW
+        self._last_depth_level = 1
+        self._last_video_level = 1
+        # Recent video frames by capture sequence, to color a depth frame
+        # with the video of the same capture (the server pairs them)
+        self._recent_video = deque(maxlen=4)
+
+        # Region of interest (x, y, width, height) in full-resolution pixels
+        # and its newest (crop, origin) per stream, pasted over the context frames
+        self._roi = None
+        self._roi_video = None
+        self._roi_depth = None
+        self._roi_drag = None
+        self._rubber_band = None
+        self._main_window.kinect_video.installEventFilter(self)
+        self._main_window.kinect_depth.installEventFilter(self)
 
         # Setup UI connections
         self._setup_buttons()
         self._setup_tab_handling()
 
-        # Handle window close
+        # Handle window close, and minimize/restore for stream subscriptions
         self._main_window_ref.closeEvent = self._on_window_close
+        self._main_window_ref.changeEvent = self._on_window_change
+        self._update_topics()
 
     def _on_window_close(self, event):
         """Handle window close event."""
@@ -89,9 +121,102 @@ class MainWindowWrapper(QDialog):
         self.cleanup()
         event.accept()
 
+    def _on_window_change(self, event):
+        """Handle window state changes (minimized windows need no video)."""
+        QMainWindow.changeEvent(self._main_window_ref, event)
+        if event.type() == QEvent.WindowStateChange:
+            self._update_topics()
+
+    def _update_topics(self):
+        """Subscribe only to the Kinect streams (and region of interest) currently on screen."""
+        topics = {TOPIC_TELEMETRY, TOPIC_STATS}
+        roi = None
+        if not self._main_window_ref.isMinimized():
+            if self._main_window.video_tab_widget.currentIndex() == self.TAB_POINTCLOUD:
+                level = Config.POINTCLOUD_LEVEL
+                topics.add(level_topic(TOPIC_DEPTH, level))
+                # Video only for RGB-colored clouds
+                if not Config.POINTCLOUD_DEPTH_COLORING or self._last_depth_format == DEPTH_REGISTERED:
+                    topics.add(level_topic(TOPIC_VIDEO, level))
+            else:
+                level = Config.STREAM_VIEW_LEVEL
+                topics.update((level_topic(TOPIC_VIDEO, level), level_topic(TOPIC_DEPTH, level)))
+                roi = self._roi
+        if roi is None:
+            self._roi_video = self._roi_depth = None
+        self._connection_manager.set_topics(topics)
+        self._connection_manager.set_roi(roi)
+
+    def eventFilter(self, watched, event):
+        """
+        Select a region of interest by dragging on the video or depth stream,
+        and (continuous drive, application-wide filter) track the held drive keys.
+        """
+        if event.type() in (QEvent.KeyPress, QEvent.KeyRelease) and self._main_window.velocity_drive.isChecked():
+            if isinstance(self._app.focusWidget(), QLineEdit):
+                return QDialog.eventFilter(self, watched, event)
+            if event.isAutoRepeat():
+                return event.key() in KEY_AXES
+            if event.type() == QEvent.KeyPress:
+                return self._velocity.press(event.key())
+            return self._velocity.release(event.key())
+        if event.type() == QEvent.ApplicationDeactivate:
+            # Key releases go to the window that has the focus now
+            self._velocity.stop()
+            return False
+
+        if watched not in (self._main_window.kinect_video, self._main_window.kinect_depth):
+            return QDialog.eventFilter(self, watched, event)
+
+        if event.type() == QEvent.MouseButtonPress:
+            if event.button() == Qt.LeftButton:
+                self._roi_drag = event.pos()
+                self._rubber_band = QRubberBand(QRubberBand.Rectangle, watched)
+                self._rubber_band.setGeometry(QRect(event.pos(), QSize()))
+                self._rubber_band.show()
+            elif event.button() == Qt.RightButton:
+                self._set_roi(None)
+            return True
+        if event.type() == QEvent.MouseMove and self._rubber_band is not None:
+            self._rubber_band.setGeometry(QRect(self._roi_drag, event.pos()).normalized())
+            return True
+        if event.type() == QEvent.MouseButtonRelease and self._rubber_band is not None:
+            rect = self._rubber_band.geometry()
+            self._rubber_band.hide()
+            self._rubber_band.deleteLater()
+            self._rubber_band = None
+            self._set_roi(self._label_to_frame(watched, rect))
+            return True
+        return QDialog.eventFilter(self, watched, event)
+
+    def _label_to_frame(self, label, rect: QRect):
+        """
+        Map a rectangle on a stream label to full-resolution frame pixels.
+
+        Returns:
+            (x, y, width, height), or None for a click without a drag
+        """
+        # The labels scale their pixmap to fill them (setScaledContents)
+        scale_x = self.FRAME_SIZE[0] / max(1, label.width())
+        scale_y = self.FRAME_SIZE[1] / max(1, label.height())
+        width, height = int(rect.width() * scale_x), int(rect.height() * scale_y)
+        if width < 2 or height < 2:
+            return None
+        return int(rect.x() * scale_x), int(rect.y() * scale_y), width, height
+
+    def _set_roi(self, roi):
+        """Request full-resolution crops of a region (None = full frame only)."""
+        self._roi = roi
+        self._roi_video = self._roi_depth = None
+        self._logger.debug("Region of interest: {}".format(roi))
+        self._update_topics()
+        self._show_video()
+        self._show_depth()
+
     def cleanup(self):
         """Disconnect and cleanup resources."""
         self._logger.info("Cleanup: disconnecting from robot...")
+        self._velocity.stop()
 
         # Disconnect from robot
         if self._connection_manager.is_connected:
@@ -105,13 +230,15 @@ class MainWindowWrapper(QDialog):
 
     def _on_tab_changed(self, index: int):
         """Handle tab changes - used for point cloud optimization."""
+        self._update_topics()
         if index == self.TAB_POINTCLOUD:
             self._logger.debug("Switched to Point Cloud tab")
             # If we have cached data, update point cloud immediately
-            if self._last_depth_array is not None and self._last_video_frame is not None:
+            if self._last_depth_array is not None:
                 try:
                     points, colors = FrameProcessor.depth_to_colored_pointcloud(
-                        self._last_depth_array, self._last_video_frame)
+                        self._last_depth_array, self._last_video_frame,
+                        depth_format=self._last_depth_format, level=self._last_depth_level)
                     self._pointcloud_widget.update_pointcloud(points, colors)
                 except Exception as e:
                     self._logger.warning(f"Point cloud error: {e}")
@@ -151,12 +278,21 @@ class MainWindowWrapper(QDialog):
         self._logger.error(f"Connection error: {error_message}")
 
     def update_kinect(self, data: KinectPacket):
-        """Update video and depth displays from Kinect data."""
+        """Update the video or depth display from a Kinect stream packet."""
         self._logger.debug("Got kinect packet!")
 
-        # Update frame counters and calculate FPS
-        self._video_frame_count += 1
-        self._depth_frame_count += 1
+        # Region-of-interest crops are pasted over the context frames
+        if data.roi is not None:
+            self._update_roi(data)
+            return
+
+        # Each packet carries one stream (video or depth)
+        if data.get_video_frame() is not None:
+            self._video_frame_count += 1
+            self._update_video(data)
+        if data.get_depth() is not None:
+            self._depth_frame_count += 1
+            self._update_depth(data)
 
         current_time = time.time()
         elapsed = current_time - self._last_fps_time
@@ -171,30 +307,88 @@ class MainWindowWrapper(QDialog):
             self._main_window.lcd_video_fps.display(self._video_fps)
             self._main_window.lcd_depth_fps.display(self._depth_fps)
 
-        # Get frame data
-        video_frame = data.get_video_frame()
-        depth_array = data.get_depth()
+    def _update_video(self, data: KinectPacket):
+        """Show a video frame and keep it for point cloud coloring."""
+        self._last_video_frame = FrameProcessor.video_to_rgb(data.get_video_frame(), data.video_format)
+        self._last_video_level = data.level
+        self._recent_video.append((data.sequence, self._last_video_frame))
+        self._show_video()
 
-        # Store for point cloud generation
-        self._last_video_frame = video_frame
+    def _update_depth(self, data: KinectPacket):
+        """Show a depth frame and refresh the point cloud."""
+        depth_array = data.get_depth()
         self._last_depth_array = depth_array
+        self._last_depth_level = data.level
+        if data.depth_format != self._last_depth_format:
+            self._last_depth_format = data.depth_format
+            # Registered depth colors the point cloud from video
+            self._update_topics()
 
-        # Always update video stream display
-        video_image = FrameProcessor.video_to_qimage(video_frame)
-        self._main_window.kinect_video.setPixmap(QPixmap.fromImage(video_image))
-
-        # Always update depth stream display (with jet colormap for better visibility)
-        depth_image = FrameProcessor.depth_to_qimage(depth_array, colormap='jet')
-        self._main_window.kinect_depth.setPixmap(QPixmap.fromImage(depth_image))
+        self._show_depth()
 
         # Only update point cloud if Point Cloud tab is active (performance optimization)
         if self._main_window.video_tab_widget.currentIndex() == self.TAB_POINTCLOUD:
             try:
-                points, colors = FrameProcessor.depth_to_colored_pointcloud(depth_array, video_frame)
+                points, colors = FrameProcessor.depth_to_colored_pointcloud(
+                    depth_array, self._video_for(data.sequence),
+                    depth_format=data.depth_format, level=data.level)
                 self._pointcloud_widget.update_pointcloud(points, colors)
             except Exception as e:
                 self._logger.warning(f"Point cloud error: {e}")
 
+    def _video_for(self, sequence: int):
+        """Video frame captured together with a depth frame, else the newest one."""
+        for video_sequence, frame in self._recent_video:
+            if video_sequence == sequence:
+                return frame
+        return self._last_video_frame
+
+    def _update_roi(self, data: KinectPacket):
+        """Keep a region-of-interest crop and redraw its stream."""
+        if self._roi is None:
+            return  # Still in flight when the region was cleared
+        if data.get_video_frame() is not None:
+            crop = FrameProcessor.video_to_rgb(data.get_video_frame(), data.video_format)
+            self._roi_video = (crop, data.roi)
+            self._show_video()
+        if data.get_depth() is not None:
+            self._roi_depth = (data.get_depth(), data.roi)
+            self._show_depth()
+
+    def _show_video(self):
+        """Display the last video frame with the region-of-interest crop on top."""
+        frame, level = self._last_video_frame, self._last_video_level
+        if self._roi_video is not None:
+            crop, origin = self._roi_video
+            frame = FrameProcessor.composite_roi(frame, crop, origin, level)
+            level = 1
+        if frame is None:
+            return
+        video_image = FrameProcessor.video_to_qimage(frame)
+        self._main_window.kinect_video.setPixmap(self._full_size_pixmap(video_image, level))
+
+    def _show_depth(self):
+        """Display the last depth frame with the region-of-interest crop on top."""
+        depth_array, level = self._last_depth_array, self._last_depth_level
+        if self._roi_depth is not None:
+            crop, origin = self._roi_depth
+            depth_array = FrameProcessor.composite_roi(depth_array, crop, origin, level)
+            level = 1
+        if depth_array is None:
+            return
+        # Depth stream display (with jet colormap for better visibility)
+        depth_image = FrameProcessor.depth_to_qimage(
+            depth_array, colormap='jet', depth_format=self._last_depth_format)
+        self._main_window.kinect_depth.setPixmap(self._full_size_pixmap(depth_image, level))
+
+    @staticmethod
+    def _full_size_pixmap(image, level: int) -> QPixmap:
+        """Scale a reduced pyramid level back up so the layout does not change."""
+        pixmap = QPixmap.fromImage(image)
+        if level > 1:
+            pixmap = pixmap.scaled(pixmap.width() * level, pixmap.height() * level)
+        return pixmap
+
     def update_telemetry(self, data: TelemetryPacket):
         """Update all telemetry displays from robot data."""
         self._telemetry_count += 1
@@ -208,9 +402,12 @@ class MainWindowWrapper(QDialog):
         self._main_window.color_sensor_lcd.display(data.color_sensor.raw)
 
         # Sensors (in Telemetry section)
+        self._main_window.ultrasonic_sensor_lcd.display(data.ultrasound_sensor.raw)
+
+    def update_stats(self, data: StatsPacket):
+        """Update the slow-changing board and system displays."""
         self._main_window.lcd_temperature.display(data.temperature)
         self._main_window.lcd_voltage.display(data.voltage)
-        self._main_window.ultrasonic_sensor_lcd.display(data.ultrasound_sensor.raw)
 
         # System stats (in Telemetry section)
         stats = data.system_stats
@@ -239,6 +436,44 @@ class MainWindowWrapper(QDialog):
         self._main_window.turret_right.clicked.connect(self.turret_right)
         self._main_window.turret_reset.clicked.connect(self.turret_reset)
 
+        # Continuous drive: the sliders spring back to zero when let go
+        self._velocity.command.connect(self._connection_manager.send_command)
+        self._main_window.velocity_drive.toggled.connect(self._on_velocity_drive)
+        self._main_window.drive_linear.valueChanged.connect(
+            lambda value: self._velocity.set_slider('linear', value / 100.0))
+        self._main_window.drive_angular.valueChanged.connect(
+            lambda value: self._velocity.set_slider('angular', value / 100.0))
+        self._main_window.drive_linear.sliderReleased.connect(lambda: self._main_window.drive_linear.setValue(0))
+        self._main_window.drive_angular.sliderReleased.connect(lambda: self._main_window.drive_angular.setValue(0))
+        self._main_window.motor_speed.valueChanged.connect(self._update_velocity_scales)
+        self._main_window.turret_speed.valueChanged.connect(self._update_velocity_scales)
+        self._update_velocity_scales()
+
+    def _velocity_buttons(self) -> tuple:
+        """Buttons whose shortcuts are the continuous drive keys."""
+        window = self._main_window
+        return window.forward, window.backward, window.left, window.right, window.turret_left, window.turret_right
+
+    def _on_velocity_drive(self, enabled: bool):
+        """Switch W/A/S/D and [/] between one step per press and continuous drive."""
+        if enabled:
+            self._shortcuts = {button: button.shortcut() for button in self._velocity_buttons()}
+            for button in self._shortcuts:
+                button.setShortcut(QKeySequence())
+            self._app.installEventFilter(self)
+        else:
+            self._app.removeEventFilter(self)
+            for button, shortcut in self._shortcuts.items():
+                button.setShortcut(shortcut)
+            self._shortcuts = {}
+            self._velocity.stop()
+
+    def _update_velocity_scales(self, _=None):
+        """Held keys drive at the speeds set on the motor and turret dials."""
+        self._velocity.set_scales(
+            min(1.0, self._main_window.motor_speed.value() / Config.VELOCITY_MAX_SPEED),
+            min(1.0, self._main_window.turret_speed.value() / Config.VELOCITY_MAX_SPEED))
+
     # === Command methods ===
 
     def go_forward(self):
@@ -211,9 +211,43 @@ class Ui_MainWindow(object):
         movement_layout.addLayout(speed_layout)
         locomotion_layout.addLayout(movement_layout)
 
+        # Continuous (velocity) drive: held keys and spring-back sliders
+        self._setup_drive_sliders(locomotion_layout)
+
         locomotion_layout.addStretch()
         self.controls_layout.addWidget(self.locomotion, stretch=1)
 
+    def _setup_drive_sliders(self, parent_layout):
+        """Set up the continuous drive toggle and the drive/steer sliders."""
+        self.velocity_drive = QtWidgets.QCheckBox(self.locomotion)
+        self.velocity_drive.setObjectName("velocity_drive")
+        parent_layout.addWidget(self.velocity_drive)
+
+        slider_grid = QtWidgets.QGridLayout()
+        slider_grid.setSpacing(4)
+
+        self.label_drive_linear = QtWidgets.QLabel(self.locomotion)
+        self.label_drive_linear.setObjectName("label_drive_linear")
+        slider_grid.addWidget(self.label_drive_linear, 0, 0)
+        self.drive_linear = QtWidgets.QSlider(QtCore.Qt.Horizontal, self.locomotion)
+        self.drive_linear.setObjectName("drive_linear")
+        self.drive_linear.setRange(-100, 100)
+        self.drive_linear.setValue(0)
+        slider_grid.addWidget(self.drive_linear, 0, 1)
+
+        self.label_drive_angular = QtWidgets.QLabel(self.locomotion)
+        self.label_drive_angular.setObjectName("label_drive_angular")
+        slider_grid.addWidget(self.label_drive_angular, 1, 0)
+        self.drive_angular = QtWidgets.QSlider(QtCore.Qt.Horizontal, self.locomotion)
+        self.drive_angular.setObjectName("drive_angular")
+        self.drive_angular.setRange(-100, 100)
+        self.drive_angular.setValue(0)
+        # Left end turns left
+        self.drive_angular.setInvertedAppearance(True)
+        slider_grid.addWidget(self.drive_angular, 1, 1)
+
+        parent_layout.addLayout(slider_grid)
+
     def _setup_direction_buttons(self, parent_layout):
         """Set up the direction control buttons in a grid."""
         grid = QtWidgets.QGridLayout()
@@ -620,6 +654,13 @@ class Ui_MainWindow(object):
         self.backward.setShortcut(_translate("MainWindow", "S"))
         self.right.setToolTip(_translate("MainWindow", "Turn Right (D)"))
         self.right.setShortcut(_translate("MainWindow", "D"))
+        self.velocity_drive.setText(_translate("MainWindow", "Continuous drive (hold keys)"))
+        self.velocity_drive.setToolTip(_translate(
+            "MainWindow", "Stream velocity while W/A/S/D and [/] are held instead of one step per press"))
+        self.label_drive_linear.setText(_translate("MainWindow", "Drive"))
+        self.label_drive_angular.setText(_translate("MainWindow", "Steer"))
+        self.drive_linear.setToolTip(_translate("MainWindow", "Hold to drive, springs back to stop"))
+        self.drive_angular.setToolTip(_translate("MainWindow", "Hold to steer, springs back to straight"))
 
         # Turret section
         self.turret_controls.setTitle(_translate("MainWindow", "Turret"))
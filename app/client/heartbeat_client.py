@@ -2,16 +2,41 @@
 HeartbeatClient - Sends periodic heartbeat to robot server.
 
 Maintains connection by sending heartbeat requests and receiving responses.
+Every request carries the client's session id, the round trip of the
+previous heartbeat and the client's capabilities; the response carries
+the capabilities the server negotiated and the number of connected clients.
+The response's timestamp, taken halfway through the round trip, gives the
+offset of the server's clock, which CommandClient uses to stamp commands
+in server time (their time to live is checked against the server clock).
 This was formerly named HelloClient.
 """
 import logging
+import random
 import time
+from collections import deque
 
 import zmq
 from PyQt5.QtCore import QThread
 
-from app.networking import HeartbeatRequest, get_available_interfaces
-from app.common.serialization import compress, decompress
+from app.common.config import Config
+from app.common.serialization import (
+    FRAMES_MIN_VERSION, FRAMES_VERSION, available_compressors, compress, decompress
+)
+from app.networking import HEARTBEAT_REJECTED, HeartbeatRequest, get_available_interfaces
+
+# Recent heartbeats the clock offset is taken from (the shortest round trip wins)
+CLOCK_SAMPLES = 8
+
+
+def client_capabilities() -> dict:
+    """Features this client supports, sent with every heartbeat."""
+    return {
+        'compressors': available_compressors(),
+        'frames_version': FRAMES_VERSION,
+        'frames_min_version': FRAMES_MIN_VERSION,
+        'chunks': True,
+        'stream_session': Config.STREAM_SESSION,
+    }
 
 
 class HeartbeatClient(QThread):
@@ -19,15 +44,51 @@ class HeartbeatClient(QThread):
     Sends periodic heartbeat requests to the robot server.
 
     Used to maintain connection and trigger server-side component startup.
+
+    Args:
+        server_ip: Robot address
+        port: Handshake port
+        sleep_time: Seconds between heartbeats
+        session: Session id sent with every heartbeat (random if None)
     """
 
-    def __init__(self, server_ip: str, port: int, sleep_time: float = 1):
+    def __init__(self, server_ip: str, port: int, sleep_time: float = 1, session: int = None):
         QThread.__init__(self, parent=None)
         self._running = True
         self._logger = logging.getLogger(__name__)
         self._host = server_ip
         self._port = port
         self._sleep_time = sleep_time
+        self._session = (random.getrandbits(32) or 1) if session is None else session
+        self._rtt_ms = 0.0
+        self._capabilities = {}
+        self._clients = 0
+        self._clock_offset = None
+
+    @property
+    def session(self) -> int:
+        """Session id of this connection."""
+        return self._session
+
+    @property
+    def rtt_ms(self) -> float:
+        """Round trip of the last heartbeat (milliseconds)."""
+        return self._rtt_ms
+
+    @property
+    def capabilities(self) -> dict:
+        """Capabilities negotiated with the server (empty until the first response)."""
+        return self._capabilities
+
+    @property
+    def clients(self) -> int:
+        """Clients connected to the robot, as of the last response."""
+        return self._clients
+
+    @property
+    def clock_offset(self) -> float:
+        """Server clock minus this client's clock (seconds), None until the first response."""
+        return self._clock_offset
 
     def run(self):
         context = zmq.Context()
@@ -37,17 +98,42 @@ class HeartbeatClient(QThread):
         self._logger.info("HeartbeatClient starting -> address: {}".format(address))
 
         sequence = 0
+        capabilities = client_capabilities()
+        # (round trip, clock offset) of recent heartbeats
+        clock_samples = deque(maxlen=CLOCK_SAMPLES)
         while self._running:
             try:
                 request = HeartbeatRequest(
                     sequence,
                     running=True,
                     network=get_available_interfaces(),
-                    sleep=self._sleep_time
+                    sleep=self._sleep_time,
+                    session=self._session,
+                    rtt_ms=self._rtt_ms,
+                    capabilities=capabilities
                 )
+                sent = time.perf_counter()
+                sent_at = time.time()
                 socket.send(compress(request))
 
-                response = decompress(socket.recv())
+                reply = socket.recv()
+                if reply == HEARTBEAT_REJECTED:
+                    self._logger.warning("The robot rejected heartbeat {}".format(sequence))
+                    time.sleep(self._sleep_time)
+                    continue
+                response = decompress(reply)
+                round_trip = time.perf_counter() - sent
+                self._rtt_ms = round_trip * 1000.0
+                # The server stamped the response about halfway through the round trip
+                clock_samples.append((round_trip, response.time - (sent_at + round_trip / 2)))
+                self._clock_offset = min(clock_samples)[1]
+                if self._capabilities.get('frames_version', FRAMES_VERSION) is not None \
+                        and response.capabilities.get('frames_version', FRAMES_VERSION) is None:
+                    self._logger.error("The robot writes no Kinect frame format this client reads "
+                                       "(versions {}-{}): video and depth are unavailable".format(
+                                           FRAMES_MIN_VERSION, FRAMES_VERSION))
+                self._capabilities = response.capabilities
+                self._clients = response.clients
                 sequence = response.sequence
                 time.sleep(self._sleep_time)
             except Exception as e:
@@ -64,4 +150,3 @@ class HeartbeatClient(QThread):
 
 # Backward compatibility alias
 HelloClient = HeartbeatClient
-
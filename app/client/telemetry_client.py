@@ -2,9 +2,25 @@
 TelemetryClient - Receives telemetry and Kinect data from the robot.
 
 Subscribes to the robot's telemetry publisher (ZMQ PUB socket) and
-emits Qt signals when data is received.
+emits Qt signals when data is received. Only the topics set with
+set_topics() are subscribed, so hidden streams are never sent.
+
+Kinect frames are delivered latest-wins: decoded frames wait in a
+one-per-stream mailbox and a newer frame replaces one the GUI has not
+taken yet, so a slow GUI shows the newest frame instead of a backlog.
+Telemetry and stats are emitted as they arrive. A message that cannot be
+decoded (a corrupt or missing chunk, an unknown compressor) is counted and
+skipped: the topic's chunk and temporal state start over and a keyframe
+is requested.
+
+With STREAM_SESSION the client opens a stream session (DEALER socket on
+STREAM_PORT) instead of subscribing: the robot then paces this client
+alone, sending at most STREAM_WINDOW messages beyond those acknowledged.
 """
 import logging
+import random
+import threading
+import time
 
 import zmq
 from PyQt5 import QtCore
@@ -12,8 +28,12 @@ from PyQt5.QtCore import pyqtSignal
 
 from app.client.heartbeat_client import HeartbeatClient
 from app.common.config import Config
-from app.common.serialization import decompress
-from app.networking import KinectPacket, TelemetryPacket
+from app.common.drop_counter import DropCounter
+from app.common.serialization import ChunkAssembler, decode_message, is_chunk, is_last_chunk
+from app.networking import (
+    KinectPacket, TelemetryPacket, StatsPacket, DEFAULT_TOPICS, TOPIC_VIDEO, topic_stream,
+    STREAM_ACK, STREAM_BYE, STREAM_TOPICS
+)
 
 
 class TelemetryClient(QtCore.QThread):
@@ -22,18 +42,26 @@ class TelemetryClient(QtCore.QThread):
 
     Signals:
         telemetry_packet_signal: Emitted when TelemetryPacket received
-        kinect_packet_signal: Emitted when KinectPacket received
+        stats_packet_signal: Emitted when StatsPacket received
+        kinect_ready_signal: Emitted when the Kinect mailbox gets a frame
+            while empty; collect the frames with take_kinect_packets()
         connection_timeout_signal: Emitted when no data received for timeout period
+        keyframe_request_signal: Emitted when a temporal decoder lost its reference
     """
 
     telemetry_packet_signal = pyqtSignal(TelemetryPacket)
-    kinect_packet_signal = pyqtSignal(KinectPacket)
+    stats_packet_signal = pyqtSignal(StatsPacket)
+    kinect_ready_signal = pyqtSignal()
     connection_timeout_signal = pyqtSignal()
+    keyframe_request_signal = pyqtSignal()
 
     # Timeout in milliseconds (2 seconds without data = timeout)
     POLL_TIMEOUT_MS = 500
     TIMEOUT_THRESHOLD = 4  # 4 timeouts = 2 seconds
 
+    # Time the stream session's goodbye may take to leave on disconnect
+    BYE_LINGER_MS = 200
+
     def __init__(self, port: int = None, parent=None):
         QtCore.QThread.__init__(self, parent)
         self._logger = logging.getLogger(__name__)
@@ -41,12 +69,29 @@ class TelemetryClient(QtCore.QThread):
         self._port = port if port is not None else Config.TELEMETRY_PORT
 
         self._heartbeat_client = None
+        # Identifies this connection in the handshake and the stream session
+        self._session = random.getrandbits(32) or 1
 
         self.running = True
         self.ultrasonic_sensor = 0
         self.color_sensor = 0
         self._timeout_count = 0
 
+        # Temporal decoder state per topic (see temporal_codec.py)
+        self._temporal_decoders = {}
+        # Partly received chunked messages, per topic
+        self._chunk_assemblers = {}
+        self._last_keyframe_request = 0.0
+
+        # Topics requested by the GUI thread, applied by run()
+        self._topics = frozenset(DEFAULT_TOPICS)
+
+        # Newest undelivered KinectPacket per topic, shared with the GUI thread
+        self._mailbox = {}
+        self._mailbox_lock = threading.Lock()
+        self._drops = DropCounter("Kinect frames (GUI busy)", self._logger)
+        self._decode_errors = DropCounter("undecodable messages", self._logger)
+
     def robot_ip_address(self):
         return self._robot_ip_address
 
@@ -55,9 +100,41 @@ class TelemetryClient(QtCore.QThread):
 
     def launch_heartbeat_client(self):
         """Start the heartbeat client to maintain connection."""
-        self._heartbeat_client = HeartbeatClient(self._robot_ip_address, Config.HELLO_PORT)
+        self._heartbeat_client = HeartbeatClient(self._robot_ip_address, Config.HELLO_PORT, session=self._session)
         self._heartbeat_client.start()
 
+    def set_topics(self, topics):
+        """
+        Select the topics to receive (thread-safe, applied on the next poll).
+
+        Args:
+            topics: Iterable of TOPIC_* values
+        """
+        self._topics = frozenset(topics)
+
+    @property
+    def clock_offset(self) -> float:
+        """Robot clock minus this client's clock (seconds), None until the first heartbeat response."""
+        heartbeat_client = self._heartbeat_client
+        return heartbeat_client.clock_offset if heartbeat_client is not None else None
+
+    @property
+    def dropped_frames(self) -> dict:
+        """Kinect frames replaced in the mailbox before the GUI took them, per topic."""
+        return self._drops.totals
+
+    def take_kinect_packets(self) -> list:
+        """
+        Take the frames waiting in the Kinect mailbox (thread-safe).
+
+        Returns:
+            The newest undelivered KinectPacket of each topic
+        """
+        with self._mailbox_lock:
+            packets = list(self._mailbox.values())
+            self._mailbox.clear()
+        return packets
+
     def on_telemetry_packet(self, packet: TelemetryPacket):
         self.telemetry_packet_signal = packet
 
@@ -65,12 +142,24 @@ class TelemetryClient(QtCore.QThread):
         self.launch_heartbeat_client()
 
         context = zmq.Context()
-        zmq_address = "tcp://{}:{}".format(self._robot_ip_address, self._port)
-        self._logger.debug("ZMQ connecting to {}".format(zmq_address))
+        session = Config.STREAM_SESSION
+        port = Config.STREAM_PORT if session else self._port
+        zmq_address = "tcp://{}:{}".format(self._robot_ip_address, port)
+        self._logger.debug("ZMQ connecting to {}{}".format(zmq_address, " (stream session)" if session else ""))
 
-        subscriber = context.socket(zmq.SUB)
+        if session:
+            subscriber = context.socket(zmq.DEALER)
+            subscriber.setsockopt(zmq.ROUTING_ID, b'%08x' % self._session)
+        else:
+            subscriber = context.socket(zmq.SUB)
+        subscriber.setsockopt(zmq.RCVHWM, Config.TELEMETRY_RCVHWM)
+        subscriber.setsockopt(zmq.RCVBUF, Config.TELEMETRY_RCVBUF)
+        subscriber.setsockopt(zmq.LINGER, Config.FRAME_LINGER_MS)
         subscriber.connect(zmq_address)
-        subscriber.setsockopt(zmq.SUBSCRIBE, b'')
+        subscribed = set()
+        # Stream session: messages consumed, and when the session was last refreshed
+        consumed = 0
+        last_keepalive = 0.0
 
         # Use poller for non-blocking receive with timeout
         poller = zmq.Poller()
@@ -78,18 +167,44 @@ class TelemetryClient(QtCore.QThread):
 
         while self.running:
             try:
+                # Apply topic changes from the GUI thread (sockets are not thread-safe)
+                topics = self._topics
+                for topic in subscribed - topics:
+                    if not session:
+                        subscriber.setsockopt(zmq.UNSUBSCRIBE, topic)
+                    self._temporal_decoders.pop(topic, None)
+                    self._chunk_assemblers.pop(topic, None)
+                if not session:
+                    for topic in topics - subscribed:
+                        subscriber.setsockopt(zmq.SUBSCRIBE, topic)
+                now = time.monotonic()
+                if session and (topics != subscribed or now - last_keepalive >= Config.STREAM_KEEPALIVE):
+                    # Also reopens the session after a server restart
+                    last_keepalive = now
+                    subscriber.send_multipart([STREAM_TOPICS] + sorted(topics))
+                    subscriber.send_multipart([STREAM_ACK, b'%d' % consumed, b'%d' % Config.STREAM_WINDOW])
+                subscribed = set(topics)
+
                 # Poll with timeout instead of blocking recv
                 events = dict(poller.poll(timeout=self.POLL_TIMEOUT_MS))
 
                 if subscriber in events and events[subscriber] == zmq.POLLIN:
                     # Data available - reset timeout counter
                     self._timeout_count = 0
-                    data = decompress(subscriber.recv(flags=zmq.NOBLOCK))
-
-                    if type(data) is TelemetryPacket:
-                        self.telemetry_packet_signal.emit(data)
-                    if type(data) is KinectPacket:
-                        self.kinect_packet_signal.emit(data)
+                    topic, *frames = subscriber.recv_multipart(flags=zmq.NOBLOCK, copy=False)
+                    # A stream session credits whole messages
+                    complete = not is_chunk(frames) or is_last_chunk(frames)
+                    data = self._decode(topic.bytes, frames)
+                    if data is not None:
+                        if type(data) is TelemetryPacket:
+                            self.telemetry_packet_signal.emit(data)
+                        if type(data) is StatsPacket:
+                            self.stats_packet_signal.emit(data)
+                        if type(data) is KinectPacket:
+                            self._on_kinect_packet(topic.bytes, data)
+                    if session and complete:
+                        consumed += 1
+                        subscriber.send_multipart([STREAM_ACK, b'%d' % consumed, b'%d' % Config.STREAM_WINDOW])
                 else:
                     # No data - increment timeout counter
                     self._timeout_count += 1
@@ -107,6 +222,61 @@ class TelemetryClient(QtCore.QThread):
                 break
 
         self._heartbeat_client.wait()
-        subscriber.close()
+        if session:
+            try:
+                subscriber.send_multipart([STREAM_BYE], flags=zmq.NOBLOCK)
+            except zmq.Again:
+                pass
+            subscriber.close(linger=self.BYE_LINGER_MS)
+        else:
+            subscriber.close()
         context.term()
 
+    def _decode(self, topic: bytes, frames: list):
+        """
+        Decode one received message, reassembling chunked messages.
+
+        Returns:
+            The decoded packet, or None for a chunk of an unfinished message
+            and for a message that could not be decoded
+        """
+        try:
+            if is_chunk(frames):
+                frames = self._chunk_assemblers.setdefault(topic, ChunkAssembler()).add(frames)
+                if frames is None:
+                    return None
+            return decode_message(frames, self._temporal_decoders.setdefault(topic, {}))
+        except Exception as e:
+            if topic not in self._decode_errors.totals:
+                self._logger.warning("Cannot decode a message on {}: {}".format(topic.decode(errors='replace'), e))
+            self._decode_errors.drop(topic)
+            # Start the topic over from its next keyframe
+            self._chunk_assemblers.pop(topic, None)
+            self._temporal_decoders.pop(topic, None)
+            self._request_keyframe()
+            return None
+
+    def _request_keyframe(self):
+        """Ask the robot for a keyframe, at most every KEYFRAME_REQUEST_INTERVAL seconds."""
+        now = time.time()
+        if now - self._last_keyframe_request >= Config.KEYFRAME_REQUEST_INTERVAL:
+            self._last_keyframe_request = now
+            self._logger.debug("Lost temporal reference, requesting keyframe")
+            self.keyframe_request_signal.emit()
+
+    def _on_kinect_packet(self, topic: bytes, packet: KinectPacket):
+        """Emit decoded frames, ask for a keyframe while a stream is missing."""
+        stream, _ = topic_stream(topic)
+        frame = packet.video_frame if stream == TOPIC_VIDEO else packet.depth
+        if frame is None:
+            # Temporal decoder is waiting for a keyframe
+            self._request_keyframe()
+            return
+
+        with self._mailbox_lock:
+            notify = not self._mailbox
+            if topic in self._mailbox:
+                self._drops.drop(topic)
+            self._mailbox[topic] = packet
+        if notify:
+            self.kinect_ready_signal.emit()
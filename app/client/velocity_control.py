@@ -0,0 +1,110 @@
+"""
+VelocityControl - Streams VelocityCommand while the operator drives.
+
+Combines the held drive keys and the drive sliders into one velocity and
+sends it every 1 / VELOCITY_RATE_HZ seconds while it is not zero, then a
+single zero command.
+
+Keys: W / S forward and backward, A / D turn, [ / ] turret.
+"""
+from PyQt5 import QtCore
+from PyQt5.QtCore import Qt
+
+from app.common.config import Config
+from app.networking import CommandPacket, VelocityCommand
+
+# Key -> (axis, direction)
+KEY_AXES = {
+    Qt.Key_W: ('linear', 1),
+    Qt.Key_S: ('linear', -1),
+    Qt.Key_A: ('angular', 1),
+    Qt.Key_D: ('angular', -1),
+    Qt.Key_BracketLeft: ('turret_rate', 1),
+    Qt.Key_BracketRight: ('turret_rate', -1),
+}
+
+
+class VelocityControl(QtCore.QObject):
+    """
+    Turns held keys and slider positions into a stream of VelocityCommand.
+
+    Args:
+        rate_hz: Commands per second while driving (defaults to VELOCITY_RATE_HZ)
+        parent: Qt parent
+    """
+
+    command = QtCore.pyqtSignal(CommandPacket)
+
+    def __init__(self, rate_hz: float = None, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        if rate_hz is None:
+            rate_hz = Config.VELOCITY_RATE_HZ
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(max(1, int(1000 / rate_hz)))
+        self._timer.timeout.connect(self._send)
+        self._keys = set()
+        self._sliders = {'linear': 0.0, 'angular': 0.0, 'turret_rate': 0.0}
+        # Fraction of full speed a held key drives the tracks / the turret at
+        self._drive_scale = 1.0
+        self._turret_scale = 1.0
+
+    @property
+    def driving(self) -> bool:
+        """True while commands are being streamed."""
+        return self._timer.isActive()
+
+    def press(self, key: int) -> bool:
+        """Handle a key press (not auto-repeat). Returns True for drive keys."""
+        if key not in KEY_AXES:
+            return False
+        self._keys.add(key)
+        self._update()
+        return True
+
+    def release(self, key: int) -> bool:
+        """Handle a key release (not auto-repeat). Returns True for drive keys."""
+        if key not in KEY_AXES:
+            return False
+        self._keys.discard(key)
+        self._update()
+        return True
+
+    def set_slider(self, axis: str, value: float):
+        """Set the slider of an axis ('linear', 'angular', 'turret_rate'), -1 to 1."""
+        self._sliders[axis] = value
+        self._update()
+
+    def set_scales(self, drive: float, turret: float):
+        """Set the fraction of full speed held keys drive the tracks and the turret at."""
+        self._drive_scale = drive
+        self._turret_scale = turret
+        if self.driving:
+            self._send()
+
+    def stop(self):
+        """Release every key and slider and stop the robot."""
+        self._keys.clear()
+        self._sliders = dict.fromkeys(self._sliders, 0.0)
+        self._update()
+
+    def velocity(self) -> tuple:
+        """Current (linear, angular, turret_rate)."""
+        axes = dict(self._sliders)
+        for key in self._keys:
+            axis, direction = KEY_AXES[key]
+            scale = self._turret_scale if axis == 'turret_rate' else self._drive_scale
+            axes[axis] += direction * scale
+        return axes['linear'], axes['angular'], axes['turret_rate']
+
+    def _update(self):
+        """Send a change at once; stream while moving, end with a zero command."""
+        if any(self.velocity()):
+            self._send()
+            # (Re)start the period from this command
+            self._timer.start()
+        elif self.driving:
+            self._timer.stop()
+            self._send()
+
+    def _send(self):
+        self.command.emit(VelocityCommand(*self.velocity()))
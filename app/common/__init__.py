@@ -4,8 +4,8 @@ Common utilities module.
 Provides:
 - Configuration (Config)
 - Logging setup (setup_logging)
-- Serialization utilities (compress, decompress)
+- Serialization utilities (compress, decompress, encode, encode_frames, decode_message)
 """
 from .config import Config
 from .logging_wrapper import setup_logging
-from .serialization import compress, decompress, decompress_telemetry
+from .serialization import compress, decompress, decompress_telemetry, encode, encode_frames, decode_message
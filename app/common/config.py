@@ -22,6 +22,11 @@ def _env_str(key: str, default: str) -> str:
     return os.environ.get(key, default)
 
 
+def _env_bool(key: str, default: bool) -> bool:
+    """Get boolean from environment variable with default (1/true/yes/on)."""
+    return os.environ.get(key, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+
 class Config:
     """Robot configuration constants."""
 
@@ -29,16 +34,19 @@ class Config:
     # Network Ports
     # ==========================================================================
 
-    # REQ/REP handshake port (HelloServer/HelloClient)
+    # REQ/ROUTER handshake port (HandshakeServer/HeartbeatClient)
     HELLO_PORT = _env_int('HELLO_PORT', 5556)
 
     # Internal ports (server-side only, localhost)
     BRICKPI_PORT = _env_int('BRICKPI_PORT', 5557)  # BrickPi → Aggregator
     KINECT_PORT = _env_int('KINECT_PORT', 5558)    # Kinect → Aggregator
+    CAPTURE_PORT = _env_int('CAPTURE_PORT', 5561)  # PUB: mirror of published messages (0 = off)
+    CONTROL_PORT = _env_int('CONTROL_PORT', 5562)  # REP: publisher pause/resume/statistics (0 = off)
 
     # External ports (client-facing)
     TELEMETRY_PORT = _env_int('TELEMETRY_PORT', 5559)  # PUB: server → clients
     COMMAND_PORT = _env_int('COMMAND_PORT', 5560)      # PULL: clients → server
+    STREAM_PORT = _env_int('STREAM_PORT', 5563)        # ROUTER: stream sessions (0 = off)
 
     # ==========================================================================
     # Connection Settings
@@ -54,14 +62,223 @@ class Config:
     # Timing
     # ==========================================================================
 
-    # BrickPi update interval (seconds)
+    # BrickPi control loop period (seconds, one hardware update per tick)
     BRICKPI_CLOCK = _env_float('BRICKPI_CLOCK', 0.1)
 
-    # HelloServer sleep between handshakes (seconds)
+    # Slow sensor sampler (its own thread, off the control loop): seconds
+    # between reads of the CPU temperature, the battery voltage (i2c) and
+    # the psutil system stats (0 = never), and how much nicer than the
+    # server process the sampler thread runs
+    SAMPLER_TEMPERATURE_INTERVAL = _env_float('SAMPLER_TEMPERATURE_INTERVAL', 1.0)
+    SAMPLER_VOLTAGE_INTERVAL = _env_float('SAMPLER_VOLTAGE_INTERVAL', 1.0)
+    SAMPLER_SYSTEM_STATS_INTERVAL = _env_float('SAMPLER_SYSTEM_STATS_INTERVAL', 1.0)
+    SAMPLER_NICE = _env_int('SAMPLER_NICE', 10)
+
+    # Heartbeat interval the HandshakeServer advertises (seconds)
     HELLO_SLEEP = _env_float('HELLO_SLEEP', 1.0)
 
-    # Command queue max size
-    COMMAND_QUEUE_SIZE = _env_int('COMMAND_QUEUE_SIZE', 100)
+    # Seconds without a heartbeat after which a client no longer counts as connected
+    HANDSHAKE_SESSION_TIMEOUT = _env_float('HANDSHAKE_SESSION_TIMEOUT', 5.0)
+
+    # ==========================================================================
+    # Teleoperation (VelocityCommand, see doc/networking.md)
+    # ==========================================================================
+
+    # BrickPi motor speed of a full-rate VelocityCommand (motor range 0-255)
+    VELOCITY_MAX_SPEED = _env_int('VELOCITY_MAX_SPEED', 255)
+
+    # Rate at which the client GUI streams VelocityCommand while the
+    # operator drives (held keys or drive sliders), in Hz
+    VELOCITY_RATE_HZ = _env_float('VELOCITY_RATE_HZ', 20.0)
+
+    # Deadman: an actuator is stopped this many milliseconds after its last
+    # command, whatever the control loop period
+    DEADMAN_MS = _env_int('DEADMAN_MS', 300)
+
+    # Time to live the client gives every command (milliseconds, 0 = none,
+    # at most 65535): the server discards commands older than this, e.g.
+    # ones held in the client's socket queue during a Wi-Fi dropout
+    COMMAND_TTL_MS = _env_int('COMMAND_TTL_MS', 500)
+
+    # ==========================================================================
+    # Wire Format
+    # ==========================================================================
+
+    # Kinect frame encoding: 'multipart' (raw buffers, zero-copy) or 'pickle'
+    # (legacy compress() path). Clients decode both.
+    KINECT_WIRE_FORMAT = _env_str('KINECT_WIRE_FORMAT', 'multipart')
+
+    # Kinect video capture: 'rgb' (RGB888) or 'bayer' (raw sensor mosaic,
+    # one third of the bytes, demosaiced by the client)
+    KINECT_VIDEO_MODE = _env_str('KINECT_VIDEO_MODE', 'rgb')
+
+    # Kinect depth capture: 'raw' (11-bit disparity), 'mm' (millimetres) or
+    # 'registered' (millimetres aligned to the RGB image), converted by libfreenect
+    KINECT_DEPTH_MODE = _env_str('KINECT_DEPTH_MODE', 'raw')
+
+    # Seconds the Kinect process sleeps between checks while no client is
+    # subscribed to video or depth
+    KINECT_IDLE_SLEEP = _env_float('KINECT_IDLE_SLEEP', 0.1)
+
+    # Kinect capture: 'sync' (sync_get_video()/sync_get_depth() one after
+    # the other) or 'async' (libfreenect callbacks, video and depth received
+    # concurrently and paired by device timestamp)
+    KINECT_CAPTURE = _env_str('KINECT_CAPTURE', 'sync')
+
+    # Seconds before a failed callback capture (device lost, event
+    # processing error) is restarted
+    KINECT_CAPTURE_RESTART = _env_float('KINECT_CAPTURE_RESTART', 5.0)
+
+    # Largest device timestamp difference of a video/depth pair (about half
+    # a frame at 30 Hz always pairs the nearest frames), and the tick rate
+    # of the Kinect timestamp counter
+    KINECT_PAIR_TOLERANCE_MS = _env_float('KINECT_PAIR_TOLERANCE_MS', 17.0)
+    KINECT_CLOCK_HZ = _env_float('KINECT_CLOCK_HZ', 60000000.0)
+
+    # Encoder threads of the Kinect pipeline (capture -> encode -> deliver);
+    # messages of different topics encode in parallel and are sent in
+    # capture order. 0 = encode on the capture thread (the default; 3 uses
+    # the Pi's spare cores). Average per-stage latencies are logged every
+    # KINECT_STATS_INTERVAL seconds (0 = never)
+    KINECT_ENCODE_WORKERS = _env_int('KINECT_ENCODE_WORKERS', 0)
+    KINECT_STATS_INTERVAL = _env_float('KINECT_STATS_INTERVAL', 10.0)
+
+    # Kinect capture rate per stream in frames per second (0 = as fast as
+    # the camera delivers, 30 Hz). A stream the publisher has no room for is
+    # skipped before capture and retried a period (or KINECT_BACKOFF_MS) later
+    KINECT_VIDEO_FPS = _env_float('KINECT_VIDEO_FPS', 30.0)
+    KINECT_DEPTH_FPS = _env_float('KINECT_DEPTH_FPS', 30.0)
+    KINECT_BACKOFF_MS = _env_int('KINECT_BACKOFF_MS', 5)
+
+    # Telemetry/command encoding: 'binary' (fixed-layout struct codec) or
+    # 'pickle' (legacy compress() path). Receivers decode both.
+    PACKET_WIRE_FORMAT = _env_str('PACKET_WIRE_FORMAT', 'binary')
+
+    # ==========================================================================
+    # Stream Delivery (latest frame wins, see doc/networking.md)
+    # ==========================================================================
+
+    # Kinect messages queued between KinectProcess and the publisher; while
+    # the queue is full the Kinect skips frames instead of queueing stale ones
+    KINECT_HWM = _env_int('KINECT_HWM', 2)
+
+    # Messages (a chunk counts as one) queued per client on the telemetry
+    # publisher. A full client makes the publisher wait (XPUB_NODROP):
+    # frames stay pending and hold back capture, telemetry waits in a local
+    # backlog of TELEMETRY_BACKLOG messages, so it is never dropped while it
+    # fits (also while the publisher is paused)
+    TELEMETRY_PUB_SNDHWM = _env_int('TELEMETRY_PUB_SNDHWM', 16)
+
+    # Messages queued per client on the stream session socket and the client
+    # SUB socket (a full SUB socket stops reading, it does not drop).
+    # Session frames wait for credit, session telemetry in its own backlog
+    TELEMETRY_SNDHWM = _env_int('TELEMETRY_SNDHWM', 2)
+    TELEMETRY_RCVHWM = _env_int('TELEMETRY_RCVHWM', 2)
+    TELEMETRY_BACKLOG = _env_int('TELEMETRY_BACKLOG', 1000)
+
+    # Kernel socket buffers of the telemetry link in bytes (-1 = OS default).
+    # Auto-tuned buffers hold seconds of video on a slow link
+    TELEMETRY_SNDBUF = _env_int('TELEMETRY_SNDBUF', 65536)
+    TELEMETRY_RCVBUF = _env_int('TELEMETRY_RCVBUF', 65536)
+
+    # Pyramid level (downscale factor 1, 2 or 4) the GUI subscribes to for
+    # the streams tab and the point cloud; 2 or 4 suit a low-bandwidth console
+    STREAM_VIEW_LEVEL = _env_int('STREAM_VIEW_LEVEL', 1)
+    POINTCLOUD_LEVEL = _env_int('POINTCLOUD_LEVEL', 1)
+
+    # Region-of-interest crops: seconds a region lives on the server without
+    # a refresh, seconds between client refreshes, and regions served at once
+    ROI_TIMEOUT = _env_float('ROI_TIMEOUT', 3.0)
+    ROI_REFRESH_INTERVAL = _env_float('ROI_REFRESH_INTERVAL', 1.0)
+    ROI_MAX = _env_int('ROI_MAX', 4)
+
+    # Shared-memory ring between KinectProcess and the publisher: encoded
+    # frames are written once into a slot and sent from it without a copy;
+    # only a slot number crosses the loopback socket. Messages larger than
+    # a slot, or written while every slot is in use, go over the socket
+    # (off by default: every frame goes over the socket)
+    KINECT_RING = _env_bool('KINECT_RING', False)
+    KINECT_RING_SLOTS = _env_int('KINECT_RING_SLOTS', 24)
+    KINECT_RING_SLOT_BYTES = _env_int('KINECT_RING_SLOT_BYTES', 1024 * 1024)
+
+    # Kinect messages larger than this many bytes are published in chunks,
+    # so telemetry can pass a large frame on the link (0 = never split)
+    KINECT_CHUNK_BYTES = _env_int('KINECT_CHUNK_BYTES', 64 * 1024)
+
+    # Stream sessions (per-client credit-paced delivery on STREAM_PORT, see
+    # app/server/stream_sessions.py): the client receives through a session
+    # instead of subscribing, with up to STREAM_WINDOW messages in flight;
+    # it refreshes the session every STREAM_KEEPALIVE seconds and the server
+    # closes sessions silent for STREAM_SESSION_TIMEOUT seconds
+    STREAM_SESSION = _env_bool('STREAM_SESSION', False)
+    STREAM_WINDOW = _env_int('STREAM_WINDOW', 2)
+    STREAM_KEEPALIVE = _env_float('STREAM_KEEPALIVE', 1.0)
+    STREAM_SESSION_TIMEOUT = _env_float('STREAM_SESSION_TIMEOUT', 5.0)
+
+    # Messages queued for a recorder on the capture socket before it loses
+    # messages (each may hold a frame ring slot)
+    CAPTURE_HWM = _env_int('CAPTURE_HWM', 4)
+
+    # Milliseconds between publisher send retries while a client is full
+    PUBLISHER_RETRY_MS = _env_int('PUBLISHER_RETRY_MS', 5)
+
+    # Milliseconds unsent frames are kept when a frame socket closes
+    FRAME_LINGER_MS = _env_int('FRAME_LINGER_MS', 0)
+
+    # Seconds between dropped-frame counter log lines (0 = never log)
+    DROP_LOG_INTERVAL = _env_float('DROP_LOG_INTERVAL', 10.0)
+
+    # ==========================================================================
+    # Compression (see app/common/serialization.py)
+    # ==========================================================================
+
+    # Compressor per stream: 'none', 'zlib', 'zlib-1'..'zlib-9', 'lz4',
+    # 'zstd', 'zstd-1'/'zstd-3'/'zstd-9' (lz4/zstd only when installed),
+    # or 'auto' to pick by measured cost on the current link. Depth also
+    # accepts 'rvl' (lossless RVL/11-bit depth codec, depth_codec.py);
+    # video also accepts the lossy 'jpeg' (needs OpenCV) and 'yuv420'
+    # (video_codec.py)
+    COMPRESS_HEARTBEAT = _env_str('COMPRESS_HEARTBEAT', 'none')
+    COMPRESS_COMMAND = _env_str('COMPRESS_COMMAND', 'none')
+    COMPRESS_TELEMETRY = _env_str('COMPRESS_TELEMETRY', 'none')
+    COMPRESS_KINECT = _env_str('COMPRESS_KINECT', 'zlib-1')  # pickle wire format
+    COMPRESS_VIDEO = _env_str('COMPRESS_VIDEO', 'zlib-1')
+    COMPRESS_BAYER = _env_str('COMPRESS_BAYER', 'zlib-1')  # KINECT_VIDEO_MODE=bayer
+    COMPRESS_DEPTH = _env_str('COMPRESS_DEPTH', 'zlib-1')
+
+    # Auto mode: candidates (ones not installed here, or that a connected
+    # client cannot decode, are skipped; lz4/zstd-1 can be added once the
+    # clients have them), messages between re-measurements, and the
+    # bandwidth floor used when the link is idle
+    COMPRESS_AUTO_CANDIDATES = _env_str('COMPRESS_AUTO_CANDIDATES', 'none,zlib-1,zlib-6')
+    COMPRESS_AUTO_INTERVAL = _env_int('COMPRESS_AUTO_INTERVAL', 30)
+    COMPRESS_AUTO_MIN_MBPS = _env_float('COMPRESS_AUTO_MIN_MBPS', 5.0)
+
+    # JPEG video: starting (best) quality, lowest quality the adaptation may
+    # reach, and chroma subsampling at full quality ('444', '422', '420')
+    VIDEO_JPEG_QUALITY = _env_int('VIDEO_JPEG_QUALITY', 85)
+    VIDEO_JPEG_MIN_QUALITY = _env_int('VIDEO_JPEG_MIN_QUALITY', 40)
+    VIDEO_JPEG_CHROMA = _env_str('VIDEO_JPEG_CHROMA', '444')
+
+    # Step JPEG chroma/quality down when the frame rate falls below the
+    # target or the frames outgrow the measured link, back up when it recovers
+    VIDEO_ADAPTIVE = _env_bool('VIDEO_ADAPTIVE', True)
+    VIDEO_TARGET_FPS = _env_float('VIDEO_TARGET_FPS', 10.0)
+    VIDEO_ADAPT_INTERVAL = _env_int('VIDEO_ADAPT_INTERVAL', 15)  # frames
+
+    # Temporal coding of Kinect streams (keyframe + dirty-tile residuals,
+    # see app/common/temporal_codec.py). Multipart wire format only; streams
+    # using a lossy compressor (jpeg, yuv420) are always sent whole.
+    KINECT_TEMPORAL = _env_bool('KINECT_TEMPORAL', False)
+    TEMPORAL_KEYFRAME_INTERVAL = _env_int('TEMPORAL_KEYFRAME_INTERVAL', 30)  # frames
+    TEMPORAL_TILE_SIZE = _env_int('TEMPORAL_TILE_SIZE', 16)                  # pixels
+
+    # Largest per-pixel change still treated as unchanged (0 = lossless)
+    TEMPORAL_VIDEO_THRESHOLD = _env_int('TEMPORAL_VIDEO_THRESHOLD', 4)
+    TEMPORAL_DEPTH_THRESHOLD = _env_int('TEMPORAL_DEPTH_THRESHOLD', 0)
+
+    # Minimum seconds between client keyframe requests after frame loss
+    KEYFRAME_REQUEST_INTERVAL = _env_float('KEYFRAME_REQUEST_INTERVAL', 1.0)
 
     # ==========================================================================
     # Kinect Calibration (for point cloud conversion)
@@ -75,6 +292,12 @@ class Config:
     KINECT_CX = _env_float('KINECT_CX', 339.5)
     KINECT_CY = _env_float('KINECT_CY', 242.7)
 
+    # RGB camera intrinsics, used for registered depth (already in RGB view)
+    KINECT_RGB_FX = _env_float('KINECT_RGB_FX', 529.2)
+    KINECT_RGB_FY = _env_float('KINECT_RGB_FY', 525.6)
+    KINECT_RGB_CX = _env_float('KINECT_RGB_CX', 328.9)
+    KINECT_RGB_CY = _env_float('KINECT_RGB_CY', 267.5)
+
     # ==========================================================================
     # Depth Processing
     # ==========================================================================
@@ -100,6 +323,7 @@ class Config:
     # Use depth-based coloring (True) or attempt RGB alignment (False)
     POINTCLOUD_DEPTH_COLORING = True
 
-    # Subsample stride (2 = every 2nd pixel, 4 = every 4th, etc.)
+    # Subsample stride in full-resolution pixels (2 = every 2nd pixel, 4 =
+    # every 4th, etc.); reduced pyramid levels are already subsampled
     POINTCLOUD_STRIDE = _env_int('POINTCLOUD_STRIDE', 2)
 
@@ -0,0 +1,76 @@
+"""
+Dropped message counters for the latest-frame-wins stream paths.
+
+KinectProcess, the telemetry publisher and TelemetryClient each drop
+stale frames rather than queue them (see doc/networking.md). DropCounter
+keeps the totals per stream and logs them every DROP_LOG_INTERVAL seconds.
+"""
+import logging
+import time
+from collections import Counter
+
+from app.common.config import Config
+
+
+class DropCounter:
+    """
+    Counts dropped messages per stream.
+
+    Args:
+        name: What is being dropped, used in the log line
+        logger: Logger for the periodic totals (defaults to this module's)
+        interval: Seconds between log lines (defaults to Config.DROP_LOG_INTERVAL)
+    """
+
+    def __init__(self, name: str, logger: logging.Logger = None, interval: float = None):
+        self._name = name
+        self._logger = logger or logging.getLogger(__name__)
+        self._interval = Config.DROP_LOG_INTERVAL if interval is None else interval
+        self._totals = Counter()
+        self._logged = Counter()
+        self._last_log = time.monotonic()
+
+    @property
+    def totals(self) -> dict:
+        """Messages dropped since start, per stream."""
+        return dict(self._totals)
+
+    @property
+    def total(self) -> int:
+        """Messages dropped since start, all streams."""
+        return sum(self._totals.values())
+
+    def drop(self, stream, count: int = 1):
+        """
+        Record dropped messages and log the totals when the interval elapsed.
+
+        Args:
+            stream: Stream (topic or name) the messages belonged to
+            count: Number of messages dropped
+        """
+        self._totals[stream] += count
+        self.maybe_log()
+
+    def maybe_log(self):
+        """Log the drops since the last log line, if any and the interval elapsed."""
+        if self._interval <= 0:
+            return
+        now = time.monotonic()
+        elapsed = now - self._last_log
+        if elapsed < self._interval:
+            return
+        recent = self._totals - self._logged
+        self._last_log = now
+        if not recent:
+            return
+        self._logged = Counter(self._totals)
+        self._logger.info("Dropped {} in the last {:.0f}s: {} (total {})".format(
+            self._name, elapsed, _format(recent), self.total))
+
+
+def _format(counts: Counter) -> str:
+    return ', '.join('{}={}'.format(_label(stream), count) for stream, count in sorted(counts.items()))
+
+
+def _label(stream) -> str:
+    return stream.decode() if isinstance(stream, bytes) else str(stream)
@@ -0,0 +1,143 @@
+"""
+Resolution pyramids and region-of-interest crops for Kinect frames.
+
+KinectProcess publishes each stream at several pyramid levels (downscale
+factors 1, 2, 4, see app/networking/topics.py). Each level is built from
+the one below it by 2x2 binning, once per captured frame:
+
+Depth:
+    Min-pooling over valid pixels, so a near obstacle covering a single
+    full-resolution pixel survives into every level. Invalid readings
+    (raw 2047, or 0 in the millimetre formats) only win when the whole
+    block is invalid.
+
+RGB video:
+    2x2 box average.
+
+Bayer video:
+    Each of the four mosaic phases is averaged separately, so the result
+    is again a GRBG mosaic (at half the size) the client can demosaic.
+
+Region-of-interest crops (crop_region()) are taken from the full
+resolution frame on even coordinates, which keeps the Bayer phase.
+"""
+import numpy as np
+
+from app.networking import VIDEO_BAYER, DEPTH_RAW
+
+
+def _crop(array: np.ndarray, multiple: int) -> np.ndarray:
+    """Crop height/width down to a multiple (640x480 never needs it)."""
+    height = array.shape[0] - array.shape[0] % multiple
+    width = array.shape[1] - array.shape[1] % multiple
+    return array[:height, :width]
+
+
+def _blocks(array: np.ndarray) -> np.ndarray:
+    """View an (H, W, ...) array as (H/2, 2, W/2, 2, ...) blocks."""
+    array = _crop(array, 2)
+    height, width = array.shape[:2]
+    return array.reshape((height // 2, 2, width // 2, 2) + array.shape[2:])
+
+
+def halve_depth(depth: np.ndarray, depth_format: str = DEPTH_RAW) -> np.ndarray:
+    """
+    Halve a depth frame by min-pooling 2x2 blocks.
+
+    Args:
+        depth: (H, W) uint16 depth array
+        depth_format: DEPTH_RAW (invalid = 2047, larger = farther) or a
+            millimetre format (invalid = 0)
+
+    Returns:
+        (H/2, W/2) uint16 depth array
+    """
+    blocks = _blocks(depth)
+    if depth_format != DEPTH_RAW:
+        # Shift 0 (no reading) to 65535 with uint16 wrap-around, then back
+        blocks = blocks - np.uint16(1)
+    # (The raw no-reading value 2047 is the largest, so min() skips it)
+    result = np.minimum(np.minimum(blocks[:, 0, :, 0], blocks[:, 0, :, 1]),
+                        np.minimum(blocks[:, 1, :, 0], blocks[:, 1, :, 1]))
+    if depth_format != DEPTH_RAW:
+        result += np.uint16(1)
+    return result
+
+
+def halve_video(frame: np.ndarray, video_format: str) -> np.ndarray:
+    """
+    Halve a video frame by 2x2 averaging (per mosaic phase for Bayer).
+
+    Args:
+        frame: (H, W, 3) RGB or (H, W) Bayer uint8 array
+        video_format: VIDEO_RGB or VIDEO_BAYER
+
+    Returns:
+        Frame of the same format at half the size
+    """
+    if video_format == VIDEO_BAYER:
+        # (H, W) mosaic -> (H/2, W/2, 2, 2) phase planes: cell row, cell
+        # column, then the phase within the 2x2 cell
+        cells = _blocks(_crop(frame, 4)).transpose(0, 2, 1, 3)
+        planes = cells.reshape(cells.shape[0], cells.shape[1], 4)
+        halved = _average(planes)
+        height, width = halved.shape[:2]
+        return halved.reshape(height, width, 2, 2).transpose(0, 2, 1, 3).reshape(height * 2, width * 2)
+    return _average(frame)
+
+
+def _average(array: np.ndarray) -> np.ndarray:
+    """Average 2x2 blocks of a uint8 (H, W, ...) array with rounding."""
+    blocks = _blocks(array).astype(np.uint16)
+    total = blocks[:, 0, :, 0] + blocks[:, 0, :, 1] + blocks[:, 1, :, 0] + blocks[:, 1, :, 1]
+    return ((total + 2) >> 2).astype(np.uint8)
+
+
+def build_pyramid(array: np.ndarray, levels, halve) -> dict:
+    """
+    Build the requested pyramid levels of one frame.
+
+    Each level is halved from the previous one, so the shared levels are
+    only computed once however many are requested.
+
+    Args:
+        array: Full-resolution frame
+        levels: Iterable of downscale factors (powers of two)
+        halve: Function halving one frame, e.g.
+            lambda depth: halve_depth(depth, depth_format)
+
+    Returns:
+        {level: array}
+    """
+    wanted = set(levels)
+    pyramid = {}
+    current, factor = array, 1
+    while wanted:
+        if factor in wanted:
+            pyramid[factor] = current
+            wanted.discard(factor)
+        if not wanted or factor > max(wanted):
+            break
+        current, factor = halve(current), factor * 2
+    return pyramid
+
+
+def crop_region(array: np.ndarray, x: int, y: int, width: int, height: int) -> tuple:
+    """
+    Crop a region of interest, aligned to even coordinates and clipped to the frame.
+
+    Args:
+        array: (H, W, ...) full-resolution frame
+        x, y: Requested top-left corner
+        width, height: Requested size
+
+    Returns:
+        Tuple of (crop view, (x, y) origin actually used); the crop is
+        empty if the region lies outside the frame
+    """
+    frame_height, frame_width = array.shape[:2]
+    x0 = min(max(x, 0), frame_width) & ~1
+    y0 = min(max(y, 0), frame_height) & ~1
+    x1 = min(x + width + 1, frame_width) & ~1
+    y1 = min(y + height + 1, frame_height) & ~1
+    return array[y0:max(y0, y1), x0:max(x0, x1)], (x0, y0)
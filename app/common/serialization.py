@@ -2,29 +2,472 @@
 Serialization utilities for network communication.
 
 Provides compress/decompress functions for sending Python objects
-over ZMQ sockets using pickle and zlib compression.
+over ZMQ sockets using pickle and a pluggable compressor registry, plus
+a multipart framing mode for KinectPacket that sends the numpy buffers
+as separate frames.
+
+Wire format versioning:
+    The first byte of every message identifies its encoding:
+
+    - 0xC0-0xCF: compress() output, low nibble is the compressor id
+    - 0x10/0x20: binary telemetry/command packets (app.networking.codec)
+    - FRAMES_TAG: multipart Kinect header frame, followed by its version
+      (FRAMES_MIN_VERSION..FRAMES_VERSION are read and written)
+    - CHUNK_TAG: one chunk of a large multipart message (split_message())
+    - 0x78: legacy zlib'd pickle (older servers/clients)
+
+    decompress() and decode_message() accept all of them transparently.
+
+Compression policy:
+    Each stream ('telemetry', 'command', 'heartbeat', 'kinect', 'video',
+    'depth') picks a compressor by name through Config.COMPRESS_*. Depth
+    can also use 'rvl', the specialised codec in depth_codec.py, and video
+    the lossy 'jpeg'/'yuv420' codecs in video_codec.py ('jpeg' adapts its
+    quality through an AdaptiveJpegCompressor). The name 'auto' selects an
+    AutoCompressor that periodically measures the candidates and picks the
+    lowest end-to-end cost for the current link. Compressors the receivers
+    cannot decode (set_decodable_source()) are never used; a stream whose
+    policy names one, or an optional codec that is not installed (lz4,
+    zstd), falls back to FALLBACK_COMPRESSOR.
 
 Formerly named Misc.py.
 """
+import logging
 import pickle
+import struct
+import time
 import zlib
 
-from app.networking import TelemetryPacket
+import numpy as np
+
+from app.common import depth_codec, video_codec
+from app.common.config import Config
+from app.common.temporal_codec import TemporalEncoder, TemporalDecoder, is_keyframe
+from app.networking import (
+    HeartbeatPacket, CommandPacket, KinectPacket, TelemetryPacket, StatsPacket,
+    VIDEO_RGB, VIDEO_BAYER, DEPTH_RAW, DEPTH_MM, DEPTH_REGISTERED,
+    can_encode, is_encoded, encode_packet, decode_packet,
+)
+
+# Optional compressors (registered only when installed)
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # Use protocol 4 for compatibility with Python 3.4+
 # (Protocol 5 requires Python 3.8+ which older Raspberry Pi images may lack)
 PICKLE_PROTOCOL = 4
 
+logger = logging.getLogger(__name__)
+
+# =============================================================================
+# Compressor Registry
+# =============================================================================
+
+# compress() header byte is COMPRESSED_TAG | compressor id
+COMPRESSED_TAG = 0xC0
+_COMPRESSED_MASK = 0xF0
+
+# Compressor ids (all zlib levels share one id, decompression is level-agnostic)
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_LZ4 = 2
+CODEC_ZSTD = 3
+CODEC_RVL = 4
+CODEC_YUV420 = 5
+CODEC_JPEG = 6
+
+# Stateful keyframe/delta coding (frame buffers only, see temporal_codec.py);
+# the payload names the compressor used inside it
+CODEC_TEMPORAL = 15
+
+AUTO = 'auto'
+
+# Used instead of a compressor the receivers cannot decode (zlib is always there)
+FALLBACK_COMPRESSOR = 'zlib-1'
+
+
+class Compressor:
+    """A named byte compressor in the registry."""
+
+    def __init__(self, name: str, codec_id: int, compress, decompress, lossy: bool = False):
+        self.name = name
+        self.codec_id = codec_id
+        self.compress = compress
+        self.decompress = decompress
+        self.lossy = lossy
+
+    def __repr__(self):
+        return "Compressor({})".format(self.name)
+
+
+# name -> Compressor, codec id -> decompress function
+_compressors = {}
+_decompressors = {}
+
+
+def register_compressor(name: str, codec_id: int, compress, decompress, lossy: bool = False):
+    """
+    Add a compressor to the registry.
+
+    Args:
+        name: Policy name used in Config (e.g. 'zlib-6')
+        codec_id: Id written on the wire (0-15)
+        compress: Callable bytes-like -> bytes-like
+        decompress: Callable bytes-like -> bytes-like
+        lossy: True if decompress() does not return the exact input
+    """
+    _compressors[name] = Compressor(name, codec_id, compress, decompress, lossy)
+    _decompressors[codec_id] = decompress
+
+
+def get_compressor(name: str) -> Compressor:
+    """Look up a registered compressor by name."""
+    try:
+        return _compressors[name]
+    except KeyError:
+        raise ValueError("Unknown or unavailable compressor: {}".format(name)) from None
+
+
+def available_compressors() -> list:
+    """Names of all registered compressors."""
+    return list(_compressors)
+
+
+def _zlib_level(level: int):
+    return lambda data: zlib.compress(data, level)
+
+
+register_compressor('none', CODEC_NONE, lambda data: data, lambda data: data)
+register_compressor('zlib', CODEC_ZLIB, zlib.compress, zlib.decompress)
+for _level in range(1, 10):
+    register_compressor('zlib-{}'.format(_level), CODEC_ZLIB, _zlib_level(_level), zlib.decompress)
+
+if lz4_frame is not None:
+    register_compressor('lz4', CODEC_LZ4, lz4_frame.compress, lz4_frame.decompress)
+
+if zstandard is not None:
+    _zstd_decompressor = zstandard.ZstdDecompressor()
+    for _level in (1, 3, 9):
+        register_compressor(
+            'zstd-{}'.format(_level), CODEC_ZSTD,
+            zstandard.ZstdCompressor(level=_level).compress, _zstd_decompressor.decompress)
+    _compressors['zstd'] = _compressors['zstd-3']
+
+# Lossless depth codec (uint16 depth buffers only, see depth_codec.py)
+register_compressor('rvl', CODEC_RVL, depth_codec.encode, depth_codec.decode)
+
+# Lossy RGB video codecs ((H, W, 3) uint8 frame buffers only, see video_codec.py)
+register_compressor(
+    'yuv420', CODEC_YUV420, video_codec.encode_yuv420, video_codec.decode_yuv420, lossy=True)
+if video_codec.jpeg_available():
+    register_compressor(
+        'jpeg', CODEC_JPEG,
+        lambda data: video_codec.encode_jpeg(data, Config.VIDEO_JPEG_QUALITY, Config.VIDEO_JPEG_CHROMA),
+        video_codec.decode_jpeg, lossy=True)
+
+
+def decompress_buffer(codec_id: int, data):
+    """Decompress a buffer written by the compressor with the given id."""
+    try:
+        decompressor = _decompressors[codec_id]
+    except KeyError:
+        raise ValueError("Compressor id {} is not available".format(codec_id)) from None
+    return decompressor(data)
+
+
+# =============================================================================
+# Link Bandwidth / Auto Selection
+# =============================================================================
+
+_bandwidth_source = None
+
+
+def set_bandwidth_source(source):
+    """
+    Set the callable that reports the current link bandwidth in Mbps.
+
+    The server wires this to SystemStats.net_bandwidth_mbps (shared with
+    the Kinect process through a multiprocessing.Value).
+    """
+    global _bandwidth_source
+    _bandwidth_source = source
+
+
+def measured_bandwidth_mbps() -> float:
+    """Link throughput reported by the bandwidth source, None if unknown."""
+    if _bandwidth_source is None:
+        return None
+    try:
+        measured = float(_bandwidth_source())
+    except Exception as e:
+        logger.debug("Bandwidth source failed: {}".format(e))
+        return None
+    return measured if measured > 0 else None
+
+
+_decodable_source = None
+
+
+def set_decodable_source(source):
+    """
+    Set the callable that reports the compressor ids every receiver can decode.
+
+    The server wires this to the compressors negotiated with the connected
+    clients (HandshakeServer, a bitmask of codec ids shared through a
+    multiprocessing.Value). Without a source, or while it reports 0, every
+    registered compressor may be used.
+    """
+    global _decodable_source
+    _decodable_source = source
+
+
+def is_decodable(compressor: Compressor) -> bool:
+    """True if the receivers can decode the compressor's output."""
+    if _decodable_source is None:
+        return True
+    try:
+        mask = int(_decodable_source())
+    except Exception as e:
+        logger.debug("Decodable source failed: {}".format(e))
+        return True
+    return not mask or bool(mask & (1 << compressor.codec_id))
+
+
+def codec_mask(names) -> int:
+    """Bitmask of the codec ids of the registered compressors among names."""
+    mask = 0
+    for name in names:
+        if name in _compressors:
+            mask |= 1 << _compressors[name].codec_id
+    return mask
+
+
+def link_bandwidth_mbps() -> float:
+    """Current link bandwidth estimate, never below COMPRESS_AUTO_MIN_MBPS."""
+    return max(measured_bandwidth_mbps() or 0.0, Config.COMPRESS_AUTO_MIN_MBPS)
+
+
+class AutoCompressor:
+    """
+    Picks the compressor with the lowest end-to-end cost for the link.
+
+    Every `interval` messages all candidates compress the current payload;
+    cost = compress time + compressed bytes / link bandwidth. The winner is
+    used until the next probe. Probe output is reused, so a probe never
+    compresses the same payload twice with the chosen codec. Candidates the
+    receivers cannot decode are left out of every probe.
+    """
+
+    def __init__(self, candidates: list = None, interval: int = None):
+        names = candidates or Config.COMPRESS_AUTO_CANDIDATES.split(',')
+        self._candidates = [_compressors[name] for name in names if name in _compressors]
+        if not self._candidates:
+            self._candidates = [_compressors['zlib-1']]
+        self._interval = interval or Config.COMPRESS_AUTO_INTERVAL
+        self._count = 0
+        self._current = self._candidates[0]
+
+    @property
+    def current(self) -> Compressor:
+        return self._current
+
+    def compress(self, data) -> tuple:
+        """
+        Compress data with the currently selected compressor.
+
+        Returns:
+            Tuple of (Compressor used, compressed data)
+        """
+        candidates = [compressor for compressor in self._candidates if is_decodable(compressor)]
+        if not candidates:
+            candidates = [_compressors[FALLBACK_COMPRESSOR]]
+        if self._count % self._interval == 0 or self._current not in candidates:
+            result = self._probe(data, candidates)
+        else:
+            result = (self._current, self._current.compress(data))
+        self._count += 1
+        return result
+
+    def _probe(self, data, candidates: list) -> tuple:
+        bytes_per_second = link_bandwidth_mbps() * 1e6 / 8
+        best = None
+        for compressor in candidates:
+            start = time.perf_counter()
+            output = compressor.compress(data)
+            elapsed = time.perf_counter() - start
+            cost = elapsed + memoryview(output).nbytes / bytes_per_second
+            if best is None or cost < best[0]:
+                best = (cost, compressor, output)
+
+        cost, compressor, output = best
+        if compressor is not self._current:
+            logger.debug("Auto compressor: {} -> {} ({:.1f} ms/msg)".format(
+                self._current.name, compressor.name, cost * 1000))
+        self._current = compressor
+        return compressor, output
+
+
+class AdaptiveJpegCompressor:
+    """
+    JPEG video compressor following a QualityController.
+
+    Quality and chroma subsampling start at VIDEO_JPEG_QUALITY /
+    VIDEO_JPEG_CHROMA and move along the controller's ladder as the
+    measured frame rate and link throughput change.
+    """
+
+    def __init__(self):
+        self._compressor = get_compressor('jpeg')
+        self._controller = video_codec.QualityController(
+            max_quality=Config.VIDEO_JPEG_QUALITY,
+            min_quality=Config.VIDEO_JPEG_MIN_QUALITY,
+            chroma=Config.VIDEO_JPEG_CHROMA,
+            target_fps=Config.VIDEO_TARGET_FPS,
+            interval=Config.VIDEO_ADAPT_INTERVAL)
+
+    @property
+    def setting(self) -> tuple:
+        """Current (quality, chroma) pair."""
+        return self._controller.setting
+
+    def compress(self, data) -> tuple:
+        """
+        Encode a frame at the current setting.
+
+        Returns:
+            Tuple of (Compressor used, JPEG bytes)
+        """
+        quality, chroma = self._controller.setting
+        payload = video_codec.encode_jpeg(data, quality, chroma)
+        if self._controller.update(len(payload), time.monotonic(), measured_bandwidth_mbps()):
+            logger.debug("JPEG video: quality {} -> {}, chroma {} -> {}".format(
+                quality, self._controller.setting[0], chroma, self._controller.setting[1]))
+        return self._compressor, payload
+
+
+# Stream name -> Config attribute holding its compressor name
+_STREAM_POLICY = {
+    'heartbeat': 'COMPRESS_HEARTBEAT',
+    'command': 'COMPRESS_COMMAND',
+    'telemetry': 'COMPRESS_TELEMETRY',
+    'kinect': 'COMPRESS_KINECT',
+    'video': 'COMPRESS_VIDEO',
+    'bayer': 'COMPRESS_BAYER',
+    'depth': 'COMPRESS_DEPTH',
+}
+
+# (stream, policy name, pyramid level) -> AutoCompressor/AdaptiveJpegCompressor,
+# created on first use
+_stateful_compressors = {}
+
+# (stream, policy name) already logged as undecodable
+_fallbacks_logged = set()
+
+
+def stream_for(data: object) -> str:
+    """Map a packet to its compression policy stream name."""
+    if isinstance(data, (TelemetryPacket, StatsPacket)):
+        return 'telemetry'
+    if isinstance(data, CommandPacket):
+        return 'command'
+    if isinstance(data, HeartbeatPacket):
+        return 'heartbeat'
+    return 'kinect'
+
+
+def compress_stream(stream: str, data, level: int = 1) -> tuple:
+    """
+    Compress a buffer according to the stream's Config policy.
+
+    Args:
+        stream: Policy stream name
+        data: Buffer to compress
+        level: Pyramid level of a Kinect frame; adaptive compressors keep
+            separate measurements per level
+
+    Returns:
+        Tuple of (Compressor used, compressed data)
+    """
+    name = _policy_name(stream)
+    if name != AUTO:
+        compressor = _compressors.get(name)
+        if compressor is None:
+            reason = "{} is not installed".format(name)
+        elif not is_decodable(compressor):
+            reason = "A client cannot decode {}".format(name)
+        else:
+            reason = None
+        if reason is not None:
+            if (stream, name) not in _fallbacks_logged:
+                _fallbacks_logged.add((stream, name))
+                logger.warning("{} ({} stream), using {}".format(reason, stream, FALLBACK_COMPRESSOR))
+            name = FALLBACK_COMPRESSOR
+    if name == AUTO or (name == 'jpeg' and Config.VIDEO_ADAPTIVE):
+        key = (stream, name, level)
+        stateful = _stateful_compressors.get(key)
+        if stateful is None:
+            factory = AutoCompressor if name == AUTO else AdaptiveJpegCompressor
+            stateful = _stateful_compressors[key] = factory()
+        return stateful.compress(data)
+
+    compressor = get_compressor(name)
+    return compressor, compressor.compress(data)
+
+
+def _policy_name(stream: str) -> str:
+    return getattr(Config, _STREAM_POLICY.get(stream, 'COMPRESS_KINECT'))
+
+
+def is_lossy_stream(stream: str) -> bool:
+    """True if the stream's policy names a lossy compressor."""
+    name = _policy_name(stream)
+    if name == AUTO:
+        return any(_compressors[candidate].lossy
+                   for candidate in Config.COMPRESS_AUTO_CANDIDATES.split(',')
+                   if candidate in _compressors)
+    return get_compressor(name).lossy
+
 
-def compress(data: object) -> bytes:
-    """Compress a Python object for network transmission."""
+# =============================================================================
+# Packet Serialization
+# =============================================================================
+
+def compress(data: object, compressor: str = None) -> bytes:
+    """
+    Compress a Python object for network transmission.
+
+    Args:
+        data: Object to pickle
+        compressor: Compressor name (default: Config policy for the packet type)
+
+    Returns:
+        Header byte (COMPRESSED_TAG | compressor id) followed by the payload
+    """
     p = pickle.dumps(data, protocol=PICKLE_PROTOCOL)
-    return zlib.compress(p)
+    if compressor is None:
+        used, payload = compress_stream(stream_for(data), p)
+    else:
+        used = get_compressor(compressor)
+        payload = used.compress(p)
+    return bytes((COMPRESSED_TAG | used.codec_id,)) + payload
 
 
 def decompress(data: bytes) -> object:
     """Decompress received network data back to Python object."""
-    p = zlib.decompress(data)
+    if is_encoded(data):
+        return decode_packet(data)
+    if data[0] & _COMPRESSED_MASK == COMPRESSED_TAG:
+        p = decompress_buffer(data[0] & ~_COMPRESSED_MASK, memoryview(data)[1:])
+    else:
+        # Legacy payload: bare zlib stream
+        p = zlib.decompress(data)
     return pickle.loads(p)
 
 
@@ -33,6 +476,444 @@ def decompress_telemetry(data: bytes) -> TelemetryPacket:
     return decompress(data)
 
 
+def encode(data: object) -> bytes:
+    """
+    Encode a packet for transmission, preferring the binary codec.
+
+    Telemetry and command packets use the fixed-layout struct codec unless
+    Config.PACKET_WIRE_FORMAT is 'pickle'; everything else goes through
+    compress(). The result is always readable by decompress().
+    """
+    if Config.PACKET_WIRE_FORMAT == 'binary' and can_encode(data):
+        return encode_packet(data)
+    return compress(data)
+
+
+# =============================================================================
+# Multipart Frame Format
+# =============================================================================
+
+# First byte of a multipart header frame (never 0x78, the zlib CMF byte)
+FRAMES_TAG = 0xF1
+# Newest header layout, and the oldest one still read and written
+FRAMES_VERSION = 6
+FRAMES_MIN_VERSION = 2
+
+# Message types carried in the header frame
+MSG_KINECT = 1
+
+# Buffer stream identifiers
+STREAM_VIDEO = 1
+STREAM_DEPTH = 2
+STREAM_BAYER = 3             # video as a raw Bayer mosaic (KinectPacket.video_format)
+STREAM_DEPTH_MM = 4          # depth in millimetres (KinectPacket.depth_format)
+STREAM_DEPTH_REGISTERED = 5  # millimetres, registered to the RGB image
+
+# Stream id -> compression policy name
+_STREAM_NAMES = {
+    STREAM_VIDEO: 'video',
+    STREAM_DEPTH: 'depth',
+    STREAM_BAYER: 'bayer',
+    STREAM_DEPTH_MM: 'depth',
+    STREAM_DEPTH_REGISTERED: 'depth',
+}
+
+# Packet video_format/depth_format -> stream id, and back
+_VIDEO_STREAMS = {VIDEO_RGB: STREAM_VIDEO, VIDEO_BAYER: STREAM_BAYER}
+_DEPTH_STREAMS = {
+    DEPTH_RAW: STREAM_DEPTH,
+    DEPTH_MM: STREAM_DEPTH_MM,
+    DEPTH_REGISTERED: STREAM_DEPTH_REGISTERED,
+}
+_VIDEO_FORMATS = {stream: fmt for fmt, stream in _VIDEO_STREAMS.items()}
+_DEPTH_FORMATS = {stream: fmt for fmt, stream in _DEPTH_STREAMS.items()}
+
+# tag, version, message type, sequence, time, tilt state, tilt degrees,
+# the fields added by each version (below), buffer count
+_FRAMES_BASE = '!BBBIdif'
+
+# (version, struct format, fields) added to the header by each version
+_FRAMES_FIELDS = (
+    (3, 'B', ('level',)),
+    (4, 'BHH', ('has_roi', 'roi_x', 'roi_y')),
+    (5, 'fIf', ('capture_fps', 'skipped_frames', 'encode_ms')),
+    (6, 'II', ('video_timestamp', 'depth_timestamp')),
+)
+
+# Values of the fields an older header does not carry
+_FRAMES_DEFAULTS = {
+    'level': 1, 'has_roi': 0, 'roi_x': 0, 'roi_y': 0,
+    'capture_fps': 0.0, 'skipped_frames': 0, 'encode_ms': 0.0,
+    'video_timestamp': 0, 'depth_timestamp': 0,
+}
+
+
+def _frames_header(version: int) -> tuple:
+    """(struct, added field names) of one header version."""
+    added = [(fmt, names) for since, fmt, names in _FRAMES_FIELDS if since <= version]
+    layout = struct.Struct(_FRAMES_BASE + ''.join(fmt for fmt, _ in added) + 'B')
+    return layout, tuple(name for _, names in added for name in names)
+
+
+# version -> (struct, added field names)
+_FRAMES_HEADERS = {version: _frames_header(version) for version in range(FRAMES_MIN_VERSION, FRAMES_VERSION + 1)}
+
+# stream id, compressor id, numpy dtype string (e.g. '<u2'), ndim, shape (up to 3 dims)
+_BUFFER_DESCRIPTOR = struct.Struct('!BB4sBHHH')
+
+
+_TEMPORAL_THRESHOLDS = {
+    'video': 'TEMPORAL_VIDEO_THRESHOLD',
+    'bayer': 'TEMPORAL_VIDEO_THRESHOLD',
+    'depth': 'TEMPORAL_DEPTH_THRESHOLD',
+}
+
+
+def new_temporal_encoder(stream: str, level: int = 1) -> TemporalEncoder:
+    """Create a TemporalEncoder for a stream (at a pyramid level) using its Config policy."""
+    def compress_array(array):
+        compressor, payload = compress_stream(stream, array, level)
+        return compressor.codec_id, payload
+
+    return TemporalEncoder(
+        compress_array,
+        keyframe_interval=Config.TEMPORAL_KEYFRAME_INTERVAL,
+        tile=Config.TEMPORAL_TILE_SIZE,
+        threshold=getattr(Config, _TEMPORAL_THRESHOLDS[stream]))
+
+
+def _describe_buffer(stream: int, codec_id: int, array: np.ndarray) -> bytes:
+    """Pack the descriptor for one buffer frame."""
+    shape = tuple(array.shape) + (0,) * (3 - array.ndim)
+    return _BUFFER_DESCRIPTOR.pack(
+        stream, codec_id, array.dtype.str.encode('ascii'), array.ndim, *shape)
+
+
+def encode_frames(packet: KinectPacket, temporal: dict = None, version: int = FRAMES_VERSION) -> list:
+    """
+    Encode a KinectPacket as multipart frames without pickling.
+
+    Layout: [header, video, depth]. The header holds the packet fields and
+    one descriptor per buffer; a stream that is None is left out. Each buffer is compressed according to the
+    'video' (or 'bayer' for a Bayer mosaic) / 'depth' policy; with 'none'
+    the numpy array itself is the frame, suitable for
+    send_multipart(..., copy=False).
+
+    Args:
+        packet: KinectPacket with numpy video and depth arrays
+        temporal: Optional {(stream id, level): TemporalEncoder} for
+            keyframe/delta coding; encoders are created on first use and
+            kept in the dict.
+            Streams with a lossy compressor are always sent whole.
+        version: Header version to write (FRAMES_MIN_VERSION..FRAMES_VERSION,
+            see negotiate_frames_version()); fields an older version lacks
+            are left out
+
+    Returns:
+        List of frames (header bytes followed by buffers)
+    """
+    arrays = [
+        (_VIDEO_STREAMS[packet.video_format], packet.video_frame),
+        (_DEPTH_STREAMS[packet.depth_format], packet.depth),
+    ]
+    descriptors = []
+    buffers = []
+    for stream, array in arrays:
+        if array is None:
+            continue
+        array = np.ascontiguousarray(array)
+        # Temporal deltas assume the receiver reconstructs exactly what was sent
+        if temporal is not None and not is_lossy_stream(_STREAM_NAMES[stream]):
+            encoder = temporal.get((stream, packet.level))
+            if encoder is None:
+                encoder = temporal[(stream, packet.level)] = new_temporal_encoder(
+                    _STREAM_NAMES[stream], packet.level)
+            codec_id, payload = CODEC_TEMPORAL, encoder.encode(array, packet.sequence)
+        else:
+            compressor, payload = compress_stream(_STREAM_NAMES[stream], array, packet.level)
+            codec_id = compressor.codec_id
+        descriptors.append(_describe_buffer(stream, codec_id, array))
+        buffers.append(payload)
+
+    layout, added = _FRAMES_HEADERS[version]
+    fields = {
+        'level': packet.level,
+        'has_roi': packet.roi is not None,
+        'roi_x': packet.roi[0] if packet.roi else 0,
+        'roi_y': packet.roi[1] if packet.roi else 0,
+        'capture_fps': packet.capture_fps,
+        'skipped_frames': packet.skipped_frames & 0xFFFFFFFF,
+        'encode_ms': packet.encode_ms,
+        'video_timestamp': packet.video_timestamp & 0xFFFFFFFF,
+        'depth_timestamp': packet.depth_timestamp & 0xFFFFFFFF,
+    }
+    header = layout.pack(
+        FRAMES_TAG, version, MSG_KINECT,
+        packet.sequence, packet.time,
+        int(packet.tilt_state), float(packet.tilt_degs),
+        *(fields[name] for name in added),
+        len(buffers))
+
+    return [header + b''.join(descriptors)] + buffers
+
+
+def decode_frames(frames: list, temporal: dict = None) -> KinectPacket:
+    """
+    Rebuild a KinectPacket from frames produced by encode_frames().
+
+    Arrays are created with np.frombuffer over the received (or
+    decompressed) memory, so no extra copy is made. The resulting arrays
+    are read-only.
+
+    Args:
+        frames: List of zmq.Frame (recv_multipart(copy=False)) or bytes
+        temporal: {(stream id, level): TemporalDecoder} state kept by the
+            receiver, required for temporally coded streams (decoders
+            created on use)
+
+    Returns:
+        KinectPacket. A temporally coded stream is None while its decoder
+        waits for a keyframe.
+    """
+    header = _frame_buffer(frames[0])
+    layout, added = _header_layout(header)
+    tag, version, message_type, sequence, timestamp, tilt_state, tilt_degs, *values, count = \
+        layout.unpack_from(header)
+    fields = dict(_FRAMES_DEFAULTS, **dict(zip(added, values)))
+    level = fields['level']
+
+    if message_type != MSG_KINECT:
+        raise ValueError("Unknown frame message type: {}".format(message_type))
+    if len(frames) != count + 1:
+        raise ValueError("Expected {} buffer frames, got {}".format(count, len(frames) - 1))
+
+    video = depth = None
+    video_format, depth_format = VIDEO_RGB, DEPTH_RAW
+    offset = layout.size
+    for frame in frames[1:]:
+        stream, codec_id, dtype, ndim, *shape = _BUFFER_DESCRIPTOR.unpack_from(header, offset)
+        offset += _BUFFER_DESCRIPTOR.size
+        dtype = np.dtype(dtype.rstrip(b'\0').decode('ascii'))
+        shape = tuple(shape[:ndim])
+
+        if codec_id == CODEC_TEMPORAL:
+            if temporal is None:
+                raise ValueError("Temporally coded stream {} needs decoder state".format(stream))
+            decoder = temporal.get((stream, level))
+            if decoder is None:
+                decoder = temporal[(stream, level)] = TemporalDecoder(decompress_buffer)
+            array = decoder.decode(_frame_buffer(frame), sequence, dtype, shape)
+        else:
+            data = decompress_buffer(codec_id, _frame_buffer(frame))
+            array = np.frombuffer(data, dtype=dtype).reshape(shape)
+
+        if stream in _VIDEO_FORMATS:
+            video, video_format = array, _VIDEO_FORMATS[stream]
+        elif stream in _DEPTH_FORMATS:
+            depth, depth_format = array, _DEPTH_FORMATS[stream]
+
+    return KinectPacket(
+        sequence,
+        video,
+        depth,
+        tilt_state,
+        tilt_degs,
+        timestamp=timestamp,
+        video_format=video_format,
+        depth_format=depth_format,
+        level=level,
+        roi=(fields['roi_x'], fields['roi_y']) if fields['has_roi'] else None,
+        capture_fps=fields['capture_fps'],
+        skipped_frames=fields['skipped_frames'],
+        encode_ms=fields['encode_ms'],
+        video_timestamp=fields['video_timestamp'],
+        depth_timestamp=fields['depth_timestamp'])
+
+
+def _header_layout(header) -> tuple:
+    """(struct, added field names) of a received header frame, ValueError if unsupported."""
+    if len(header) < 2 or header[0] != FRAMES_TAG or header[1] not in _FRAMES_HEADERS:
+        raise ValueError("Unsupported frame format: tag {:#x}, version {} (this side reads {}-{})".format(
+            header[0] if len(header) else 0, header[1] if len(header) > 1 else 0,
+            FRAMES_MIN_VERSION, FRAMES_VERSION))
+    return _FRAMES_HEADERS[header[1]]
+
+
+def negotiate_frames_version(ranges) -> int:
+    """
+    Newest header version every receiver reads.
+
+    Args:
+        ranges: (oldest, newest) version read by each receiver
+
+    Returns:
+        A version in FRAMES_MIN_VERSION..FRAMES_VERSION, or None if no
+        version suits every receiver (FRAMES_VERSION without receivers)
+    """
+    oldest, newest = FRAMES_MIN_VERSION, FRAMES_VERSION
+    for low, high in ranges:
+        oldest, newest = max(oldest, low), min(newest, high)
+    return newest if newest >= oldest else None
+
+
+def is_independent(frames: list) -> bool:
+    """
+    True if a message decodes without any earlier message.
+
+    Only a Kinect message with a temporal delta buffer depends on the
+    previous message of its topic; a receiver that missed a message can
+    start again at the next independent one (a keyframe).
+
+    Args:
+        frames: Message frames (without the topic), not chunked
+    """
+    header = _frame_buffer(frames[0])
+    if not len(header) or header[0] != FRAMES_TAG:
+        return True
+    offset = _header_layout(header)[0].size
+    for frame in frames[1:]:
+        _, codec_id, *_ = _BUFFER_DESCRIPTOR.unpack_from(header, offset)
+        offset += _BUFFER_DESCRIPTOR.size
+        if codec_id == CODEC_TEMPORAL and not is_keyframe(_frame_buffer(frame)):
+            return False
+    return True
+
+
+def decode_message(frames: list, temporal: dict = None) -> object:
+    """
+    Decode a received message in any supported wire format.
+
+    Single-frame messages go through decompress(); multipart messages
+    starting with FRAMES_TAG go through decode_frames().
+
+    Args:
+        frames: Result of recv_multipart() (copy=True or copy=False)
+        temporal: Temporal decoder state, see decode_frames()
+
+    Returns:
+        Decoded packet object
+    """
+    first = _frame_buffer(frames[0])
+    if len(first) and first[0] == FRAMES_TAG:
+        return decode_frames(frames, temporal)
+    return decompress(first)
+
+
+# =============================================================================
+# Chunked Messages
+# =============================================================================
+
+# First byte of a chunk header frame
+CHUNK_TAG = 0xF4
+
+# tag, message id, chunk index, chunk count, flag: the last part continues
+# as the first part of the next chunk
+_CHUNK_HEADER = struct.Struct('!BHHHB')
+
+
+def split_message(frames: list, chunk_bytes: int, message_id: int) -> list:
+    """
+    Split a large multipart message into chunks sent as separate messages.
+
+    A single ZMQ message is sent whole, so a telemetry packet queued after a
+    large Kinect frame waits for all of it. Chunks let the publisher send
+    other messages in between. Each chunk is [chunk header, parts...];
+    the parts are views of the original frames (no copy), and a frame that
+    does not fit continues in the next chunk.
+
+    Args:
+        frames: Message frames (without the topic)
+        chunk_bytes: Largest payload of one chunk (0 = never split)
+        message_id: Identifies the message's chunks (wraps at 16 bits)
+
+    Returns:
+        List of messages: [frames] unchanged when the message fits in one
+        chunk, else the chunks
+    """
+    buffers = [_frame_buffer(frame).cast('B') for frame in frames]
+    if chunk_bytes <= 0 or sum(buffer.nbytes for buffer in buffers) <= chunk_bytes:
+        return [frames]
+
+    chunks = []
+    parts, room = [], chunk_bytes
+    for buffer in buffers:
+        while buffer.nbytes > room:
+            continued = room > 0
+            if continued:
+                parts.append(buffer[:room])
+                buffer = buffer[room:]
+            chunks.append((parts, continued))
+            parts, room = [], chunk_bytes
+        parts.append(buffer)
+        room -= buffer.nbytes
+    chunks.append((parts, False))
+
+    message_id &= 0xFFFF
+    return [[_CHUNK_HEADER.pack(CHUNK_TAG, message_id, index, len(chunks), continued)] + parts
+            for index, (parts, continued) in enumerate(chunks)]
+
+
+def is_chunk(frames: list) -> bool:
+    """True for a message made by split_message() from a larger one."""
+    first = _frame_buffer(frames[0])
+    return len(first) == _CHUNK_HEADER.size and first[0] == CHUNK_TAG
+
+
+def is_last_chunk(frames: list) -> bool:
+    """True for the chunk that completes its message (see is_chunk())."""
+    _, _, index, count, _ = _CHUNK_HEADER.unpack(bytes(_frame_buffer(frames[0])))
+    return index + 1 == count
+
+
+class ChunkAssembler:
+    """
+    Reassembles the chunks of one topic into the original message.
+
+    Chunks of a topic arrive in order on one socket. A message missing its
+    beginning (subscribed mid-message) or a chunk is discarded.
+    """
+
+    def __init__(self):
+        self._message_id = None
+        self._expected = 0
+        self._frames = []
+        self._continued = False
+
+    def add(self, frames: list):
+        """
+        Add one received chunk.
+
+        Args:
+            frames: A message for which is_chunk() is True (without the topic)
+
+        Returns:
+            The original frames once the last chunk arrived, else None
+        """
+        _, message_id, index, count, continued = _CHUNK_HEADER.unpack(bytes(_frame_buffer(frames[0])))
+        if index == 0:
+            self._message_id, self._expected, self._frames, self._continued = message_id, 0, [], False
+        elif message_id != self._message_id or index != self._expected:
+            self._message_id = None
+            return None
+
+        parts = [_frame_buffer(frame) for frame in frames[1:]]
+        if self._continued and parts:
+            self._frames[-1].append(parts.pop(0))
+        self._frames.extend([part] for part in parts)
+        self._continued = bool(continued)
+        self._expected = index + 1
+        if self._expected < count:
+            return None
+
+        self._message_id = None
+        return [pieces[0] if len(pieces) == 1 else b''.join(pieces) for pieces in self._frames]
+
+
+def _frame_buffer(frame):
+    """Return a buffer over a zmq.Frame or bytes-like object."""
+    return memoryview(getattr(frame, 'buffer', frame))
+
+
 def print_send(data: object) -> str:
     """Format a debug message for sent packets."""
     return "sending {}, sequence {}".format(data.__class__.__name__, data.sequence)
@@ -41,4 +922,3 @@ def print_send(data: object) -> str:
 def print_recv(data: object) -> str:
     """Format a debug message for received packets."""
     return "receiving {}, sequence {}".format(data.__class__.__name__, data.sequence)
-
@@ -0,0 +1,188 @@
+"""
+Keyframe + delta temporal coding for Kinect video and depth streams.
+
+Consecutive frames from a slow robot are nearly identical, so between
+periodic keyframes only the tiles that changed are sent:
+
+    Keyframe: the full frame, compressed with the stream's compressor
+    Delta:    a bitmask of dirty tiles plus the residual (current minus
+              reference, modulo the dtype) of those tiles, compressed
+
+The encoder keeps the reference exactly as the decoder will reconstruct
+it, so with a non-zero change threshold (lossy) both sides still agree.
+Each delta names the sequence number of its reference frame; when the
+decoder sees a gap (a lost or skipped message) it drops frames until the
+next keyframe and raises needs_keyframe so the client can ask for one.
+
+Payload layout:
+    !BIBBB (frame type, reference sequence, tile size, compressor id, reserved)
+    delta frames: packed tile mask (ceil(tiles / 8) bytes)
+    compressed keyframe or residual
+"""
+import struct
+
+import numpy as np
+
+KEYFRAME = 0
+DELTA = 1
+
+_HEADER = struct.Struct('!BIBBB')
+
+
+def _pad_to_tiles(array: np.ndarray, tile: int) -> np.ndarray:
+    """Pad height/width up to a multiple of the tile size (edge values)."""
+    pad_h = -array.shape[0] % tile
+    pad_w = -array.shape[1] % tile
+    if not pad_h and not pad_w:
+        return array
+    padding = [(0, pad_h), (0, pad_w)] + [(0, 0)] * (array.ndim - 2)
+    return np.pad(array, padding, mode='edge')
+
+
+def _tiles(array: np.ndarray, tile: int) -> np.ndarray:
+    """View a padded (H, W[, C]) array as (rows, cols, tile, tile[, C])."""
+    rows, cols = array.shape[0] // tile, array.shape[1] // tile
+    shape = (rows, tile, cols, tile) + array.shape[2:]
+    return array.reshape(shape).swapaxes(1, 2)
+
+
+def is_keyframe(data) -> bool:
+    """True if a temporal payload is a keyframe (decodable without a reference)."""
+    return memoryview(data)[0] == KEYFRAME
+
+
+class TemporalEncoder:
+    """
+    Server-side temporal encoder for one stream.
+
+    Args:
+        compress: Callable array -> (compressor id, bytes-like)
+        keyframe_interval: Frames between keyframes
+        tile: Tile edge in pixels
+        threshold: Largest per-pixel change still treated as clean (0 = lossless)
+    """
+
+    def __init__(self, compress, keyframe_interval: int, tile: int, threshold: int = 0):
+        self._compress = compress
+        self._keyframe_interval = keyframe_interval
+        self._tile = tile
+        self._threshold = threshold
+        self._reference = None
+        self._reference_sequence = None
+        self._since_keyframe = 0
+        self._force_keyframe = False
+
+    def force_keyframe(self):
+        """Make the next encoded frame a keyframe (e.g. on client request)."""
+        self._force_keyframe = True
+
+    def encode(self, array: np.ndarray, sequence: int) -> bytes:
+        """Encode one frame, returning the temporal payload."""
+        padded = _pad_to_tiles(np.ascontiguousarray(array), self._tile)
+
+        keyframe = (
+            self._force_keyframe
+            or self._reference is None
+            or self._reference.shape != padded.shape
+            or self._since_keyframe >= self._keyframe_interval
+        )
+        if keyframe:
+            payload = self._encode_keyframe(array, padded)
+        else:
+            payload = self._encode_delta(padded)
+
+        self._reference_sequence = sequence
+        return payload
+
+    def _encode_keyframe(self, array: np.ndarray, padded: np.ndarray) -> bytes:
+        self._reference = padded.copy()
+        self._since_keyframe = 1
+        self._force_keyframe = False
+        codec_id, data = self._compress(array)
+        return _HEADER.pack(KEYFRAME, 0, self._tile, codec_id, 0) + bytes(data)
+
+    def _encode_delta(self, padded: np.ndarray) -> bytes:
+        current = _tiles(padded, self._tile)
+        reference = _tiles(self._reference, self._tile)
+        pixel_axes = tuple(range(2, current.ndim))
+
+        if self._threshold:
+            change = np.abs(current.astype(np.int32) - reference.astype(np.int32))
+            dirty = (change > self._threshold).any(axis=pixel_axes)
+        else:
+            dirty = (current != reference).any(axis=pixel_axes)
+
+        # Residual wraps modulo the dtype; the decoder adds it back the same way
+        residual = current[dirty] - reference[dirty]
+        reference[dirty] = current[dirty]
+        self._since_keyframe += 1
+
+        codec_id, data = self._compress(residual)
+        header = _HEADER.pack(DELTA, self._reference_sequence, self._tile, codec_id, 0)
+        return header + np.packbits(dirty.ravel()).tobytes() + bytes(data)
+
+
+class TemporalDecoder:
+    """
+    Client-side temporal decoder for one stream.
+
+    Args:
+        decompress: Callable (compressor id, buffer) -> bytes-like
+    """
+
+    def __init__(self, decompress):
+        self._decompress = decompress
+        self._reference = None
+        self._sequence = None
+        self._needs_keyframe = False
+        self._dropped = 0
+
+    @property
+    def needs_keyframe(self) -> bool:
+        """True while waiting for a keyframe after a gap."""
+        return self._needs_keyframe
+
+    @property
+    def dropped(self) -> int:
+        """Delta frames discarded because their reference was missing."""
+        return self._dropped
+
+    def decode(self, data, sequence: int, dtype: np.dtype, shape: tuple):
+        """
+        Decode one frame.
+
+        Returns:
+            Array of the given shape, or None while waiting for a keyframe
+        """
+        data = memoryview(data)
+        frame_type, reference_sequence, tile, codec_id, _ = _HEADER.unpack_from(data)
+        offset = _HEADER.size
+
+        if frame_type == KEYFRAME:
+            frame = np.frombuffer(self._decompress(codec_id, data[offset:]), dtype=dtype)
+            frame = frame.reshape(shape)
+            self._reference = _pad_to_tiles(frame, tile)
+            self._sequence = sequence
+            self._needs_keyframe = False
+            return frame
+
+        if self._reference is None or reference_sequence != self._sequence:
+            self._dropped += 1
+            self._needs_keyframe = True
+            self._reference = None
+            return None
+
+        # New reference so arrays already handed to the GUI stay unchanged
+        reference = self._reference.copy()
+        tiles = _tiles(reference, tile)
+        count = tiles.shape[0] * tiles.shape[1]
+        mask_size = (count + 7) // 8
+        dirty = np.unpackbits(np.frombuffer(data, np.uint8, mask_size, offset), count=count)
+        dirty = dirty.astype(bool).reshape(tiles.shape[:2])
+
+        residual = np.frombuffer(self._decompress(codec_id, data[offset + mask_size:]), dtype=dtype)
+        tiles[dirty] += residual.reshape((-1,) + tiles.shape[2:])
+
+        self._reference = reference
+        self._sequence = sequence
+        return np.ascontiguousarray(reference[:shape[0], :shape[1]])
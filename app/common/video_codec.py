@@ -0,0 +1,267 @@
+"""
+Lossy codecs for Kinect RGB video frames.
+
+Raw RGB888 is 921,600 bytes per 640x480 frame. Two server-side encodings
+reduce that before the frame leaves the Pi:
+
+YUV420 (numpy only):
+    Full-resolution luma plus 2x2-averaged chroma (BT.601, full range),
+    12 bits per pixel, half the size of RGB888.
+
+JPEG (OpenCV, optional):
+    Configurable quality and chroma subsampling. QualityController steps
+    chroma and quality down when the frame rate or the link cannot keep
+    up, and back up when they recover.
+
+Both decoders return a C-contiguous (H, W, 3) uint8 RGB array, the layout
+FrameProcessor.video_to_qimage() wraps without copying.
+
+Layout:
+    YUV420: !HH (height, width), then Y, Cb, Cr planes
+            (chroma planes are ceil(H/2) x ceil(W/2))
+    JPEG:   standard JFIF stream
+"""
+import struct
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+_YUV_HEADER = struct.Struct('!HH')
+
+CHROMA_444 = '444'
+CHROMA_422 = '422'
+CHROMA_420 = '420'
+
+# Chroma settings from best to smallest
+_CHROMA_ORDER = (CHROMA_444, CHROMA_422, CHROMA_420)
+
+# Quality lost per adaptation step
+QUALITY_STEP = 10
+
+
+def jpeg_available() -> bool:
+    """True if OpenCV is installed (JPEG encode/decode)."""
+    return cv2 is not None
+
+
+# =============================================================================
+# YUV420
+# =============================================================================
+
+def _pad_even(array: np.ndarray) -> np.ndarray:
+    """Pad height/width to even sizes (edge values) for 2x2 chroma blocks."""
+    pad_h, pad_w = array.shape[0] & 1, array.shape[1] & 1
+    if not pad_h and not pad_w:
+        return array
+    return np.pad(array, ((0, pad_h), (0, pad_w), (0, 0)), mode='edge')
+
+
+def encode_yuv420(rgb) -> bytes:
+    """
+    Encode an RGB frame as planar YUV 4:2:0.
+
+    Args:
+        rgb: (H, W, 3) uint8 RGB array
+
+    Returns:
+        Header + Y, Cb, Cr planes
+    """
+    rgb = np.asarray(rgb)
+    height, width = rgb.shape[:2]
+
+    # Fixed-point BT.601 (JFIF) with 8 fractional bits; the weights sum to
+    # 256, so luma fits uint16 and needs no clipping
+    wide = rgb.astype(np.uint16)
+    y = (wide[..., 0] * 77 + wide[..., 1] * 150 + wide[..., 2] * 29 + 128) >> 8
+
+    # Chroma is linear in RGB, so sum RGB over 2x2 blocks first
+    blocks = _pad_even(wide)
+    blocks = blocks.reshape(blocks.shape[0] // 2, 2, blocks.shape[1] // 2, 2, 3)
+    blocks = (blocks[:, 0, :, 0] + blocks[:, 0, :, 1]
+              + blocks[:, 1, :, 0] + blocks[:, 1, :, 1]).astype(np.int32)
+    r, g, b = blocks[..., 0], blocks[..., 1], blocks[..., 2]
+    cb = ((-43 * r - 85 * g + 128 * b + 512) >> 10) + 128
+    cr = ((128 * r - 107 * g - 21 * b + 512) >> 10) + 128
+
+    planes = [y.astype(np.uint8)] + [np.clip(plane, 0, 255).astype(np.uint8) for plane in (cb, cr)]
+    return _YUV_HEADER.pack(height, width) + b''.join(plane.tobytes() for plane in planes)
+
+
+def decode_yuv420(data) -> np.ndarray:
+    """Decode encode_yuv420() output into an (H, W, 3) uint8 RGB array."""
+    height, width = _YUV_HEADER.unpack_from(data)
+    chroma_h, chroma_w = (height + 1) // 2, (width + 1) // 2
+    offset = _YUV_HEADER.size
+
+    y = np.frombuffer(data, np.uint8, height * width, offset).reshape(height, width)
+    offset += height * width
+    cb = np.frombuffer(data, np.uint8, chroma_h * chroma_w, offset).reshape(chroma_h, chroma_w)
+    offset += chroma_h * chroma_w
+    cr = np.frombuffer(data, np.uint8, chroma_h * chroma_w, offset).reshape(chroma_h, chroma_w)
+
+    # Chroma contributions at quarter resolution, then upsampled onto luma
+    cb = cb.astype(np.int32) - 128
+    cr = cr.astype(np.int32) - 128
+    chroma = np.stack((
+        (359 * cr + 128) >> 8,
+        -((88 * cb + 183 * cr + 128) >> 8),
+        (454 * cb + 128) >> 8,
+    ), axis=-1)
+    chroma = chroma.repeat(2, axis=0).repeat(2, axis=1)[:height, :width]
+
+    rgb = np.empty((height, width, 3), dtype=np.uint8)
+    np.clip(y[..., None].astype(np.int32) + chroma, 0, 255, out=rgb, casting='unsafe')
+    return rgb
+
+
+# =============================================================================
+# JPEG
+# =============================================================================
+
+def _jpeg_params(quality: int, chroma: str) -> list:
+    params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    # Sampling factor control needs OpenCV 4.5.5+, older builds always use 4:2:0
+    sampling = getattr(cv2, 'IMWRITE_JPEG_SAMPLING_FACTOR', None)
+    if sampling is not None:
+        factor = getattr(cv2, 'IMWRITE_JPEG_SAMPLING_FACTOR_' + chroma, None)
+        if factor is not None:
+            params += [sampling, factor]
+    return params
+
+
+def encode_jpeg(rgb, quality: int, chroma: str = CHROMA_420) -> bytes:
+    """
+    Encode an RGB frame as JPEG.
+
+    Args:
+        rgb: (H, W, 3) uint8 RGB array
+        quality: JPEG quality 1-100
+        chroma: Chroma subsampling ('444', '422' or '420')
+
+    Returns:
+        JPEG bytes
+    """
+    bgr = cv2.cvtColor(np.asarray(rgb), cv2.COLOR_RGB2BGR)
+    ok, encoded = cv2.imencode('.jpg', bgr, _jpeg_params(quality, chroma))
+    if not ok:
+        raise ValueError("JPEG encoding failed")
+    return encoded.tobytes()
+
+
+def decode_jpeg(data) -> np.ndarray:
+    """Decode a JPEG stream into an (H, W, 3) uint8 RGB array."""
+    bgr = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if bgr is None:
+        raise ValueError("JPEG decoding failed")
+    return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+
+
+# =============================================================================
+# Adaptive Quality
+# =============================================================================
+
+class QualityController:
+    """
+    Chooses JPEG quality and chroma subsampling from measured conditions.
+
+    Settings form a ladder from (max quality, configured chroma) down to
+    (min quality, 4:2:0): chroma is reduced first, then quality in
+    QUALITY_STEP steps. Every `interval` frames the controller compares
+    the measured frame rate with the target, and the video bit rate with
+    the measured link throughput (video produced faster than the link
+    sends means frames are queueing or being dropped). It steps down at
+    once when either falls short and steps up after UPGRADE_WINDOWS
+    consecutive healthy windows.
+
+    Args:
+        max_quality: Quality at the top of the ladder
+        min_quality: Quality at the bottom of the ladder
+        chroma: Chroma subsampling at the top of the ladder
+        target_fps: Frame rate below which the controller steps down
+        interval: Frames per measurement window
+    """
+
+    # Consecutive healthy windows before stepping back up
+    UPGRADE_WINDOWS = 3
+
+    # Video bit rate above the measured link throughput by this factor
+    # counts as congestion
+    BACKLOG_FACTOR = 1.1
+
+    def __init__(self, max_quality: int, min_quality: int, chroma: str,
+                 target_fps: float, interval: int):
+        self._ladder = self._build_ladder(max_quality, min_quality, chroma)
+        self._target_fps = target_fps
+        self._interval = max(1, interval)
+        self._level = 0
+        self._healthy = 0
+        self._window_start = None
+        self._window_frames = 0
+        self._window_bytes = 0
+
+    @staticmethod
+    def _build_ladder(max_quality: int, min_quality: int, chroma: str) -> list:
+        start = _CHROMA_ORDER.index(chroma) if chroma in _CHROMA_ORDER else len(_CHROMA_ORDER) - 1
+        ladder = [(max_quality, c) for c in _CHROMA_ORDER[start:]]
+        quality = max_quality - QUALITY_STEP
+        while quality > min_quality:
+            ladder.append((quality, CHROMA_420))
+            quality -= QUALITY_STEP
+        if min_quality < max_quality:
+            ladder.append((min_quality, CHROMA_420))
+        return ladder
+
+    @property
+    def setting(self) -> tuple:
+        """Current (quality, chroma) pair."""
+        return self._ladder[self._level]
+
+    def update(self, frame_bytes: int, now: float, link_mbps: float = None) -> bool:
+        """
+        Record one encoded frame.
+
+        Args:
+            frame_bytes: Encoded frame size
+            now: Monotonic time of the frame
+            link_mbps: Measured link throughput, None if unknown
+
+        Returns:
+            True if the setting changed
+        """
+        if self._window_start is None:
+            self._window_start = now
+            return False
+
+        self._window_frames += 1
+        self._window_bytes += frame_bytes
+        if self._window_frames < self._interval:
+            return False
+
+        elapsed = now - self._window_start
+        fps = self._window_frames / elapsed if elapsed > 0 else float('inf')
+        video_mbps = self._window_bytes * 8 / 1e6 / elapsed if elapsed > 0 else 0.0
+        self._window_start = now
+        self._window_frames = 0
+        self._window_bytes = 0
+
+        slow = fps < self._target_fps
+        congested = link_mbps is not None and video_mbps > link_mbps * self.BACKLOG_FACTOR
+        if slow or congested:
+            self._healthy = 0
+            return self._step(1)
+
+        self._healthy += 1
+        if self._healthy >= self.UPGRADE_WINDOWS:
+            self._healthy = 0
+            return self._step(-1)
+        return False
+
+    def _step(self, direction: int) -> bool:
+        level = min(max(self._level + direction, 0), len(self._ladder) - 1)
+        changed = level != self._level
+        self._level = level
+        return changed
@@ -1,30 +1,29 @@
 import logging
-import queue
-import time
-from queue import Queue
 from threading import Thread
 
-import psutil
-import smbus2
 import zmq
 from BrickPi import PORT_A, PORT_D, PORT_C, PORT_1, PORT_4, TYPE_SENSOR_LIGHT_ON, TYPE_SENSOR_ULTRASONIC_CONT, \
     BrickPiSetup, BrickPi, BrickPiSetupSensors, BrickPiUpdateValues
 
-from app.common.serialization import compress, decompress
-from app.networking import LegoMotor, LegoSensor, TelemetryPacket, SystemStats
-
-COMMAND_QUEUE_GRACE = 3
+from app.common.config import Config
+from app.common.serialization import encode
+from app.networking import (
+    LegoMotor, LegoSensor, TelemetryPacket, StatsPacket, TOPIC_TELEMETRY, TOPIC_STATS
+)
+from app.server.command_mailbox import CommandMailbox, LEFT_TRACK, RIGHT_TRACK, TURRET
+from app.server.sensor_sampler import SensorSampler
+from app.server.tick_scheduler import TickScheduler
 
 
 class BrickPiWrapper(Thread):
-    def __init__(self, host, port, command_queue: Queue, clock=0.1):
+    def __init__(self, host, port, commands: CommandMailbox, clock=0.1, link_bandwidth=None):
         Thread.__init__(self)
         Thread.daemon = True
         self._clock = clock
         self._host = host
         self._port = port
         self._logger = logging.getLogger(__name__)
-        self._command_queue = command_queue
+        self._commands = commands
 
         BrickPiSetup()
 
@@ -43,17 +42,30 @@ class BrickPiWrapper(Thread):
 
         BrickPiSetupSensors()
 
+        self._actuators = {
+            LEFT_TRACK: self._left_motor,
+            RIGHT_TRACK: self._right_motor,
+            TURRET: self._turret_motor,
+        }
+        # Deadman: when each actuator got its last command (monotonic
+        # seconds, None once stopped), and the moving actuators it stopped
+        self._commanded_at = dict.fromkeys(self._actuators)
+        self._deadman_stops = 0
+
         self._running = True
         self._sequence = 0
-        self._brick_temp = 0
-        self._brick_voltage = 0
-        self._command_queue_grace = COMMAND_QUEUE_GRACE
 
-        # System stats
-        self._system_stats = SystemStats()
-        self._last_net_bytes_sent = 0
-        self._last_net_bytes_recv = 0
-        self._last_net_time = time.time()
+        # One hardware update per tick, on a fixed grid of `clock` seconds
+        self._scheduler = TickScheduler(clock)
+
+        # Temperature, voltage and system stats, read on the sampler's own
+        # thread; link_bandwidth (multiprocessing.Value('d') or None) is
+        # shared with KinectProcess for automatic compressor selection
+        self._sampler = SensorSampler(link_bandwidth)
+        self._sensors = self._sampler.snapshot
+
+        # Set when temperature/voltage/system stats were refreshed and not yet sent
+        self._stats_pending = False
 
     @property
     def running(self):
@@ -69,30 +81,17 @@ class BrickPiWrapper(Thread):
         address = "tcp://{}:{}".format(self._host, self._port)
         sender.bind(address)
         self._logger.info("Starting -> address: {}".format(address))
+        self._sampler.start()
 
-        command_packet = TelemetryPacket(1)
         while self._running:
             try:
-                command_packet = self._command_queue.get_nowait()
-                self._command_queue_grace = COMMAND_QUEUE_GRACE
-            except queue.Empty as e:
-                if self._command_queue_grace > 0:
-                    self._command_queue_grace -= 1
-                if self._command_queue_grace <= 0:
-                    self._command_queue_grace = COMMAND_QUEUE_GRACE
-                    command_packet = TelemetryPacket(1)
-                    self.update_values(command_packet)
-                    # self._logger.exception(e)
-            except KeyboardInterrupt:
-                self._logger.debug("exiting...")
-                self._running = False
-            except Exception as e:
-                self._logger.exception(e)
-                break
-
-            try:
-                telemetry_packet = self.update_values(command_packet)
-                sender.send(compress(telemetry_packet))
+                deadline = self._scheduler.wait()
+                telemetry_packet = self.update_values(self._next_speeds(deadline))
+                sender.send_multipart([TOPIC_TELEMETRY, encode(telemetry_packet)])
+                if self._stats_pending:
+                    self._stats_pending = False
+                    sender.send_multipart([TOPIC_STATS, encode(self.stats_packet())])
+                    self._scheduler.reset_window()
             except KeyboardInterrupt:
                 self._logger.debug("exiting...")
                 self._running = False
@@ -100,21 +99,54 @@ class BrickPiWrapper(Thread):
                 self._logger.exception(e)
                 break
 
+        self._sampler.stop()
         sender.close()
         context.term()
 
-    def update_values(self, telemetry: TelemetryPacket) -> TelemetryPacket:
-        BrickPi.MotorSpeed[self._left_motor.port] = telemetry.left_motor.speed
-        BrickPi.MotorSpeed[self._right_motor.port] = telemetry.right_motor.speed
-        BrickPi.MotorSpeed[self._turret_motor.port] = telemetry.turret_motor.speed
+    def _next_speeds(self, now: float) -> dict:
+        """
+        Speed of every actuator for this tick: the latest command, or the
+        current speed until the deadman expires.
+
+        An actuator without a new command for DEADMAN_MS milliseconds is
+        stopped, however long the ticks are.
+
+        Args:
+            now: Tick time (time.monotonic())
+        """
+        commands = self._commands.take()
+        deadman = Config.DEADMAN_MS / 1000.0
+        speeds = {}
+        for actuator, motor in self._actuators.items():
+            commanded_at = self._commanded_at[actuator]
+            if actuator in commands:
+                speeds[actuator] = commands[actuator]
+                self._commanded_at[actuator] = now
+            elif commanded_at is not None and now - commanded_at < deadman:
+                speeds[actuator] = motor.speed
+            else:
+                if motor.speed:
+                    self._deadman_stops += 1
+                    self._logger.debug("Deadman: stopping {}, no command for {:.0f} ms".format(
+                        actuator, (now - commanded_at) * 1000 if commanded_at is not None else 0))
+                speeds[actuator] = 0
+                self._commanded_at[actuator] = None
+        return speeds
+
+    def update_values(self, speeds: dict) -> TelemetryPacket:
+        """Set the motor speeds ({actuator: speed}), exchange with the BrickPi and read the sensors."""
+        for actuator, speed in speeds.items():
+            motor = self._actuators[actuator]
+            motor.speed = speed
+            BrickPi.MotorSpeed[motor.port] = speed
 
         BrickPiUpdateValues()
 
-        # Update temp, voltage, and system stats every 10 cycles (~1 second)
-        if self._sequence % 10 == 0:
-            self._brick_temp = self.read_temp()
-            self._brick_voltage = self.get_voltage()
-            self._update_system_stats()
+        # Pick up the sampler's latest values (no waiting, no lock)
+        sensors = self._sampler.snapshot
+        if sensors is not self._sensors:
+            self._sensors = sensors
+            self._stats_pending = True
 
         self._left_motor.angle = BrickPi.Encoder[self._left_motor.port]
         self._right_motor.angle = BrickPi.Encoder[self._right_motor.port]
@@ -130,94 +162,22 @@ class BrickPiWrapper(Thread):
         output.turret_motor = self._turret_motor
         output.color_sensor = self._color_sensor
         output.ultrasound_sensor = self._ultrasonic_sensor
-        output.temperature = self._brick_temp
-        output.voltage = self._brick_voltage
-        output.system_stats = self._system_stats
-
-        time.sleep(self._clock)
+        output.temperature = sensors.temperature
+        output.voltage = sensors.voltage
+        output.system_stats = sensors.system_stats
 
         return output
 
-    def _update_system_stats(self):
-        """Collect system stats using psutil."""
-        try:
-            # CPU usage (non-blocking, uses cached value from previous call)
-            self._system_stats.cpu_percent = psutil.cpu_percent(interval=None)
-
-            # RAM usage
-            mem = psutil.virtual_memory()
-            self._system_stats.ram_percent = mem.percent
-            self._system_stats.ram_used_mb = mem.used / (1024 * 1024)
-            self._system_stats.ram_total_mb = mem.total / (1024 * 1024)
-
-            # Network stats for wlan0
-            net_io = psutil.net_io_counters(pernic=True)
-            if 'wlan0' in net_io:
-                wlan = net_io['wlan0']
-                current_time = time.time()
-                time_delta = current_time - self._last_net_time
-
-                if time_delta > 0 and self._last_net_bytes_sent > 0:
-                    # Calculate bandwidth in Mbps
-                    bytes_sent_delta = wlan.bytes_sent - self._last_net_bytes_sent
-                    bytes_recv_delta = wlan.bytes_recv - self._last_net_bytes_recv
-                    total_bytes = bytes_sent_delta + bytes_recv_delta
-                    bandwidth_mbps = (total_bytes * 8) / (time_delta * 1000000)
-                    self._system_stats.net_bandwidth_mbps = round(bandwidth_mbps, 2)
-
-                self._last_net_bytes_sent = wlan.bytes_sent
-                self._last_net_bytes_recv = wlan.bytes_recv
-                self._last_net_time = current_time
-                self._system_stats.net_bytes_sent = wlan.bytes_sent
-                self._system_stats.net_bytes_recv = wlan.bytes_recv
-
-        except Exception as e:
-            self._logger.warning("Failed to collect system stats: {}".format(e))
-
-    def read_temp(self):
-        temp = 0
-        with open('/sys/class/thermal/thermal_zone0/temp', 'r') as file:
-            try:
-                temp = int(file.readline()) / 1000
-            except Exception as e:
-                self._logger.exception(e)
-
-        return temp
-
-    def get_voltage(self):
-        """
-        Reads the digital output code of the MCP3021 chip on the BrickPi+ over i2c.
-        Some bit operation magic to get a voltage floating number.
-
-        If this doesnt work try this on the command line: i2cdetect -y 1
-        The 1 in there is the bus number, same as in bus = smbus.SMBus(1)
-        Google the resulting error.
-
-        :return: voltage (float)
-        """
-
-        # time.sleep(0.1) # Necessary?
-        try:
-            bus = smbus2.SMBus(1)            # SMBUS 1 because we're using greater than V1.
-            address = 0x48
-            # read data from i2c bus. the 0 command is mandatory for the protocol but not used in this chip.
-            data = bus.read_word_data(address, 0)
-
-            # from this data we need the last 4 bits and the first 6.
-            last_4 = data & 0b1111 # using a bit mask
-            first_6 = data >> 10 # left shift 10 because data is 16 bits
-
-            # together they make the voltage conversion ratio
-            # to make it all easier the last_4 bits are most significant :S
-            vratio = (last_4 << 6) | first_6
-
-            # Now we can calculate the battery voltage like so:
-            ratio = 0.01818     # this is 0.1/5.5V Still have to find out why...
-            voltage = vratio * ratio
-
-            return "{:.3F}".format(voltage)
-
-        except Exception as e:
-            self._logger.exception(e)
-            return 0
-
+    def stats_packet(self) -> StatsPacket:
+        """Latest temperature, voltage, system stats and control loop timing as a StatsPacket."""
+        return StatsPacket(
+            self._sequence,
+            voltage=self._sensors.voltage,
+            temperature=self._sensors.temperature,
+            system_stats=self._sensors.system_stats,
+            tick_jitter_ms=self._scheduler.jitter_ms,
+            tick_jitter_max_ms=self._scheduler.max_jitter_ms,
+            tick_overruns=self._scheduler.overruns,
+            commands_coalesced=self._commands.coalesced,
+            commands_expired=self._commands.expired,
+            deadman_stops=self._deadman_stops)
@@ -0,0 +1,82 @@
+"""
+CommandMailbox - Latest-wins motor commands, one slot per actuator.
+
+CommandReceiver overwrites the pending speed of each actuator a command
+names; the control loop takes all pending speeds at the start of each
+tick. Overwritten (coalesced) and expired commands are counted and sent
+in StatsPacket.
+"""
+import logging
+from threading import Lock
+
+from app.common.drop_counter import DropCounter
+
+# Actuators
+LEFT_TRACK = 'left_track'
+RIGHT_TRACK = 'right_track'
+TURRET = 'turret'
+
+ACTUATORS = (LEFT_TRACK, RIGHT_TRACK, TURRET)
+
+
+class CommandMailbox:
+    """
+    Pending speed per actuator, written by CommandReceiver and taken by
+    BrickPiWrapper (thread-safe).
+
+    Args:
+        logger: Logger for the periodic coalesced and expired command totals
+    """
+
+    def __init__(self, logger: logging.Logger = None):
+        logger = logger or logging.getLogger(__name__)
+        self._lock = Lock()
+        self._pending = {}
+        self._coalesced = DropCounter("coalesced motor commands", logger)
+        self._expired = DropCounter("expired commands (arrived after their TTL)", logger)
+
+    @property
+    def coalesced(self) -> int:
+        """Commands overwritten before the control loop took them, since start."""
+        return self._coalesced.total
+
+    @property
+    def coalesced_per_actuator(self) -> dict:
+        """Coalesced commands since start, per actuator."""
+        return self._coalesced.totals
+
+    @property
+    def expired(self) -> int:
+        """Commands discarded because they arrived after their TTL, since start."""
+        return self._expired.total
+
+    def expire(self, command: str):
+        """Count a command discarded for its age (by command name)."""
+        self._expired.drop(command)
+
+    def post(self, speeds: dict):
+        """
+        Set the pending speed of one or more actuators.
+
+        The speeds of one call are taken together (e.g. both tracks of a
+        turn).
+
+        Args:
+            speeds: {actuator: speed}
+        """
+        with self._lock:
+            superseded = [actuator for actuator in speeds if actuator in self._pending]
+            self._pending.update(speeds)
+        for actuator in superseded:
+            self._coalesced.drop(actuator)
+
+    def take(self) -> dict:
+        """
+        Take the pending speeds, leaving the mailbox empty.
+
+        Returns:
+            {actuator: speed} of the actuators commanded since the last take()
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
@@ -6,7 +6,7 @@ to connect and send commands. This is the inverse of the old
 CommandSubscriber which required knowing the client's IP address.
 """
 import logging
-from queue import Queue
+import time
 from threading import Thread
 
 import zmq
@@ -15,9 +15,11 @@ from app.common.config import Config
 from app.common.serialization import decompress
 from app.networking import (
     CommandPacket, GoForward, GoBackward, GoLeft, GoRight,
-    TurnLeft, TurnRight, TurretLeft, TurretRight, TurretReset,
-    TelemetryPacket, LegoMotor
+    TurnLeft, TurnRight, TurretLeft, TurretRight, TurretReset, RequestKeyframe, SetRegionOfInterest,
+    VelocityCommand
 )
+from app.server.command_mailbox import CommandMailbox, LEFT_TRACK, RIGHT_TRACK, TURRET
+from app.server.differential_mixer import mix
 
 
 class CommandReceiver(Thread):
@@ -28,7 +30,7 @@ class CommandReceiver(Thread):
     This allows multiple clients and eliminates the need for client IP discovery.
     """
 
-    def __init__(self, queue: Queue, port: int = None):
+    def __init__(self, commands: CommandMailbox, port: int = None, keyframe_request=None, roi_requests=None):
         if port is None:
             port = Config.COMMAND_PORT
         Thread.__init__(self)
@@ -36,7 +38,12 @@ class CommandReceiver(Thread):
         self._logger = logging.getLogger(__name__)
         self._running = True
         self._port = port
-        self._queue = queue
+        # Latest motor speeds, taken by BrickPiWrapper once per tick
+        self._commands = commands
+        # multiprocessing.Event shared with KinectProcess
+        self._keyframe_request = keyframe_request
+        # multiprocessing.Queue of SetRegionOfInterest read by KinectProcess
+        self._roi_requests = roi_requests
 
     @property
     def running(self):
@@ -69,59 +76,47 @@ class CommandReceiver(Thread):
         context.term()
 
     def handle_command_packet(self, packet: CommandPacket):
-        """Translate high-level commands to motor control packets."""
+        """Translate high-level commands to motor speeds, discarding expired ones."""
         try:
-            if type(packet) is GoForward:
-                self._queue.put_nowait(TelemetryPacket(
-                    sequence=0,
-                    left_motor=LegoMotor(speed=-packet.value),
-                    right_motor=LegoMotor(speed=packet.value)
-                ))
+            if is_expired(packet, time.time()):
+                self._commands.expire(type(packet).__name__)
+            elif type(packet) is VelocityCommand:
+                self._commands.post(mix(packet.linear, packet.angular, packet.turret_rate))
+            elif type(packet) is GoForward:
+                self._commands.post({LEFT_TRACK: -packet.value, RIGHT_TRACK: packet.value})
             elif type(packet) is GoBackward:
-                self._queue.put_nowait(TelemetryPacket(
-                    sequence=0,
-                    left_motor=LegoMotor(speed=packet.value),
-                    right_motor=LegoMotor(speed=-packet.value)
-                ))
+                self._commands.post({LEFT_TRACK: packet.value, RIGHT_TRACK: -packet.value})
             elif type(packet) is GoLeft:
-                self._queue.put_nowait(TelemetryPacket(
-                    sequence=0,
-                    left_motor=LegoMotor(speed=-int(packet.value / 2)),
-                    right_motor=LegoMotor(speed=packet.value)
-                ))
+                self._commands.post({LEFT_TRACK: -int(packet.value / 2), RIGHT_TRACK: packet.value})
             elif type(packet) is GoRight:
-                self._queue.put_nowait(TelemetryPacket(
-                    sequence=0,
-                    left_motor=LegoMotor(speed=-packet.value),
-                    right_motor=LegoMotor(speed=int(packet.value / 2))
-                ))
+                self._commands.post({LEFT_TRACK: -packet.value, RIGHT_TRACK: int(packet.value / 2)})
             elif type(packet) is TurnLeft:
-                self._queue.put_nowait(TelemetryPacket(
-                    sequence=0,
-                    left_motor=LegoMotor(speed=-packet.value),
-                    right_motor=LegoMotor(speed=-packet.value)
-                ))
+                self._commands.post({LEFT_TRACK: -packet.value, RIGHT_TRACK: -packet.value})
             elif type(packet) is TurnRight:
-                self._queue.put_nowait(TelemetryPacket(
-                    sequence=0,
-                    left_motor=LegoMotor(speed=packet.value),
-                    right_motor=LegoMotor(speed=packet.value)
-                ))
+                self._commands.post({LEFT_TRACK: packet.value, RIGHT_TRACK: packet.value})
             elif type(packet) is TurretLeft:
-                self._queue.put_nowait(TelemetryPacket(
-                    sequence=0,
-                    turret_motor=LegoMotor(speed=packet.value)
-                ))
+                self._commands.post({TURRET: packet.value})
             elif type(packet) is TurretRight:
-                self._queue.put_nowait(TelemetryPacket(
-                    sequence=0,
-                    turret_motor=LegoMotor(speed=-packet.value)
-                ))
+                self._commands.post({TURRET: -packet.value})
             elif type(packet) is TurretReset:
-                self._queue.put_nowait(TelemetryPacket(
-                    sequence=0,
-                    turret_motor=LegoMotor(speed=0)
-                ))
+                self._commands.post({TURRET: 0})
+            elif type(packet) is RequestKeyframe:
+                if self._keyframe_request is not None:
+                    self._keyframe_request.set()
+            elif type(packet) is SetRegionOfInterest:
+                if self._roi_requests is not None:
+                    self._roi_requests.put_nowait(packet)
         except Exception as error:
             self._logger.exception(error)
 
+
+def is_expired(packet: CommandPacket, now: float) -> bool:
+    """
+    True if a command's send time is more than its time to live from now.
+
+    A send time that far in the future means the client's clock offset is
+    wrong, so its TTL cannot be trusted either. Commands without a TTL
+    never expire.
+    """
+    ttl_ms = packet.ttl_ms
+    return ttl_ms > 0 and abs(now - packet.time) * 1000.0 > ttl_ms
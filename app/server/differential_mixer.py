@@ -0,0 +1,57 @@
+"""
+Differential mixer - Turns a VelocityCommand into track and turret speeds.
+
+The tracks of a skid-steer robot get
+
+    left = linear + angular
+    right = linear - angular
+
+(fractions of full speed, + turning the way TurnLeft does). When the sum
+runs past full speed on either track, both tracks are scaled down by the
+same factor instead of clipping the faster one, so the robot keeps the
+commanded curvature and only drives it slower. The result is scaled to
+VELOCITY_MAX_SPEED and given the motor signs of the discrete commands
+(the left motor is mounted mirrored: GoForward drives it backwards).
+"""
+from app.common.config import Config
+from app.server.command_mailbox import LEFT_TRACK, RIGHT_TRACK, TURRET
+
+# Motor speed sign of a forward-moving track, and of TurretLeft
+LEFT_TRACK_SIGN = -1
+RIGHT_TRACK_SIGN = 1
+TURRET_SIGN = 1
+
+
+def mix(linear: float, angular: float, turret_rate: float = 0.0, max_speed: int = None) -> dict:
+    """
+    Motor speeds for a velocity command.
+
+    Args:
+        linear: Forward (+) / backward (-) speed, -1 to 1
+        angular: Turn rate, -1 to 1 (+ turns the way TurnLeft does)
+        turret_rate: Turret rate, -1 to 1 (+ turns the way TurretLeft does)
+        max_speed: Motor speed of a rate of 1 (defaults to VELOCITY_MAX_SPEED)
+
+    Returns:
+        {LEFT_TRACK: speed, RIGHT_TRACK: speed, TURRET: speed} for CommandMailbox.post()
+    """
+    if max_speed is None:
+        max_speed = Config.VELOCITY_MAX_SPEED
+    linear, angular, turret_rate = _unit(linear), _unit(angular), _unit(turret_rate)
+
+    left = linear + angular
+    right = linear - angular
+    # Desaturate: keep the ratio of the tracks (the curvature)
+    saturation = max(1.0, abs(left), abs(right))
+    left /= saturation
+    right /= saturation
+
+    return {
+        LEFT_TRACK: int(round(LEFT_TRACK_SIGN * left * max_speed)),
+        RIGHT_TRACK: int(round(RIGHT_TRACK_SIGN * right * max_speed)),
+        TURRET: int(round(TURRET_SIGN * turret_rate * max_speed)),
+    }
+
+
+def _unit(value: float) -> float:
+    return max(-1.0, min(1.0, value))
@@ -0,0 +1,176 @@
+"""
+EncodePipeline - Parallel Kinect encoding with in-order delivery.
+
+    capture (KinectProcess.run) -> encode (worker threads) -> deliver (one thread)
+
+Jobs of the same topic run in capture order, since temporal coding
+depends on the previous frame; different topics encode in parallel. The
+deliver thread sends messages in submission order and is the only thread
+using the Kinect socket.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from app.common.config import Config
+
+# Stages reported in the latency log line
+_STAGES = ('capture', 'queue', 'encode', 'reorder')
+
+
+class StageTimes:
+    """
+    Average latency per pipeline stage, logged periodically (thread-safe).
+
+    Args:
+        logger: Logger for the periodic averages
+        workers: Encoder threads, shown in the log line
+        interval: Seconds between log lines (defaults to KINECT_STATS_INTERVAL, 0 = never)
+    """
+
+    def __init__(self, logger: logging.Logger, workers: int = 0, interval: float = None):
+        self._logger = logger
+        self._workers = workers
+        self._interval = Config.KINECT_STATS_INTERVAL if interval is None else interval
+        self._lock = threading.Lock()
+        self._totals = dict.fromkeys(_STAGES, 0.0)
+        self._counts = dict.fromkeys(_STAGES, 0)
+        self._messages = 0
+        self._last_log = time.monotonic()
+
+    def record(self, stage: str, seconds: float):
+        """Add one sample of a stage."""
+        with self._lock:
+            self._totals[stage] += seconds
+            self._counts[stage] += 1
+
+    def delivered(self):
+        """Count one sent message and log the averages when the interval elapsed."""
+        with self._lock:
+            self._messages += 1
+            if self._interval <= 0:
+                return
+            now = time.monotonic()
+            elapsed = now - self._last_log
+            if elapsed < self._interval:
+                return
+            averages = ', '.join('{} {:.1f} ms'.format(
+                stage, self._totals[stage] * 1000 / self._counts[stage] if self._counts[stage] else 0.0)
+                for stage in _STAGES)
+            rate = self._messages / elapsed
+            self._totals = dict.fromkeys(_STAGES, 0.0)
+            self._counts = dict.fromkeys(_STAGES, 0)
+            self._messages = 0
+            self._last_log = now
+        self._logger.info("Kinect pipeline ({} workers): {}, {:.1f} msg/s".format(
+            self._workers, averages, rate))
+
+
+class EncodePipeline:
+    """
+    Encoder pool feeding an in-order delivery thread.
+
+    Args:
+        workers: Encoder threads (0 = encode on the submitting thread)
+        deliver: deliver(topic, frames) called on the delivery thread, in
+            submission order
+        discard: discard(topic) called on the delivery thread for a job
+            that failed (e.g. to return its publisher slot)
+        logger: Logger for failures and stage latencies
+    """
+
+    def __init__(self, workers: int, deliver, discard=None, logger: logging.Logger = None):
+        self._logger = logger or logging.getLogger(__name__)
+        self._deliver = deliver
+        self._discard = discard
+        self._executor = None
+        if workers > 0:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="KinectEncode")
+        self.times = StageTimes(self._logger, workers)
+
+        # (topic, future) in submission order, taken by the delivery thread
+        self._jobs = deque()
+        self._condition = threading.Condition()
+        # Last job per topic, which the topic's next job waits for
+        self._last_job = {}
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="KinectDeliver", daemon=True)
+        self._thread.start()
+
+    def __len__(self) -> int:
+        """Messages submitted and not yet delivered."""
+        return len(self._jobs)
+
+    def submit(self, topic: bytes, encode):
+        """
+        Queue one message for encoding and delivery.
+
+        Args:
+            topic: Topic the message is sent under
+            encode: Callable returning the message frames
+        """
+        submitted = time.perf_counter()
+        if self._executor is None:
+            future = Future()
+            try:
+                future.set_result(self._encode(encode, None, submitted))
+            except Exception as e:
+                future.set_exception(e)
+            with self._condition:
+                self._jobs.append((topic, future))
+                self._condition.notify()
+            return
+
+        with self._condition:
+            future = self._executor.submit(self._encode, encode, self._last_job.get(topic), submitted)
+            self._last_job[topic] = future
+            self._jobs.append((topic, future))
+            self._condition.notify()
+
+    def close(self):
+        """Deliver what was submitted, then stop the workers and the delivery thread."""
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def _encode(self, encode, previous: Future, submitted: float) -> tuple:
+        """Worker: wait for the topic's previous job, then encode."""
+        if previous is not None:
+            # Submitted earlier, so already running or done (FIFO pool)
+            wait([previous])
+        started = time.perf_counter()
+        self.times.record('queue', started - submitted)
+        frames = encode()
+        finished = time.perf_counter()
+        self.times.record('encode', finished - started)
+        return frames, finished
+
+    def _run(self):
+        """Delivery thread: send the encoded messages in submission order."""
+        while True:
+            with self._condition:
+                while not self._jobs and self._running:
+                    self._condition.wait()
+                if not self._jobs:
+                    return
+                topic, future = self._jobs[0]
+
+            try:
+                frames, finished = future.result()
+                self.times.record('reorder', time.perf_counter() - finished)
+                self._deliver(topic, frames)
+                self.times.delivered()
+            except Exception as e:
+                self._logger.exception(e)
+                if self._discard is not None:
+                    self._discard(topic)
+
+            with self._condition:
+                self._jobs.popleft()
+                if self._last_job.get(topic) is future:
+                    del self._last_job[topic]
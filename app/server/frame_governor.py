@@ -0,0 +1,81 @@
+"""
+FrameGovernor - Paces one Kinect stream and keeps its capture statistics.
+
+KinectProcess keeps one governor per stream (video, depth). A stream is
+captured when its governor is due (KINECT_VIDEO_FPS / KINECT_DEPTH_FPS)
+and the publisher has room for at least one of its topics; otherwise the
+frame is skipped before capture, so no CPU is spent on frames that would
+only be dropped. The measured rate, the skipped count and the encode time
+travel with every KinectPacket (see doc/networking.md).
+"""
+from app.common.config import Config
+
+# Weight of the newest sample in the rate and encode time averages
+_SMOOTHING = 0.1
+
+
+class FrameGovernor:
+    """
+    Capture schedule and statistics of one Kinect stream.
+
+    Args:
+        fps: Target frames per second (0 = as fast as the camera delivers)
+    """
+
+    def __init__(self, fps: float):
+        self._period = 1.0 / fps if fps > 0 else 0.0
+        self._next = 0.0
+        self._last_capture = None
+        self._interval = 0.0
+        self._encode_time = 0.0
+        self._skipped = 0
+
+    @property
+    def fps(self) -> float:
+        """Measured capture rate (frames per second, smoothed)."""
+        return 1.0 / self._interval if self._interval > 0 else 0.0
+
+    @property
+    def skipped(self) -> int:
+        """Captures skipped because the publisher had no room, since start."""
+        return self._skipped
+
+    @property
+    def encode_ms(self) -> float:
+        """Time to scale and encode one capture (milliseconds, smoothed)."""
+        return self._encode_time * 1000.0
+
+    def due(self, now: float) -> bool:
+        """True if the stream should be captured at now (time.monotonic())."""
+        return now >= self._next
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until the stream is due."""
+        return max(0.0, self._next - now)
+
+    def captured(self, now: float):
+        """
+        Record a capture and schedule the next one.
+
+        The schedule keeps its phase while captures are on time, and
+        restarts from now once the camera (or the loop) fell behind, so
+        there is no burst to catch up.
+        """
+        if self._last_capture is not None:
+            self._interval = _smooth(self._interval, now - self._last_capture)
+        self._last_capture = now
+        self._next = max(self._next + self._period, now)
+
+    def skip(self, now: float):
+        """Record a capture skipped for backpressure and retry after one period."""
+        self._skipped += 1
+        self._next = now + (self._period or Config.KINECT_BACKOFF_MS / 1000.0)
+
+    def encoded(self, seconds: float):
+        """Record the scale-and-encode time of one capture."""
+        self._encode_time = _smooth(self._encode_time, seconds)
+
+
+def _smooth(average: float, sample: float) -> float:
+    """Exponential moving average (the first sample is taken as is)."""
+    return sample if not average else average + _SMOOTHING * (sample - average)
@@ -0,0 +1,170 @@
+"""
+FrameRing - Shared-memory ring of encoded Kinect messages.
+
+KinectProcess writes each message into a slot of a shared memory block
+and pushes only a (RING_TAG, slot) notification; the publisher sends the
+frames straight out of the slot and then releases it.
+
+Layout of the shared block:
+
+    [slot states: one byte per slot] [slot 0] [slot 1] ...
+
+Slot states move FREE -> WRITTEN (write()) -> SENDING (read()) -> FREE
+(release()), each changed by one process only, so no lock is needed.
+"""
+import struct
+from multiprocessing import shared_memory
+
+# First byte of a ring notification (never 0xF1 multipart, 0x78 zlib or 0xC0.. compressed)
+RING_TAG = 0xF3
+
+# tag, slot index
+_NOTIFICATION = struct.Struct('!BH')
+
+# frame count, then one length per frame
+_COUNT = struct.Struct('!B')
+_LENGTH = struct.Struct('!I')
+
+# Slot states
+FREE = 0
+WRITTEN = 1
+SENDING = 2
+
+
+def is_ring_notification(frame) -> bool:
+    """True for a notification frame made by FrameRing.notification()."""
+    buffer = memoryview(frame)
+    return len(buffer) == _NOTIFICATION.size and buffer[0] == RING_TAG
+
+
+class FrameRing:
+    """
+    Preallocated message slots in shared memory.
+
+    Create it in the parent process (FrameRing(slots, slot_bytes)) and pass
+    it to both processes; it pickles by name, so a spawned process attaches
+    to the same block.
+
+    Args:
+        slots: Number of message slots
+        slot_bytes: Size of one slot (frame table included)
+        name: Attach to an existing block instead of creating one
+    """
+
+    def __init__(self, slots: int, slot_bytes: int, name: str = None):
+        self._slots = slots
+        self._slot_bytes = slot_bytes
+        self._owner = name is None
+        if name is None:
+            self._memory = shared_memory.SharedMemory(create=True, size=slots + slots * slot_bytes)
+            self._memory.buf[:slots] = bytes(slots)
+        else:
+            self._memory = shared_memory.SharedMemory(name=name)
+        self._next = 0
+
+    def __reduce__(self):
+        return self.__class__, (self._slots, self._slot_bytes, self._memory.name)
+
+    @property
+    def name(self) -> str:
+        """Name of the shared memory block."""
+        return self._memory.name
+
+    @property
+    def slot_bytes(self) -> int:
+        """Largest message (frame table included) a slot holds."""
+        return self._slot_bytes
+
+    def write(self, frames: list):
+        """
+        Copy a multipart message into a free slot.
+
+        Args:
+            frames: bytes, memoryviews or contiguous numpy arrays
+
+        Returns:
+            Slot index, or None if every slot is busy or the message does
+            not fit (send it inline instead)
+        """
+        buffers = [memoryview(frame).cast('B') for frame in frames]
+        table = _COUNT.size + _LENGTH.size * len(buffers)
+        if table + sum(buffer.nbytes for buffer in buffers) > self._slot_bytes:
+            return None
+
+        slot = self._acquire()
+        if slot is None:
+            return None
+        memory = self._memory.buf
+        offset = self._offset(slot)
+        _COUNT.pack_into(memory, offset, len(buffers))
+        position = offset + table
+        for index, buffer in enumerate(buffers):
+            _LENGTH.pack_into(memory, offset + _COUNT.size + index * _LENGTH.size, buffer.nbytes)
+            memory[position:position + buffer.nbytes] = buffer
+            position += buffer.nbytes
+        return slot
+
+    def read(self, slot: int) -> list:
+        """
+        Take a notified slot and return its frames as memoryviews into the
+        shared memory (no copy).
+
+        The views stay valid until release(slot).
+        """
+        memory = self._memory.buf
+        memory[slot] = SENDING
+        offset = self._offset(slot)
+        count, = _COUNT.unpack_from(memory, offset)
+        position = offset + _COUNT.size + _LENGTH.size * count
+        frames = []
+        for index in range(count):
+            length, = _LENGTH.unpack_from(memory, offset + _COUNT.size + index * _LENGTH.size)
+            frames.append(memory[position:position + length])
+            position += length
+        return frames
+
+    def release(self, slot: int):
+        """Hand a slot back to the writer."""
+        self._memory.buf[slot] = FREE
+
+    def reclaim(self):
+        """Free the slots written but never taken by the reader (writer restart)."""
+        states = self._memory.buf
+        for slot in range(self._slots):
+            if states[slot] == WRITTEN:
+                states[slot] = FREE
+
+    @staticmethod
+    def notification(slot: int) -> bytes:
+        """Frame announcing a written slot to the reader."""
+        return _NOTIFICATION.pack(RING_TAG, slot)
+
+    @staticmethod
+    def notified_slot(frame) -> int:
+        """Slot index of a notification frame."""
+        _, slot = _NOTIFICATION.unpack(bytes(frame))
+        return slot
+
+    def close(self):
+        """Detach from the block and remove it (call once, in the creating process)."""
+        try:
+            self._memory.close()
+        except BufferError:
+            # Views still exported (e.g. held by an unsent ZMQ frame)
+            pass
+        if self._owner:
+            self._memory.unlink()
+
+    def _acquire(self):
+        """Mark the next free slot written, round-robin."""
+        states = self._memory.buf
+        for step in range(self._slots):
+            slot = (self._next + step) % self._slots
+            if states[slot] == FREE:
+                states[slot] = WRITTEN
+                self._next = (slot + 1) % self._slots
+                return slot
+        return None
+
+    def _offset(self, slot: int) -> int:
+        return self._slots + slot * self._slot_bytes
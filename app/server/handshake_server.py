@@ -4,26 +4,106 @@ HandshakeServer - Handles client connection handshake.
 Manages the initial connection from clients and triggers startup of
 BrickPi and Kinect components on first client connection.
 
+A ROUTER socket answers every heartbeat as soon as it arrives, whatever
+the number of clients, and keeps one ClientSession per client (last seen,
+round trip, negotiated capabilities). Sessions that miss heartbeats for
+HANDSHAKE_SESSION_TIMEOUT seconds are dropped; the live client count is
+available as client_count and, for other processes, in a shared Value.
+The compressors every live client can decode are shared the same way
+(client_codecs), and so is the newest multipart frame version all of
+them read (frames_version), so the publisher and the Kinect process only
+send what every client can decode.
+
 Formerly named HelloServer.
 """
 import logging
 import time
-from threading import Thread
+from threading import Lock, Thread
 
 import zmq
 
-from app.networking import HeartbeatResponse, HeartbeatRequest, get_available_interfaces
-from app.common.serialization import compress, decompress
+from app.common.config import Config
+from app.common.serialization import (
+    FRAMES_MIN_VERSION, FRAMES_VERSION, available_compressors, codec_mask, compress, decompress,
+    negotiate_frames_version
+)
+from app.networking import HEARTBEAT_REJECTED, HeartbeatResponse, HeartbeatRequest, get_available_interfaces
 from app.server.brick_pi_wrapper import BrickPiWrapper
 from app.server.kinect_process import KinectProcess
 
 
+def negotiate_capabilities(client: dict) -> dict:
+    """
+    Features a client and this server both support.
+
+    Args:
+        client: HeartbeatRequest.capabilities (empty for older clients)
+
+    Returns:
+        Capabilities sent back in HeartbeatResponse: the compressors both
+        sides have, the newest multipart frame version both sides read
+        (None if there is none), and whether chunked frames and stream
+        sessions can be used
+    """
+    compressors = available_compressors()
+    return {
+        'compressors': [name for name in client.get('compressors', compressors) if name in compressors],
+        'frames_version': negotiate_frames_version([frames_range(client)]),
+        'chunks': bool(client.get('chunks')),
+        'stream_session': bool(client.get('stream_session')) and Config.STREAM_PORT > 0,
+    }
+
+
+def frames_range(client: dict) -> tuple:
+    """
+    (oldest, newest) multipart frame version a client reads.
+
+    Clients that send no frames_min_version only read their frames_version;
+    clients that send neither are taken to read FRAMES_VERSION.
+    """
+    newest = client.get('frames_version', FRAMES_VERSION)
+    return client.get('frames_min_version', newest), newest
+
+
+class ClientSession:
+    """
+    One connected client, as seen by the handshake.
+
+    Args:
+        session: Client session id (HeartbeatRequest.session, or the
+            socket routing id of clients that send none)
+        address: Client IP address, if known
+    """
+
+    def __init__(self, session, address: str = None):
+        self.session = session
+        self.address = address
+        self.connected = time.monotonic()
+        self.last_seen = self.connected
+        self.heartbeats = 0
+        self.rtt_ms = 0.0
+        self.capabilities = {}
+        self.frames_range = (FRAMES_VERSION, FRAMES_VERSION)
+
+
 class HandshakeServer(Thread):
     """
-    REQ/REP server for client handshake.
+    ROUTER server for client handshake and heartbeats.
 
     Starts BrickPi and Kinect on first client connection.
     No longer needs to track client IP (commands now flow client → robot).
+
+    Args:
+        port: Handshake port
+        brick_pi_wrapper: Started on the first heartbeat
+        kinect_process: Started on the first heartbeat
+        sleep_time: Heartbeat interval advertised to clients (seconds)
+        client_count: Optional multiprocessing.Value('i') receiving the
+            number of live client sessions
+        client_codecs: Optional multiprocessing.Value('i') receiving the
+            bitmask of codec ids every live client can decode (0 = no clients)
+        frames_version: Optional multiprocessing.Value('i') receiving the
+            multipart frame version to send (see frames_version)
     """
 
     def __init__(
@@ -31,7 +111,10 @@ class HandshakeServer(Thread):
             port: int,
             brick_pi_wrapper: BrickPiWrapper,
             kinect_process: KinectProcess,
-            sleep_time: float = 1):
+            sleep_time: float = 1,
+            client_count=None,
+            client_codecs=None,
+            frames_version=None):
 
         Thread.__init__(self)
         self.daemon = True
@@ -45,34 +128,74 @@ class HandshakeServer(Thread):
         self._kinect_process = kinect_process
         self._components_started = False
 
+        self._sessions = {}
+        self._sessions_lock = Lock()
+        self._client_count = client_count
+        self._client_codecs = client_codecs
+        self._frames_version = frames_version
+
+    @property
+    def client_count(self) -> int:
+        """Clients that sent a heartbeat within HANDSHAKE_SESSION_TIMEOUT."""
+        return len(self._sessions)
+
+    @property
+    def client_codecs(self) -> int:
+        """Bitmask of the codec ids every live client can decode (0 = no clients)."""
+        with self._sessions_lock:
+            negotiated = [session.capabilities.get('compressors', []) for session in self._sessions.values()]
+        if not negotiated:
+            return 0
+        mask = codec_mask(available_compressors())
+        for compressors in negotiated:
+            mask &= codec_mask(compressors)
+        return mask
+
+    @property
+    def frames_version(self) -> int:
+        """
+        Newest multipart frame version every live client reads (None if no
+        version suits them all). Clients that read none of the versions
+        this server writes are left out.
+        """
+        with self._sessions_lock:
+            ranges = [session.frames_range for session in self._sessions.values()
+                      if session.capabilities.get('frames_version') is not None]
+        return negotiate_frames_version(ranges)
+
+    @property
+    def sessions(self) -> list:
+        """Snapshot of the live client sessions (thread-safe)."""
+        with self._sessions_lock:
+            return list(self._sessions.values())
+
     def run(self):
         context = zmq.Context()
-        socket = context.socket(zmq.REP)
+        socket = context.socket(zmq.ROUTER)
+        socket.setsockopt(zmq.LINGER, 0)
         address = "tcp://*:{}".format(self._port)
         socket.bind(address)
         self._logger.info("HandshakeServer starting -> address: {}".format(address))
 
+        poller = zmq.Poller()
+        poller.register(socket, zmq.POLLIN)
+
         while self._running:
             try:
-                request = decompress(socket.recv())
-
-                if isinstance(request, HeartbeatRequest):
-                    # Start hardware components on first client connection
-                    if not self._components_started:
-                        self._start_components()
-                        self._components_started = True
-
-                    # Send response with server info
-                    sequence = request.sequence + 1
-                    response = HeartbeatResponse(
-                        sequence,
-                        running=True,
-                        network=get_available_interfaces(),
-                        sleep=self._sleep_time
-                    )
-                    socket.send(compress(response))
-
-                time.sleep(self._sleep_time)
+                # Wake up once per heartbeat interval to expire silent clients
+                if poller.poll(self._sleep_time * 1000):
+                    # REQ clients: [routing id, empty delimiter, request]
+                    identity, *envelope, payload = socket.recv_multipart(copy=False)
+                    try:
+                        response = compress(self._reply(identity.bytes, payload, _peer_address(payload)))
+                    except Exception as e:
+                        # One client's bad request must not stop the others' heartbeats
+                        self._logger.warning("Rejecting bad request from {}: {}".format(
+                            _session_name(identity.bytes), e))
+                        response = HEARTBEAT_REJECTED
+                    # Always answer: a REQ client cannot send again before a reply
+                    socket.send_multipart([identity] + envelope + [response], copy=False)
+                self._expire(time.monotonic())
 
             except KeyboardInterrupt:
                 self._logger.debug("Shutting down...")
@@ -84,6 +207,80 @@ class HandshakeServer(Thread):
         socket.close()
         context.term()
 
+    def _reply(self, identity: bytes, payload, address: str):
+        """Update the client's session and build the reply to one request (ValueError if it is not a heartbeat)."""
+        request = decompress(payload.bytes)
+        if not isinstance(request, HeartbeatRequest):
+            raise ValueError("not a heartbeat request: {}".format(type(request).__name__))
+
+        # Start hardware components on first client connection
+        if not self._components_started:
+            self._start_components()
+            self._components_started = True
+
+        key = request.session or identity
+        with self._sessions_lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = ClientSession(key, address)
+                session.capabilities = negotiate_capabilities(request.capabilities)
+                session.frames_range = frames_range(request.capabilities)
+                opened = True
+            else:
+                opened = False
+        if opened:
+            self._on_sessions_changed()
+            self._logger.info("Client {} connected from {} ({} clients)".format(
+                _session_name(key), address or "unknown address", self.client_count))
+            if session.capabilities['frames_version'] is None:
+                self._logger.warning("Client {} reads frame format versions {}-{}, the server writes "
+                                     "{}-{}: it cannot decode Kinect frames".format(
+                                         _session_name(key), *session.frames_range,
+                                         FRAMES_MIN_VERSION, FRAMES_VERSION))
+
+        session.last_seen = time.monotonic()
+        session.heartbeats += 1
+        if request.rtt_ms:
+            session.rtt_ms = request.rtt_ms
+
+        # Send response with server info
+        return HeartbeatResponse(
+            request.sequence + 1,
+            running=True,
+            network=get_available_interfaces(),
+            sleep=self._sleep_time,
+            capabilities=session.capabilities,
+            clients=self.client_count
+        )
+
+    def _expire(self, now: float):
+        """Drop the sessions without a heartbeat for HANDSHAKE_SESSION_TIMEOUT seconds."""
+        with self._sessions_lock:
+            expired = [session for session in self._sessions.values()
+                       if now - session.last_seen > Config.HANDSHAKE_SESSION_TIMEOUT]
+            for session in expired:
+                del self._sessions[session.session]
+        for session in expired:
+            self._logger.info("Client {} timed out after {:.0f} s ({} clients)".format(
+                _session_name(session.session), now - session.connected, self.client_count))
+        if expired:
+            self._on_sessions_changed()
+
+    def _on_sessions_changed(self):
+        if self._client_count is not None:
+            self._client_count.value = self.client_count
+        if self._client_codecs is not None:
+            self._client_codecs.value = self.client_codecs
+        if self._frames_version is not None:
+            version = self.frames_version
+            if version is None:
+                # Serve the newest clients; the others cannot decode Kinect frames
+                version = FRAMES_VERSION
+                self._logger.warning("No frame format version suits every client, sending {}".format(version))
+            if version != self._frames_version.value:
+                self._logger.info("Sending Kinect frame format version {}".format(version))
+                self._frames_version.value = version
+
     def _start_components(self):
         """Start BrickPi and Kinect components."""
         self._logger.info("First client connected, starting hardware components...")
@@ -97,6 +294,18 @@ class HandshakeServer(Thread):
             self._logger.info("KinectProcess started")
 
 
+def _peer_address(frame: zmq.Frame):
+    """IP address of the client that sent a frame (None if libzmq does not tell)."""
+    try:
+        return frame.get('Peer-Address')
+    except zmq.ZMQError:
+        return None
+
+
+def _session_name(session) -> str:
+    """Printable session id (int id or routing id bytes)."""
+    return '{:08x}'.format(session) if isinstance(session, int) else session.hex()
+
+
 # Backward compatibility alias
 HelloServer = HandshakeServer
-
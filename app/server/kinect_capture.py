@@ -0,0 +1,225 @@
+"""
+KinectCapture - Callback-driven Kinect capture with RGB-D pairing.
+
+Runs the freenect event loop in a thread and pairs each video frame with
+the depth frame whose device timestamp is closest, within
+KINECT_PAIR_TOLERANCE_MS. KinectProcess takes the newest pair with
+take(); when the event loop fails, `failed` is set and the owner
+restarts the capture.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from app.common.config import Config
+from app.common.drop_counter import DropCounter
+from app.networking import TOPIC_VIDEO, TOPIC_DEPTH
+
+# Frames kept per stream while they wait for a partner
+_HISTORY = 3
+
+
+def timestamp_delta(a: int, b: int) -> int:
+    """Signed difference a - b of two 32-bit device timestamps, across wrap-around."""
+    delta = (a - b) & 0xFFFFFFFF
+    return delta - (1 << 32) if delta & (1 << 31) else delta
+
+
+class KinectCapture:
+    """
+    Receives Kinect video and depth through libfreenect callbacks.
+
+    Args:
+        freenect: The freenect module
+        device: Kinect device index
+        video_format: freenect video format (e.g. freenect.VIDEO_RGB)
+        depth_format: freenect depth format (e.g. freenect.DEPTH_11BIT)
+        tolerance: Largest device timestamp difference of a pair, in ticks
+            (defaults to KINECT_PAIR_TOLERANCE_MS at KINECT_CLOCK_HZ)
+    """
+
+    def __init__(self, freenect, device: int = 0, video_format: int = None, depth_format: int = None,
+                 tolerance: int = None):
+        self._freenect = freenect
+        self._device = device
+        self._video_format = freenect.VIDEO_RGB if video_format is None else video_format
+        self._depth_format = freenect.DEPTH_11BIT if depth_format is None else depth_format
+        if tolerance is None:
+            tolerance = int(Config.KINECT_PAIR_TOLERANCE_MS * Config.KINECT_CLOCK_HZ / 1000)
+        self._tolerance = tolerance
+        self._logger = logging.getLogger(__name__)
+        self._drops = DropCounter("unpaired Kinect frames", self._logger)
+
+        self._condition = threading.Condition()
+        # Recent (timestamp, array) per stream, newest last
+        self._history = {TOPIC_VIDEO: deque(maxlen=_HISTORY), TOPIC_DEPTH: deque(maxlen=_HISTORY)}
+        # Newest untaken frame per stream, and the newest untaken pair
+        self._latest = {TOPIC_VIDEO: None, TOPIC_DEPTH: None}
+        self._pair = None
+        # Streams the event loop keeps running
+        self._wanted = frozenset()
+        self._running = False
+        self._failed = False
+        self._thread = None
+
+    @property
+    def failed(self) -> bool:
+        """True once the event loop ended on an error (until the next start())."""
+        return self._failed
+
+    @property
+    def tolerance(self) -> int:
+        """Largest device timestamp difference of a pair, in ticks."""
+        return self._tolerance
+
+    def start(self):
+        """Start the event loop thread."""
+        self._running = True
+        self._failed = False
+        self._thread = threading.Thread(target=self._run, name="KinectCapture", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the streams and the event loop thread."""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(2.0)
+            self._thread = None
+
+    def set_streams(self, streams):
+        """
+        Select the streams to run (others are stopped by the event loop).
+
+        Args:
+            streams: Iterable of TOPIC_VIDEO / TOPIC_DEPTH
+        """
+        self._wanted = frozenset(streams)
+
+    def take(self, streams, timeout: float) -> dict:
+        """
+        Take the newest frames of the given streams, waiting for new ones.
+
+        With both streams the frames are a timestamp-matched pair.
+
+        Args:
+            streams: Iterable of TOPIC_VIDEO / TOPIC_DEPTH
+            timeout: Seconds to wait
+
+        Returns:
+            {stream: (array, device timestamp)}, or None on timeout
+        """
+        streams = frozenset(streams)
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                frames = self._take_ready(streams)
+                if frames is not None:
+                    return frames
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._running:
+                    return None
+                self._condition.wait(remaining)
+
+    def _take_ready(self, streams: frozenset) -> dict:
+        """Take the frames for take() if there are new ones (lock held)."""
+        if len(streams) > 1:
+            if self._pair is None:
+                return None
+            frames, self._pair = self._pair, None
+        else:
+            stream, = streams
+            if self._latest[stream] is None:
+                return None
+            frames = {stream: self._latest[stream]}
+        for stream in frames:
+            self._latest[stream] = None
+        return frames
+
+    def _on_frame(self, stream: bytes, data, timestamp: int):
+        """Keep a frame and pair it with the closest frame of the other stream."""
+        # libfreenect reuses its buffers once the callback returns
+        entry = (data.copy(), timestamp)
+        other = TOPIC_DEPTH if stream == TOPIC_VIDEO else TOPIC_VIDEO
+        with self._condition:
+            history = self._history[stream]
+            if len(history) == history.maxlen and other in self._wanted:
+                self._drops.drop(stream)
+            history.append(entry)
+            self._latest[stream] = entry
+
+            candidates = self._history[other]
+            if candidates:
+                partner = min(candidates, key=lambda candidate: abs(timestamp_delta(timestamp, candidate[1])))
+                if abs(timestamp_delta(timestamp, partner[1])) <= self._tolerance:
+                    self._pair = {stream: entry, other: partner}
+                    # Neither frame (nor anything older) pairs again
+                    history.clear()
+                    while candidates and candidates[0] is not partner:
+                        candidates.popleft()
+                    if candidates:
+                        candidates.popleft()
+            self._condition.notify_all()
+
+    def _on_video(self, dev, data, timestamp):
+        self._on_frame(TOPIC_VIDEO, data, timestamp)
+
+    def _on_depth(self, dev, data, timestamp):
+        self._on_frame(TOPIC_DEPTH, data, timestamp)
+
+    def _run(self):
+        """Event loop: start/stop the wanted streams and dispatch callbacks."""
+        freenect = self._freenect
+        controls = {
+            TOPIC_VIDEO: (freenect.start_video, freenect.stop_video),
+            TOPIC_DEPTH: (freenect.start_depth, freenect.stop_depth),
+        }
+        context = device = None
+        started = set()
+        failed = True
+        try:
+            context = freenect.init()
+            device = freenect.open_device(context, self._device)
+            freenect.set_video_mode(device, freenect.RESOLUTION_MEDIUM, self._video_format)
+            freenect.set_depth_mode(device, freenect.RESOLUTION_MEDIUM, self._depth_format)
+            freenect.set_video_callback(device, self._on_video)
+            freenect.set_depth_callback(device, self._on_depth)
+            self._logger.info("Kinect event loop started")
+
+            while self._running:
+                wanted = self._wanted
+                for stream, (start, stop) in controls.items():
+                    if stream in wanted and stream not in started:
+                        start(device)
+                        started.add(stream)
+                    elif stream not in wanted and stream in started:
+                        stop(device)
+                        started.discard(stream)
+                        with self._condition:
+                            self._history[stream].clear()
+
+                if not started:
+                    # process_events() would block without a running stream
+                    time.sleep(Config.KINECT_IDLE_SLEEP)
+                    continue
+                if freenect.process_events(context) < 0:
+                    self._logger.error("freenect event processing failed")
+                    break
+            else:
+                failed = False
+        except Exception as e:
+            self._logger.exception(e)
+        finally:
+            try:
+                for stream in started:
+                    controls[stream][1](device)
+                if device is not None:
+                    freenect.close_device(device)
+                if context is not None:
+                    freenect.shutdown(context)
+            except Exception as e:
+                self._logger.warning("Failed to close the Kinect: {}".format(e))
+            with self._condition:
+                self._failed = failed
+                self._running = False
+                self._condition.notify_all()
@@ -1,20 +1,71 @@
 import freenect
 import logging
+import queue
+import time
+from functools import partial
 import numpy as np
 from multiprocessing import Process
 
 import zmq
 
-from app.networking import KinectPacket
-from app.common.serialization import compress
+from app.networking import (
+    KinectPacket, VIDEO_BAYER, DEPTH_MM, DEPTH_REGISTERED, KINECT_TOPICS, TOPIC_VIDEO, TOPIC_DEPTH,
+    ROI_VIDEO, ROI_DEPTH, topic_stream, roi_topic
+)
+from app.common.config import Config
+from app.common.drop_counter import DropCounter
+from app.common.pyramid import build_pyramid, crop_region, halve_depth, halve_video
+from app.common.serialization import (
+    FRAMES_VERSION, compress, encode_frames, set_bandwidth_source, set_decodable_source
+)
+from app.server.encode_pipeline import EncodePipeline
+from app.server.frame_governor import FrameGovernor
+from app.server.frame_ring import FrameRing
+from app.server.kinect_capture import KinectCapture
+from app.server.telemetry_publisher import FRAME_SLOTS, demanded_topics, topic_slot
+
+# Seconds to wait for the callback capture before checking subscriptions again
+_CAPTURE_TIMEOUT = 1.0
 
 
 class KinectProcess(Process):
-    def __init__(self, host, port, running=True):
+    def __init__(self, host, port, running=True, wire_format=None, link_bandwidth=None,
+                 keyframe_request=None, video_mode=None, depth_mode=None, stream_demand=None,
+                 frames_in_flight=None, roi_requests=None, frame_ring=None, client_codecs=None,
+                 frames_version=None):
         Process.__init__(self)
         Process.daemon = True
         self._host = host
         self._port = port
+        self._wire_format = wire_format or Config.KINECT_WIRE_FORMAT
+        self._video_mode = video_mode or Config.KINECT_VIDEO_MODE
+        self._depth_mode = depth_mode or Config.KINECT_DEPTH_MODE
+        # multiprocessing.Value('d') updated by BrickPiWrapper (Mbps)
+        self._link_bandwidth = link_bandwidth
+        # multiprocessing.Value('i') with the codec ids every client can
+        # decode, written by the HandshakeServer
+        self._client_codecs = client_codecs
+        # multiprocessing.Value('i') with the multipart frame version every
+        # client reads, written by the HandshakeServer (None = FRAMES_VERSION)
+        self._frames_version = frames_version
+        # multiprocessing.Event set by CommandReceiver when a client lost its reference
+        self._keyframe_request = keyframe_request
+        # multiprocessing.Value('i') with the bitmask of subscribed topics
+        # (stream and pyramid level), written by the telemetry publisher
+        # (None = send everything)
+        self._stream_demand = stream_demand
+        # multiprocessing.Array('i') of frames sent and not yet published per
+        # topic, decremented by the telemetry publisher once every
+        # subscriber's queue took the frame (None = ZMQ HWM only)
+        self._frames_in_flight = frames_in_flight
+        # multiprocessing.Queue of SetRegionOfInterest from CommandReceiver;
+        # active regions by roi_id with their expiry time
+        self._roi_requests = roi_requests
+        self._regions = {}
+        self._region_expiry = {}
+        # FrameRing shared with the publisher (None = frames go over the socket)
+        self._frame_ring = frame_ring
+        self._pipeline = None
         self._running = running
         self._logger = logging.getLogger(__name__)
         self._freenect = freenect
@@ -30,23 +81,156 @@ class KinectProcess(Process):
 
     def run(self):
         # self._freenect.open_device(self._kinect_device)
+        if self._link_bandwidth is not None:
+            set_bandwidth_source(lambda: self._link_bandwidth.value)
+        if self._client_codecs is not None:
+            set_decodable_source(lambda: self._client_codecs.value)
+
         context = zmq.Context()
         sender = context.socket(zmq.PUSH)
+        # A short queue to the publisher: frames are skipped, not queued, when it is full
+        sender.setsockopt(zmq.SNDHWM, Config.KINECT_HWM * FRAME_SLOTS)
+        sender.setsockopt(zmq.LINGER, Config.FRAME_LINGER_MS)
         address = "tcp://{}:{}".format(self._host, self._port)
         sender.bind(address)
         self._logger.info("Starting -> address: {}".format(address))
 
+        # Frames lost with a previous sender must not hold slots
+        if self._frames_in_flight is not None:
+            self._frames_in_flight[:] = [0] * FRAME_SLOTS
+        if self._frame_ring is not None:
+            self._frame_ring.reclaim()
+
+        # Keyframe/delta encoders per topic (multipart wire format only). The
+        # topic dict is only used on this thread; a topic's encoders only by
+        # its encode jobs, which run one at a time
+        temporal = {} if Config.KINECT_TEMPORAL else None
+        # Topics whose next encode job starts with a keyframe
+        keyframes = set()
+        drops = DropCounter("Kinect frames (publisher busy)", self._logger)
+        governors = {
+            TOPIC_VIDEO: FrameGovernor(Config.KINECT_VIDEO_FPS),
+            TOPIC_DEPTH: FrameGovernor(Config.KINECT_DEPTH_FPS),
+        }
+
+        # Callback capture pairs video and depth by device timestamp
+        capture = None
+        if Config.KINECT_CAPTURE == 'async':
+            capture = KinectCapture(self._freenect, self._kinect_device,
+                                    video_format=self._freenect_video_format(),
+                                    depth_format=self._freenect_depth_format())
+            capture.start()
+
+        # Encoder threads; the delivery thread owns the socket from here on
+        pipeline = self._pipeline = EncodePipeline(
+            Config.KINECT_ENCODE_WORKERS,
+            deliver=partial(self._deliver, sender),
+            discard=self._release_slot,
+            logger=self._logger)
+
         sequence = 0
         while self._running:
             try:
-                kinect_packet = KinectPacket(
-                    sequence,
-                    self.get_video(),
-                    self.get_depth(),
-                    self.get_tilt_state(),
-                    self.get_tilt_degs())
-                # self._logger.debug("Kinect sending {}".format(kinect_packet))
-                sender.send(compress(kinect_packet))
+                self._update_regions(temporal)
+                topics = self.wanted_topics()
+                if not topics and not self._regions:
+                    # Nobody is subscribed: leave the camera idle
+                    time.sleep(Config.KINECT_IDLE_SLEEP)
+                    continue
+
+                if temporal and self._keyframe_request is not None and self._keyframe_request.is_set():
+                    self._keyframe_request.clear()
+                    keyframes.update(temporal)
+
+                # Capture only the subscribed streams, each level sent under its own topic
+                levels = {TOPIC_VIDEO: {}, TOPIC_DEPTH: {}}
+                for topic in topics:
+                    stream, level = topic_stream(topic)
+                    levels[stream][level] = topic
+                regions = {TOPIC_VIDEO: [], TOPIC_DEPTH: []}
+                for roi_id, request in self._regions.items():
+                    for stream, flag in ((TOPIC_VIDEO, ROI_VIDEO), (TOPIC_DEPTH, ROI_DEPTH)):
+                        if request.streams & flag:
+                            regions[stream].append((roi_topic(stream, roi_id), request))
+
+                now = time.monotonic()
+                wanted = [stream for stream in levels if levels[stream] or regions[stream]]
+                if capture is not None:
+                    capture.set_streams(wanted)
+                if not wanted:
+                    time.sleep(Config.KINECT_IDLE_SLEEP)
+                    continue
+                due = [stream for stream in wanted if governors[stream].due(now)]
+                if not due:
+                    time.sleep(min(governors[stream].wait_time(now) for stream in wanted))
+                    continue
+
+                # Latest frame wins: reserve room at the publisher before
+                # capturing, and skip the capture (temporal references stay
+                # intact) when no topic of the stream has any
+                reserved = {}
+                for stream in due:
+                    ready = {}
+                    for level, topic in levels[stream].items():
+                        if self._acquire_slot(topic):
+                            ready[level] = topic
+                        else:
+                            drops.drop(topic)
+                    crops = []
+                    for topic, request in regions[stream]:
+                        if self._acquire_slot(topic):
+                            crops.append((topic, request))
+                        else:
+                            drops.drop(topic)
+                    if ready or crops:
+                        reserved[stream] = (ready, crops)
+                    else:
+                        governors[stream].skip(now)
+                if not reserved:
+                    continue
+
+                started = time.perf_counter()
+                frames = self._grab(capture, reserved)
+                pipeline.times.record('capture', time.perf_counter() - started)
+                if frames is None:
+                    # The camera sent nothing in time: give the slots back
+                    # and retry the streams a period later
+                    for stream, (ready, crops) in reserved.items():
+                        for topic in list(ready.values()) + [topic for topic, _ in crops]:
+                            self._release_slot(topic)
+                        governors[stream].skip(now)
+                    if capture is not None and capture.failed:
+                        self._restart_capture(capture)
+                    continue
+
+                now = time.monotonic()
+                timestamp = time.time()
+                device_times = {stream: device_time for stream, (_, device_time) in frames.items()}
+                for stream, (ready, crops) in reserved.items():
+                    frame, _ = frames[stream]
+                    governor = governors[stream]
+                    governor.captured(now)
+                    if capture is None and Config.KINECT_ENCODE_WORKERS:
+                        # libfreenect's sync buffer is reused by the next capture
+                        frame = frame.copy()
+
+                    # Each level is binned from the previous one, once per frame;
+                    # every level (and crop) is then encoded as its own job
+                    pyramid = build_pyramid(frame, ready, self._halve(stream))
+                    for level, topic in sorted(ready.items()):
+                        self._submit(pipeline, topic, self._packet(
+                            sequence, stream, pyramid[level], timestamp, governor, device_times,
+                            level=level), governor, temporal, keyframes)
+
+                    # Region-of-interest crops, always at full resolution
+                    for topic, request in crops:
+                        crop, origin = crop_region(frame, request.x, request.y, request.width, request.height)
+                        if not crop.size:
+                            self._release_slot(topic)
+                            continue
+                        self._submit(pipeline, topic, self._packet(
+                            sequence, stream, crop, timestamp, governor, device_times,
+                            roi=origin), governor, temporal, keyframes)
             except KeyboardInterrupt:
                 self._logger.debug("exiting...")
                 self._running = False
@@ -56,20 +240,171 @@ class KinectProcess(Process):
 
             sequence += 1
 
-        self._freenect.sync_stop()
-        self._freenect.close_device(self._kinect_device)
+        pipeline.close()
+        if capture is not None:
+            capture.stop()
+        else:
+            self._freenect.sync_stop()
+            self._freenect.close_device(self._kinect_device)
         sender.close()
         context.term()
 
+    def _packet(self, sequence: int, stream: bytes, frame, timestamp: float, governor: FrameGovernor,
+                device_times: dict, level: int = 1, roi: tuple = None) -> KinectPacket:
+        """KinectPacket carrying one frame of a stream and its capture statistics."""
+        return KinectPacket(
+            sequence,
+            frame if stream == TOPIC_VIDEO else None,
+            frame if stream == TOPIC_DEPTH else None,
+            self.get_tilt_state(),
+            self.get_tilt_degs(),
+            timestamp=timestamp,
+            video_format=self._video_mode,
+            depth_format=self._depth_mode,
+            level=level,
+            roi=roi,
+            capture_fps=governor.fps,
+            skipped_frames=governor.skipped,
+            encode_ms=governor.encode_ms,
+            video_timestamp=device_times.get(TOPIC_VIDEO, 0),
+            depth_timestamp=device_times.get(TOPIC_DEPTH, 0))
+
+    def _grab(self, capture, streams) -> dict:
+        """
+        Capture the given streams.
+
+        Returns:
+            {stream: (array, device timestamp)}, or None if the callback
+            capture received nothing within _CAPTURE_TIMEOUT seconds
+        """
+        if capture is not None:
+            return capture.take(streams, _CAPTURE_TIMEOUT)
+        return {stream: self.get_video() if stream == TOPIC_VIDEO else self.get_depth()
+                for stream in streams}
+
+    def _restart_capture(self, capture: KinectCapture):
+        """Restart a callback capture whose event loop failed, after KINECT_CAPTURE_RESTART seconds."""
+        self._logger.error("Kinect capture failed, restarting in {} s".format(Config.KINECT_CAPTURE_RESTART))
+        capture.stop()
+        time.sleep(Config.KINECT_CAPTURE_RESTART)
+        capture.start()
+
+    def _freenect_video_format(self) -> int:
+        """freenect video format for the video mode."""
+        if self._video_mode == VIDEO_BAYER:
+            return self._freenect.VIDEO_BAYER
+        return self._freenect.VIDEO_RGB
+
+    def _freenect_depth_format(self) -> int:
+        """freenect depth format for the depth mode (metric modes are converted by libfreenect)."""
+        if self._depth_mode == DEPTH_MM:
+            return self._freenect.DEPTH_MM
+        if self._depth_mode == DEPTH_REGISTERED:
+            return self._freenect.DEPTH_REGISTERED
+        return self._freenect.DEPTH_11BIT
+
+    def _submit(self, pipeline: EncodePipeline, topic: bytes, kinect_packet: KinectPacket,
+                governor: FrameGovernor, temporal: dict, keyframes: set):
+        """Queue one packet for encoding, handing the job its topic's temporal encoders."""
+        encoders = None if temporal is None else temporal.setdefault(topic, {})
+        keyframe = topic in keyframes
+        keyframes.discard(topic)
+        version = self._frames_version.value if self._frames_version is not None else FRAMES_VERSION
+        pipeline.submit(topic, partial(self._encode, kinect_packet, encoders, keyframe, version, governor))
+
+    def _encode(self, kinect_packet: KinectPacket, encoders: dict, keyframe: bool, version: int,
+                governor: FrameGovernor) -> list:
+        """Encode one packet (on an encoder thread), returns the message frames after the topic."""
+        started = time.perf_counter()
+        if self._wire_format == 'multipart':
+            if keyframe:
+                for encoder in encoders.values():
+                    encoder.force_keyframe()
+            frames = encode_frames(kinect_packet, encoders, version)
+        else:
+            frames = [compress(kinect_packet)]
+        governor.encoded(time.perf_counter() - started)
+        return frames
+
+    def _deliver(self, sender, topic: bytes, frames: list):
+        """Send one encoded message (on the delivery thread), through the frame ring if possible."""
+        # self._logger.debug("Kinect sending {}".format(topic))
+        # The frame is encoded (temporal state advanced), so it is sent
+        # inline rather than skipped when the ring has no room
+        slot = self._frame_ring.write(frames) if self._frame_ring is not None else None
+        if slot is not None:
+            sender.send_multipart([topic, FrameRing.notification(slot)])
+        else:
+            sender.send_multipart([topic] + frames, copy=False)
+
+    def _update_regions(self, temporal: dict):
+        """Apply region-of-interest requests and expire the ones no longer refreshed."""
+        now = time.monotonic()
+        while self._roi_requests is not None:
+            # empty() is only a hint on a multiprocessing queue
+            try:
+                request = self._roi_requests.get_nowait()
+            except queue.Empty:
+                break
+            if not request.width or not request.height:
+                self._region_expiry[request.roi_id] = now
+            elif request.roi_id in self._regions or len(self._regions) < Config.ROI_MAX:
+                self._regions[request.roi_id] = request
+                self._region_expiry[request.roi_id] = now + Config.ROI_TIMEOUT
+            else:
+                self._logger.warning("Ignoring region of interest {:08x}: {} regions active".format(
+                    request.roi_id, len(self._regions)))
+
+        for roi_id, expiry in list(self._region_expiry.items()):
+            if expiry > now:
+                continue
+            del self._region_expiry[roi_id]
+            self._regions.pop(roi_id, None)
+            if temporal is not None:
+                for stream in (TOPIC_VIDEO, TOPIC_DEPTH):
+                    temporal.pop(roi_topic(stream, roi_id), None)
+
+    def _acquire_slot(self, topic: bytes) -> bool:
+        """Reserve room for one more frame of a topic towards the publisher, False if full."""
+        if self._frames_in_flight is None:
+            # The delivery thread owns the socket: bound the messages it holds
+            return len(self._pipeline) < Config.KINECT_HWM * FRAME_SLOTS
+        slot = topic_slot(topic)
+        with self._frames_in_flight.get_lock():
+            if self._frames_in_flight[slot] >= Config.KINECT_HWM:
+                return False
+            self._frames_in_flight[slot] += 1
+        return True
+
+    def _release_slot(self, topic: bytes):
+        """Return a slot reserved with _acquire_slot() for a frame that is not sent."""
+        if self._frames_in_flight is None:
+            return
+        slot = topic_slot(topic)
+        with self._frames_in_flight.get_lock():
+            self._frames_in_flight[slot] = max(0, self._frames_in_flight[slot] - 1)
+
+    def _halve(self, stream: bytes):
+        """Pyramid step for a stream: min-pooled depth, averaged video."""
+        if stream == TOPIC_DEPTH:
+            return lambda depth: halve_depth(depth, self._depth_mode)
+        return lambda video: halve_video(video, self._video_mode)
+
+    def wanted_topics(self) -> tuple:
+        """Kinect topics at least one client is subscribed to."""
+        if self._stream_demand is None:
+            return KINECT_TOPICS
+        return demanded_topics(self._stream_demand.value)
+
     def get_video(self):
-        array, _ = self._freenect.sync_get_video(self._kinect_device)
-        # return cv2.cvtColor(array, cv2.COLOR_RGB2BGR)
-        return array
+        """Blocking capture of one video frame, returns (array, device timestamp)."""
+        # Bayer: (480, 640) uint8 GRBG mosaic, demosaiced by the client
+        return self._freenect.sync_get_video(self._kinect_device, self._freenect_video_format())
 
     def get_depth(self):
-        array, _ = self._freenect.sync_get_depth(self._kinect_device)
-        # array = cv2.cvtColor(array, cv2.COLOR_RGB2BGR)
-        return array
+        """Blocking capture of one depth frame, returns (array, device timestamp)."""
+        # Metric modes are converted (and registered) inside libfreenect
+        return self._freenect.sync_get_depth(self._kinect_device, self._freenect_depth_format())
 
     @staticmethod
     def pretty_depth(depth):
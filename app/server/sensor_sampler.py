@@ -0,0 +1,228 @@
+"""
+SensorSampler - Slow robot sensors, sampled off the control loop.
+
+Reads the CPU temperature, battery voltage and system stats on a
+low-priority thread, each at its own SAMPLER_*_INTERVAL, and publishes
+them as an immutable SensorSnapshot the control loop reads without a lock.
+"""
+import copy
+import logging
+import os
+import threading
+import time
+from threading import Thread
+
+import psutil
+import smbus2
+
+from app.common.config import Config
+from app.networking import SystemStats
+
+THERMAL_ZONE = '/sys/class/thermal/thermal_zone0/temp'
+
+# MCP3021 battery voltage ADC of the BrickPi+, on i2c bus 1
+VOLTAGE_BUS = 1
+VOLTAGE_ADDRESS = 0x48
+
+# Network interface whose bandwidth is reported
+NET_INTERFACE = 'wlan0'
+
+
+class SensorSnapshot:
+    """
+    Slow sensor values at one moment (never modified once published).
+
+    Args:
+        temperature: CPU temperature (°C)
+        voltage: Battery voltage (V)
+        system_stats: CPU, RAM and network usage
+        generation: Incremented with every published snapshot
+    """
+
+    def __init__(self, temperature: float = 0, voltage: float = 0, system_stats: SystemStats = None,
+                 generation: int = 0):
+        self.temperature = temperature
+        self.voltage = voltage
+        self.system_stats = system_stats or SystemStats()
+        self.generation = generation
+
+
+class SensorSampler(Thread):
+    """
+    Low-priority thread refreshing temperature, voltage and system stats.
+
+    Args:
+        link_bandwidth: Optional multiprocessing.Value('d') receiving the
+            measured network bandwidth (Mbps), shared with KinectProcess
+            for automatic compressor selection
+        temperature_interval: Seconds between temperature reads
+            (defaults to SAMPLER_TEMPERATURE_INTERVAL)
+        voltage_interval: Seconds between voltage reads (defaults to
+            SAMPLER_VOLTAGE_INTERVAL)
+        system_stats_interval: Seconds between system stats refreshes
+            (defaults to SAMPLER_SYSTEM_STATS_INTERVAL)
+    """
+
+    def __init__(self, link_bandwidth=None, temperature_interval: float = None, voltage_interval: float = None,
+                 system_stats_interval: float = None):
+        Thread.__init__(self, name="SensorSampler")
+        self.daemon = True
+        self._logger = logging.getLogger(__name__)
+        self._link_bandwidth = link_bandwidth
+        self._stop_event = threading.Event()
+
+        # Sample name -> (read function, interval)
+        self._samples = {
+            'temperature': (self._read_temperature, _interval(
+                temperature_interval, Config.SAMPLER_TEMPERATURE_INTERVAL)),
+            'voltage': (self._read_voltage, _interval(voltage_interval, Config.SAMPLER_VOLTAGE_INTERVAL)),
+            'system_stats': (self._read_system_stats, _interval(
+                system_stats_interval, Config.SAMPLER_SYSTEM_STATS_INTERVAL)),
+        }
+        self._snapshot = SensorSnapshot()
+
+        # Kept open between reads (reopened after an error)
+        self._thermal_file = None
+        self._bus = None
+
+        self._system_stats = SystemStats()
+        self._last_net_bytes = None
+        self._last_net_time = 0.0
+
+    @property
+    def snapshot(self) -> SensorSnapshot:
+        """Latest published values (safe to read from any thread)."""
+        return self._snapshot
+
+    def stop(self):
+        """Stop the thread and close the file and bus handles."""
+        self._stop_event.set()
+
+    def run(self):
+        _lower_priority(Config.SAMPLER_NICE, self._logger)
+        values = {}
+        # Samples with an interval of 0 are never read
+        due = dict.fromkeys([name for name, (_, interval) in self._samples.items() if interval > 0],
+                            time.monotonic())
+        try:
+            while due and not self._stop_event.is_set():
+                now = time.monotonic()
+                refreshed = [name for name, at in due.items() if at <= now]
+                for name in refreshed:
+                    read, interval = self._samples[name]
+                    values[name] = read()
+                    due[name] = max(due[name] + interval, now)
+                if refreshed:
+                    snapshot = self._snapshot
+                    self._snapshot = SensorSnapshot(
+                        temperature=values.get('temperature', snapshot.temperature),
+                        voltage=values.get('voltage', snapshot.voltage),
+                        system_stats=values.get('system_stats', snapshot.system_stats),
+                        generation=snapshot.generation + 1)
+                self._stop_event.wait(max(0.0, min(due.values()) - time.monotonic()))
+        finally:
+            self._close()
+
+    def _read_temperature(self) -> float:
+        """CPU temperature from the thermal zone (°C, 0 on error)."""
+        try:
+            if self._thermal_file is None:
+                self._thermal_file = open(THERMAL_ZONE, 'r')
+            self._thermal_file.seek(0)
+            return int(self._thermal_file.readline()) / 1000
+        except Exception as e:
+            self._logger.warning("Failed to read the CPU temperature: {}".format(e))
+            self._close_thermal_file()
+            return 0
+
+    def _read_voltage(self) -> float:
+        """
+        Battery voltage from the MCP3021 chip on the BrickPi+ (V, 0 on error).
+
+        If this doesnt work try this on the command line: i2cdetect -y 1
+        The 1 in there is the bus number, same as in smbus2.SMBus(1).
+        """
+        try:
+            if self._bus is None:
+                self._bus = smbus2.SMBus(VOLTAGE_BUS)
+            # The 0 command is mandatory for the protocol but not used by this chip
+            data = self._bus.read_word_data(VOLTAGE_ADDRESS, 0)
+        except Exception as e:
+            self._logger.warning("Failed to read the battery voltage: {}".format(e))
+            self._close_bus()
+            return 0
+
+        # The conversion ratio is the last 4 bits (most significant) and the first 6
+        last_4 = data & 0b1111
+        first_6 = data >> 10
+        vratio = (last_4 << 6) | first_6
+        # 0.1/5.5 V per step
+        return round(vratio * 0.01818, 3)
+
+    def _read_system_stats(self) -> SystemStats:
+        """CPU, RAM and network usage from psutil (a new SystemStats)."""
+        stats = self._system_stats
+        try:
+            # Non-blocking, relative to the previous call
+            stats.cpu_percent = psutil.cpu_percent(interval=None)
+
+            mem = psutil.virtual_memory()
+            stats.ram_percent = mem.percent
+            stats.ram_used_mb = mem.used / (1024 * 1024)
+            stats.ram_total_mb = mem.total / (1024 * 1024)
+
+            net_io = psutil.net_io_counters(pernic=True).get(NET_INTERFACE)
+            if net_io is not None:
+                now = time.monotonic()
+                total_bytes = net_io.bytes_sent + net_io.bytes_recv
+                if self._last_net_bytes is not None and now > self._last_net_time:
+                    bandwidth_mbps = (total_bytes - self._last_net_bytes) * 8 / ((now - self._last_net_time) * 1000000)
+                    stats.net_bandwidth_mbps = round(bandwidth_mbps, 2)
+                    if self._link_bandwidth is not None:
+                        self._link_bandwidth.value = bandwidth_mbps
+                self._last_net_bytes = total_bytes
+                self._last_net_time = now
+                stats.net_bytes_sent = net_io.bytes_sent
+                stats.net_bytes_recv = net_io.bytes_recv
+
+        except Exception as e:
+            self._logger.warning("Failed to collect system stats: {}".format(e))
+
+        # Published snapshots are never modified
+        return copy.copy(stats)
+
+    def _close(self):
+        self._close_thermal_file()
+        self._close_bus()
+
+    def _close_thermal_file(self):
+        if self._thermal_file is not None:
+            self._thermal_file.close()
+            self._thermal_file = None
+
+    def _close_bus(self):
+        if self._bus is not None:
+            try:
+                self._bus.close()
+            except Exception:
+                pass
+            self._bus = None
+
+
+def _interval(value: float, default: float) -> float:
+    return default if value is None else value
+
+
+def _lower_priority(nice: int, logger: logging.Logger):
+    """Raise the niceness of the calling thread (Linux schedules threads individually)."""
+    get_native_id = getattr(threading, 'get_native_id', None)  # Python 3.8+
+    if nice <= 0:
+        return
+    if get_native_id is None or not hasattr(os, 'setpriority'):
+        logger.debug("Per-thread priorities are not supported here, not lowering the sensor sampler priority")
+        return
+    try:
+        thread_id = get_native_id()
+        os.setpriority(os.PRIO_PROCESS, thread_id, os.getpriority(os.PRIO_PROCESS, thread_id) + nice)
+    except OSError as e:
+        logger.warning("Could not lower the sensor sampler priority: {}".format(e))
@@ -0,0 +1,281 @@
+"""
+StreamSessions - Credit-paced per-client streams on a ROUTER socket.
+
+A client that opens a stream session (a DEALER socket on STREAM_PORT)
+gets its own queue on the server, and the server sends it at most
+`window` messages more than it reported consumed. Sessions are served
+round-robin, one message (or chunk) per session and round.
+
+Client -> server (DEALER, the ROUTER prepends the client's routing id):
+
+    [b'TOPICS', topic, ...]          Topics (prefixes) to receive, the full set
+    [b'ACK', consumed, window]       Messages consumed since the session
+                                     started, and the messages allowed in
+                                     flight (ASCII integers)
+    [b'BYE']                         Close the session
+
+Server -> client: [topic, frames...] exactly as on the XPUB socket,
+large Kinect messages in chunks (one credit per message).
+
+Sessions without a message for STREAM_SESSION_TIMEOUT seconds are closed.
+"""
+import logging
+import time
+from collections import deque
+
+import zmq
+
+from app.common.config import Config
+from app.common.drop_counter import DropCounter
+from app.common.serialization import is_independent
+from app.networking import STREAM_ACK, STREAM_BYE, STREAM_TOPICS, TOPIC_STATS, TOPIC_TELEMETRY
+
+_TELEMETRY_TOPICS = (TOPIC_TELEMETRY, TOPIC_STATS)
+
+
+class StreamSession:
+    """
+    Queues and credits of one client.
+
+    Args:
+        identity: ZMQ routing id of the client's DEALER socket
+        consumed: Messages the client reported consumed when the session
+            started (the credit count starts there)
+    """
+
+    def __init__(self, identity: bytes, consumed: int = 0):
+        self.identity = identity
+        self.prefixes = frozenset()
+        self.window = Config.STREAM_WINDOW
+        self.sent = consumed
+        self.consumed = consumed
+        self.last_seen = time.monotonic()
+        # Telemetry and stats messages, in order
+        self.telemetry = deque()
+        # Per Kinect topic: queued (messages, slot), and topics waiting for a keyframe
+        self.frames = {}
+        self.resync = set()
+        # Chunks left of the message being sent, and its ring slot and trackers
+        self.current = None
+
+    @property
+    def credits(self) -> int:
+        """Messages the session may start now."""
+        return self.window - (self.sent - self.consumed)
+
+    def wants(self, topic: bytes) -> bool:
+        """True if any of the session's topics is a prefix of topic."""
+        return any(topic.startswith(prefix) for prefix in self.prefixes)
+
+
+class StreamSessions:
+    """
+    All stream sessions of the publisher, served from its loop.
+
+    Args:
+        socket: Bound ROUTER socket (ROUTER_MANDATORY set)
+        hold: hold(slot) called for every queued reference to a frame ring slot
+        release: release(slot, tracker) called when a queued reference is
+            dropped (tracker None) or sent (libzmq may still read the slot
+            until the tracker is done)
+        logger: Logger for session events
+    """
+
+    def __init__(self, socket: zmq.Socket, hold=None, release=None, logger: logging.Logger = None):
+        self._socket = socket
+        self._hold = hold
+        self._release = release
+        self._logger = logger or logging.getLogger(__name__)
+        self._sessions = {}
+        self._drops = DropCounter("stream session frames (client behind)", self._logger)
+        self._last_expiry = time.monotonic()
+
+    def __len__(self) -> int:
+        """Open sessions."""
+        return len(self._sessions)
+
+    @property
+    def ready(self) -> bool:
+        """True if a session has a message to send and the credits for it."""
+        return any(session.current is not None or session.credits > 0 and (
+            session.telemetry or any(session.frames.values())) for session in self._sessions.values())
+
+    def wanted(self, topic: bytes) -> bool:
+        """True if at least one session receives the topic."""
+        return any(session.wants(topic) for session in self._sessions.values())
+
+    def receive(self) -> bool:
+        """
+        Handle one client message from the socket.
+
+        Returns:
+            True if a session subscribed to new topics (it needs a keyframe)
+        """
+        identity, command, *arguments = self._socket.recv_multipart()
+        session = self._sessions.get(identity)
+        if command == STREAM_BYE:
+            if session is not None:
+                self._close(session)
+            return False
+
+        if session is None:
+            consumed = int(arguments[0]) if command == STREAM_ACK and arguments else 0
+            session = self._sessions[identity] = StreamSession(identity, consumed)
+            self._logger.info("Stream session {} opened ({} sessions)".format(_name(identity), len(self._sessions)))
+        session.last_seen = time.monotonic()
+
+        if command == STREAM_TOPICS:
+            prefixes = frozenset(arguments)
+            added = prefixes - session.prefixes
+            session.prefixes = prefixes
+            for topic in [topic for topic in session.frames if not session.wants(topic)]:
+                self._discard(session.frames.pop(topic))
+                session.resync.discard(topic)
+            return bool(added)
+        if command == STREAM_ACK and len(arguments) >= 2:
+            session.consumed = int(arguments[0])
+            session.window = max(1, int(arguments[1]))
+        return False
+
+    def offer(self, topic: bytes, frames: list, messages: list, slot: int = None):
+        """
+        Queue a message for every session that receives its topic.
+
+        Args:
+            topic: Message topic
+            frames: Message frames without the topic, not chunked
+                (to tell keyframes from deltas)
+            messages: The messages to send: [topic, frames...], or its chunks
+            slot: Frame ring slot holding the frames, or None
+        """
+        independent = None
+        for session in self._sessions.values():
+            if not session.wants(topic):
+                continue
+            if topic in _TELEMETRY_TOPICS:
+                if len(session.telemetry) >= Config.TELEMETRY_BACKLOG:
+                    session.telemetry.popleft()
+                    self._drops.drop(topic)
+                session.telemetry.append(messages)
+                continue
+
+            if independent is None:
+                independent = is_independent(frames)
+            queue = session.frames.setdefault(topic, deque())
+            if topic in session.resync:
+                if not independent:
+                    self._drops.drop(topic)
+                    continue
+                session.resync.discard(topic)
+            if len(queue) >= Config.KINECT_HWM:
+                # The client is behind: newer frames replace the queued ones
+                self._drops.drop(topic, len(queue))
+                self._discard(queue)
+                queue.clear()
+                if not independent:
+                    session.resync.add(topic)
+                    self._drops.drop(topic)
+                    continue
+            if slot is not None and self._hold is not None:
+                self._hold(slot)
+            queue.append((messages, slot))
+
+    def send(self) -> bool:
+        """
+        Send one message (or chunk) per session that has credits.
+
+        Telemetry goes before frames, frame topics take turns.
+
+        Returns:
+            True if anything was sent
+        """
+        sent_any = False
+        for session in list(self._sessions.values()):
+            if session.current is None:
+                session.current = self._next_message(session)
+            if session.current is None:
+                continue
+
+            chunks, slot, trackers = session.current
+            try:
+                tracker = self._socket.send_multipart(
+                    [session.identity] + chunks[0], flags=zmq.NOBLOCK, copy=False, track=slot is not None)
+            except zmq.Again:
+                # This client's queue is full; the others go on
+                continue
+            except zmq.ZMQError as e:
+                if e.errno != zmq.EHOSTUNREACH:
+                    raise
+                self._close(session)
+                continue
+            sent_any = True
+            chunks.popleft()
+            if slot is not None:
+                trackers.append(tracker)
+            if not chunks:
+                session.current = None
+                if slot is not None and self._release is not None:
+                    self._release(slot, zmq.MessageTracker(*trackers))
+        return sent_any
+
+    def expire(self, now: float) -> bool:
+        """
+        Close the sessions silent for STREAM_SESSION_TIMEOUT seconds
+        (checked once a second).
+
+        Returns:
+            True if a session was closed
+        """
+        if now - self._last_expiry < 1.0:
+            return False
+        self._last_expiry = now
+        expired = [session for session in self._sessions.values()
+                   if now - session.last_seen > Config.STREAM_SESSION_TIMEOUT]
+        for session in expired:
+            self._logger.info("Stream session {} timed out".format(_name(session.identity)))
+            self._close(session)
+        return bool(expired)
+
+    def close(self):
+        """Close every session, dropping their queues."""
+        for session in list(self._sessions.values()):
+            self._close(session)
+
+    def _next_message(self, session: StreamSession):
+        """Take the session's next message as (chunks, slot, trackers), spending a credit."""
+        if session.credits <= 0:
+            return None
+        if session.telemetry:
+            messages, slot = session.telemetry.popleft(), None
+        else:
+            topics = [topic for topic, queue in session.frames.items() if queue]
+            if not topics:
+                return None
+            topic = topics[0]
+            messages, slot = session.frames[topic].popleft()
+            # Round-robin: the topic goes behind the others
+            session.frames[topic] = session.frames.pop(topic)
+        session.sent += 1
+        return deque(messages), slot, []
+
+    def _discard(self, entries):
+        """Drop queued (messages, slot) entries, releasing their ring slots."""
+        for messages, slot in entries:
+            if slot is not None and self._release is not None:
+                self._release(slot, None)
+
+    def _close(self, session: StreamSession):
+        for queue in session.frames.values():
+            self._discard(queue)
+        if session.current is not None:
+            chunks, slot, trackers = session.current
+            if slot is not None and self._release is not None:
+                self._release(slot, zmq.MessageTracker(*trackers))
+        del self._sessions[session.identity]
+        self._logger.info("Stream session {} closed ({} sessions)".format(
+            _name(session.identity), len(self._sessions)))
+
+
+def _name(identity: bytes) -> str:
+    """Printable routing id (TelemetryClient uses its hex session id)."""
+    return identity.decode('ascii', 'backslashreplace')
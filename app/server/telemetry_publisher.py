@@ -0,0 +1,438 @@
+"""
+TelemetryPublisher - Aggregates BrickPi and Kinect data for clients.
+
+Forwards the topic-prefixed messages from BrickPiWrapper and KinectProcess
+to an XPUB socket, telemetry first and large Kinect messages in chunks,
+and shares the set of subscribed Kinect topics with KinectProcess. See
+doc/networking.md for delivery and flow control.
+
+Formerly the telemetry_publisher() function in server.py.
+"""
+import itertools
+import json
+import logging
+import time
+from collections import Counter, deque
+
+import zmq
+
+from app.common.config import Config
+from app.common.drop_counter import DropCounter
+from app.common.serialization import split_message
+from app.networking import KINECT_TOPICS, TOPIC_TELEMETRY, TOPIC_VIDEO, is_roi_topic, topic_stream
+from app.server.frame_ring import is_ring_notification
+from app.server.stream_sessions import StreamSessions
+
+# Bit of each Kinect topic (stream and level) in the shared demand value
+_TOPIC_DEMAND = {topic: 1 << index for index, topic in enumerate(KINECT_TOPICS)}
+DEMAND_ALL = (1 << len(KINECT_TOPICS)) - 1
+
+# Frames-in-flight counters: one per Kinect topic, then video and depth crops
+FRAME_SLOTS = len(KINECT_TOPICS) + 2
+
+# Control socket commands (as for zmq.proxy_steerable)
+CONTROL_PAUSE = b'PAUSE'
+CONTROL_RESUME = b'RESUME'
+CONTROL_STATISTICS = b'STATISTICS'
+CONTROL_TERMINATE = b'TERMINATE'
+
+
+def demanded_topics(demand: int) -> tuple:
+    """Kinect topics selected by a stream demand bitmask."""
+    return tuple(topic for topic, bit in _TOPIC_DEMAND.items() if demand & bit)
+
+
+def topic_slot(topic: bytes) -> int:
+    """Index of a Kinect topic in the shared frames-in-flight counters."""
+    topic = bytes(topic)
+    if is_roi_topic(topic):
+        stream, _ = topic_stream(topic)
+        return len(KINECT_TOPICS) + (0 if stream == TOPIC_VIDEO else 1)
+    return KINECT_TOPICS.index(topic)
+
+
+class SubscriptionTracker:
+    """
+    Counts subscriptions reported by an XPUB socket.
+
+    ZMQ subscriptions are prefixes, so a topic is wanted when any active
+    subscription is a prefix of it (b'' matches everything).
+    """
+
+    def __init__(self):
+        self._prefixes = Counter()
+
+    def update(self, message: bytes) -> bool:
+        """
+        Apply one XPUB subscription message.
+
+        Args:
+            message: b'\\x01' + prefix (subscribe) or b'\\x00' + prefix (unsubscribe)
+
+        Returns:
+            True for a subscription that matches a Kinect topic or a
+            region-of-interest topic
+        """
+        if not message:
+            return False
+        prefix = bytes(message[1:])
+        if message[0] == 1:
+            self._prefixes[prefix] += 1
+            return is_roi_topic(prefix) or any(topic.startswith(prefix) for topic in KINECT_TOPICS)
+
+        self._prefixes[prefix] -= 1
+        if self._prefixes[prefix] <= 0:
+            del self._prefixes[prefix]
+        return False
+
+    def wanted(self, topic: bytes) -> bool:
+        """True if at least one subscriber receives the topic."""
+        return any(topic.startswith(prefix) for prefix in self._prefixes)
+
+    @property
+    def demand(self) -> int:
+        """Bitmask of the Kinect topics someone receives (see demanded_topics())."""
+        demand = 0
+        for topic, bit in _TOPIC_DEMAND.items():
+            if self.wanted(topic):
+                demand |= bit
+        return demand
+
+
+class TrafficCounter:
+    """Messages and bytes through one side of the publisher."""
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+
+    def count(self, frames):
+        """Add one multipart message."""
+        self.messages += 1
+        self.bytes += sum(len(frame) for frame in frames)
+
+    def as_dict(self) -> dict:
+        """Totals for the STATISTICS reply."""
+        return {'messages': self.messages, 'bytes': self.bytes}
+
+
+def _session_demand(sessions: StreamSessions) -> int:
+    """Bitmask of the Kinect topics some stream session receives."""
+    demand = 0
+    for topic, bit in _TOPIC_DEMAND.items():
+        if sessions.wanted(topic):
+            demand |= bit
+    return demand
+
+
+def _try_send(socket, frames, copy=True, track=False):
+    """
+    Send without blocking.
+
+    Returns:
+        False if the socket refused the message (a client at its HWM on
+        the XPUB_NODROP publisher, a full ROUTER_MANDATORY peer), else
+        True (the zmq.MessageTracker with track=True)
+    """
+    try:
+        tracker = socket.send_multipart(frames, flags=zmq.NOBLOCK, copy=copy, track=track)
+        return tracker if track else True
+    except zmq.Again:
+        return False
+
+
+def telemetry_publisher(localhost, brick_pi_port, kinect_port, publisher_port,
+                        stream_demand=None, keyframe_request=None, frames_in_flight=None,
+                        frame_ring=None, capture_port=None, control_port=None, stream_port=None,
+                        client_count=None):
+    """
+    Aggregates data from BrickPi and Kinect, publishes to clients.
+
+    This is the main loop that runs on the server.
+
+    Args:
+        localhost: Address the BrickPi/Kinect PUSH sockets are bound on
+        brick_pi_port: BrickPiWrapper PUSH port
+        kinect_port: KinectProcess PUSH port
+        publisher_port: Port clients subscribe on
+        stream_demand: Optional multiprocessing.Value('i') receiving the
+            bitmask of subscribed Kinect topics
+        keyframe_request: Optional multiprocessing.Event set when a client
+            subscribes to a Kinect stream (it has no temporal reference yet)
+        frames_in_flight: Optional multiprocessing.Array('i') with one
+            counter per slot (topic_slot(), FRAME_SLOTS in all) of frames
+            sent by KinectProcess and not yet taken by every subscriber's
+            queue
+        frame_ring: Optional FrameRing the Kinect messages are read from
+        capture_port: Port every published message is mirrored on
+            (PUB, bound on localhost; None or 0 = no capture socket)
+        control_port: Port of the PAUSE/RESUME/STATISTICS/TERMINATE
+            control socket (REP, bound on localhost; None or 0 = none)
+        stream_port: Port clients open stream sessions on (ROUTER, see
+            StreamSessions; None or 0 = subscriptions only)
+        client_count: Optional multiprocessing.Value('i') with the clients
+            connected to the handshake, reported by STATISTICS
+    """
+    context = zmq.Context()
+    logger = logging.getLogger(__name__)
+
+    brick_pi_receiver = context.socket(zmq.PULL)
+    brick_pi_receiver.connect("tcp://{}:{}".format(localhost, brick_pi_port))
+
+    kinect_receiver = context.socket(zmq.PULL)
+    kinect_receiver.setsockopt(zmq.RCVHWM, Config.KINECT_HWM * FRAME_SLOTS)
+    kinect_receiver.setsockopt(zmq.LINGER, Config.FRAME_LINGER_MS)
+    kinect_receiver.connect("tcp://{}:{}".format(localhost, kinect_port))
+
+    publisher = context.socket(zmq.XPUB)
+    # Report every (un)subscription, not only the first/last per prefix
+    publisher.setsockopt(getattr(zmq, 'XPUB_VERBOSER', zmq.XPUB_VERBOSE), 1)
+    # Refuse (EAGAIN) instead of silently dropping when a client is full:
+    # telemetry then waits in the backlog, and a Kinect frame stays pending
+    # and keeps its frames-in-flight slot, so KinectProcess skips captures
+    publisher.setsockopt(zmq.XPUB_NODROP, 1)
+    publisher.setsockopt(zmq.SNDHWM, Config.TELEMETRY_PUB_SNDHWM)
+    publisher.setsockopt(zmq.SNDBUF, Config.TELEMETRY_SNDBUF)
+    publisher.setsockopt(zmq.LINGER, Config.FRAME_LINGER_MS)
+    publisher.bind('tcp://*:{}'.format(publisher_port))
+    logger.info("Telemetry publisher bound to :{}".format(publisher_port))
+
+    capture = None
+    if capture_port:
+        # Mirrors what clients receive; a slow recorder loses messages
+        # (PUB drops at its HWM) and never holds back the clients
+        capture = context.socket(zmq.PUB)
+        capture.setsockopt(zmq.SNDHWM, Config.CAPTURE_HWM)
+        capture.setsockopt(zmq.LINGER, 0)
+        capture.bind("tcp://{}:{}".format(localhost, capture_port))
+        logger.info("Telemetry capture bound to {}:{}".format(localhost, capture_port))
+
+    control = None
+    if control_port:
+        control = context.socket(zmq.REP)
+        control.setsockopt(zmq.LINGER, 0)
+        control.bind("tcp://{}:{}".format(localhost, control_port))
+        logger.info("Telemetry control bound to {}:{}".format(localhost, control_port))
+
+    router = None
+    if stream_port:
+        router = context.socket(zmq.ROUTER)
+        # EAGAIN for a full session, EHOSTUNREACH for a gone one (no silent drops)
+        router.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        router.setsockopt(zmq.SNDHWM, Config.TELEMETRY_SNDHWM)
+        router.setsockopt(zmq.SNDBUF, Config.TELEMETRY_SNDBUF)
+        router.setsockopt(zmq.LINGER, Config.FRAME_LINGER_MS)
+        router.bind('tcp://*:{}'.format(stream_port))
+        logger.info("Stream sessions bound to :{}".format(stream_port))
+
+    poller = zmq.Poller()
+    poller.register(brick_pi_receiver, zmq.POLLIN)
+    poller.register(kinect_receiver, zmq.POLLIN)
+    poller.register(publisher, zmq.POLLIN)
+    if control is not None:
+        poller.register(control, zmq.POLLIN)
+    if router is not None:
+        poller.register(router, zmq.POLLIN)
+
+    # Telemetry refused by a full client or held while paused, sent in
+    # order once there is room
+    backlog = deque()
+    # Kinect messages (chunks left to send, ring slot or None, trackers of
+    # the sent chunks) waiting for a client, per topic and in order
+    # (region-of-interest topics come and go with their clients)
+    pending = {topic: deque() for topic in KINECT_TOPICS}
+    message_ids = itertools.count()
+    # (MessageTracker, slot) of ring messages libzmq may still be reading
+    sending = []
+
+    # References (pending message, session queues, unfinished sends) per
+    # frame ring slot; the slot goes back to KinectProcess at zero
+    slot_refs = Counter()
+
+    def hold(slot):
+        slot_refs[slot] += 1
+
+    def release(slot, tracker=None):
+        if tracker is not None:
+            sending.append((tracker, slot))
+            return
+        slot_refs[slot] -= 1
+        if slot_refs[slot] <= 0:
+            del slot_refs[slot]
+            frame_ring.release(slot)
+
+    pending_count = 0
+    drops = DropCounter("telemetry (backlog full)", logger)
+    received = TrafficCounter()
+    published = TrafficCounter()
+    captured = TrafficCounter()
+    paused = False
+    progressed = False
+
+    subscriptions = SubscriptionTracker()
+    sessions = StreamSessions(router, hold, release, logger) if router is not None else None
+
+    def update_demand():
+        if stream_demand is None:
+            return
+        demand = subscriptions.demand
+        if sessions is not None:
+            demand |= _session_demand(sessions)
+        stream_demand.value = demand
+
+    update_demand()
+
+    def publish(frames, track):
+        """Send to the clients and mirror on the capture socket."""
+        sent = _try_send(publisher, frames, copy=False, track=track)
+        if not sent:
+            return sent
+        published.count(frames)
+        if capture is not None:
+            mirrored = _try_send(capture, frames, copy=False, track=track)
+            if mirrored:
+                captured.count(frames)
+                if track:
+                    # The ring slot is free once both sockets let go of it
+                    sent = zmq.MessageTracker(sent, mirrored)
+        return sent
+
+    while True:
+        try:
+            # Go on at once after sending a chunk (after reading any new
+            # telemetry), retry soon while something waits for a full
+            # client or a slot
+            waiting = ((backlog or pending_count or sessions is not None and sessions.ready) and not paused
+                       or sending)
+            timeout = 0 if progressed else Config.PUBLISHER_RETRY_MS if waiting else None
+            socks = dict(poller.poll(timeout))
+        except KeyboardInterrupt:
+            break
+
+        if control is not None and control in socks:
+            command = control.recv()
+            if command == CONTROL_PAUSE:
+                paused = True
+                logger.info("Telemetry publisher paused")
+                control.send(b'OK')
+            elif command == CONTROL_RESUME:
+                paused = False
+                logger.info("Telemetry publisher resumed")
+                control.send(b'OK')
+            elif command == CONTROL_STATISTICS:
+                control.send(json.dumps({
+                    'paused': paused,
+                    'received': received.as_dict(),
+                    'published': published.as_dict(),
+                    'captured': captured.as_dict(),
+                    'backlog': len(backlog),
+                    'pending': pending_count,
+                    'sending': len(sending),
+                    'dropped': drops.total,
+                    'clients': client_count.value if client_count is not None else None,
+                    'sessions': len(sessions) if sessions is not None else 0,
+                    'subscribed': [topic.decode() for topic in demanded_topics(subscriptions.demand)],
+                }).encode())
+            elif command == CONTROL_TERMINATE:
+                control.send(b'OK')
+                logger.info("Telemetry publisher terminated by control socket")
+                break
+            else:
+                control.send(b'ERROR unknown command')
+
+        if publisher in socks:
+            new_kinect_subscriber = subscriptions.update(publisher.recv())
+            update_demand()
+            if new_kinect_subscriber and keyframe_request is not None:
+                keyframe_request.set()
+            logger.debug("Subscribed Kinect streams: {}".format(
+                demanded_topics(subscriptions.demand)))
+
+        if router is not None and router in socks:
+            new_kinect_subscriber = sessions.receive()
+            update_demand()
+            if new_kinect_subscriber and keyframe_request is not None:
+                keyframe_request.set()
+
+        if brick_pi_receiver in socks:
+            if len(backlog) >= Config.TELEMETRY_BACKLOG:
+                backlog.popleft()
+                drops.drop(TOPIC_TELEMETRY)
+            frames = brick_pi_receiver.recv_multipart(copy=False)
+            received.count(frames)
+            backlog.append(frames)
+            if sessions is not None:
+                sessions.offer(frames[0].bytes, frames[1:], [frames])
+
+        if kinect_receiver in socks:
+            # [topic, header, buffer], forwarded without copying the buffer,
+            # or [topic, notification] of a message in the frame ring
+            frames = kinect_receiver.recv_multipart(copy=False)
+            slot = None
+            if frame_ring is not None and len(frames) == 2 and is_ring_notification(frames[1]):
+                slot = frame_ring.notified_slot(frames[1])
+                frames = [frames[0].bytes] + frame_ring.read(slot)
+            received.count(frames)
+            topic = frames[0] if slot is not None else frames[0].bytes
+            messages = [[frames[0]] + chunk for chunk in split_message(
+                frames[1:], Config.KINECT_CHUNK_BYTES, next(message_ids))]
+            pending.setdefault(topic, deque()).append((deque(messages), slot, []))
+            pending_count += 1
+            if slot is not None:
+                hold(slot)
+            if sessions is not None:
+                sessions.offer(topic, frames[1:], messages, slot)
+
+        while backlog and not paused and publish(backlog[0], False):
+            backlog.popleft()
+
+        # Each topic is paced by its own subscribers; one chunk per topic
+        # and round, telemetry first
+        progressed = False
+        for topic, messages in list(pending.items()):
+            if messages and not backlog and not paused:
+                chunks, slot, trackers = messages[0]
+                sent = publish(chunks[0], slot is not None)
+                if sent:
+                    progressed = True
+                    chunks.popleft()
+                    if slot is not None:
+                        trackers.append(sent)
+                if sent and not chunks:
+                    messages.popleft()
+                    pending_count -= 1
+                    if slot is not None:
+                        sending.append((zmq.MessageTracker(*trackers), slot))
+                    if frames_in_flight is not None:
+                        counter = topic_slot(topic)
+                        with frames_in_flight.get_lock():
+                            frames_in_flight[counter] = max(0, frames_in_flight[counter] - 1)
+            if not messages and is_roi_topic(topic):
+                del pending[topic]
+        progressed = progressed and pending_count > 0
+
+        if sessions is not None:
+            if not paused and sessions.send():
+                progressed = True
+            if len(sessions) and sessions.expire(time.monotonic()):
+                update_demand()
+
+        # Ring slots go back to KinectProcess once libzmq let go of them
+        if sending:
+            for tracker, slot in [item for item in sending if item[0].done]:
+                release(slot)
+            sending = [item for item in sending if not item[0].done]
+
+        # Without shared counters, stop reading frames until they are sent
+        full = pending_count >= Config.KINECT_HWM * FRAME_SLOTS
+        poller.modify(kinect_receiver, 0 if full else zmq.POLLIN)
+
+    if sessions is not None:
+        sessions.close()
+    for socket in (capture, control, router):
+        if socket is not None:
+            socket.close()
+    publisher.close()
+    brick_pi_receiver.close()
+    kinect_receiver.close()
+    context.term()
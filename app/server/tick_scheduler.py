@@ -0,0 +1,97 @@
+"""
+TickScheduler - Fixed-rate clock for the BrickPi control loop.
+
+Sleeps until absolute deadlines on a fixed grid (start + n * period), so
+the time spent in a tick does not accumulate as drift. Deadlines missed
+entirely are skipped. Tick jitter and overruns are reported in
+StatsPacket (see doc/networking.md).
+"""
+import time
+
+
+class TickScheduler:
+    """
+    Deadline schedule and timing statistics of a fixed-rate loop.
+
+    Args:
+        period: Seconds between ticks
+        clock: Monotonic clock (seconds)
+        sleep: Sleep function (seconds)
+    """
+
+    def __init__(self, period: float, clock=time.monotonic, sleep=time.sleep):
+        self._period = period
+        self._clock = clock
+        self._sleep = sleep
+        self._deadline = None
+        self._overruns = 0
+        self._skipped = 0
+        self._jitter_total = 0.0
+        self._jitter_max = 0.0
+        self._ticks = 0
+
+    @property
+    def period(self) -> float:
+        """Seconds between ticks."""
+        return self._period
+
+    @property
+    def deadline(self) -> float:
+        """Deadline of the current tick (clock time, None before the first tick)."""
+        return self._deadline
+
+    @property
+    def overruns(self) -> int:
+        """Ticks whose work ran past the next deadline, since start."""
+        return self._overruns
+
+    @property
+    def skipped(self) -> int:
+        """Deadlines missed entirely and skipped, since start."""
+        return self._skipped
+
+    @property
+    def jitter_ms(self) -> float:
+        """Mean tick lateness since the last reset_window() (milliseconds)."""
+        return self._jitter_total * 1000.0 / self._ticks if self._ticks else 0.0
+
+    @property
+    def max_jitter_ms(self) -> float:
+        """Largest tick lateness since the last reset_window() (milliseconds)."""
+        return self._jitter_max * 1000.0
+
+    def wait(self) -> float:
+        """
+        Sleep until the next tick.
+
+        The first call starts the grid at the current time.
+
+        Returns:
+            The tick's deadline (clock time)
+        """
+        now = self._clock()
+        if self._deadline is None:
+            self._deadline = now
+        else:
+            self._deadline += self._period
+            if now > self._deadline:
+                # The last tick overran: skip the deadlines it swallowed
+                self._overruns += 1
+                missed = int((now - self._deadline) // self._period)
+                self._skipped += missed
+                self._deadline += missed * self._period
+            else:
+                self._sleep(self._deadline - now)
+                now = self._clock()
+
+        lateness = max(0.0, now - self._deadline)
+        self._jitter_total += lateness
+        self._jitter_max = max(self._jitter_max, lateness)
+        self._ticks += 1
+        return self._deadline
+
+    def reset_window(self):
+        """Start a new jitter window (the overrun totals are kept)."""
+        self._jitter_total = 0.0
+        self._jitter_max = 0.0
+        self._ticks = 0
@@ -10,10 +10,6 @@ See app/common/config.py for all configuration options.
 """
 import signal
 import sys
-import warnings
-
-# Suppress numpy deprecation warning from pickle (server has older numpy)
-warnings.filterwarnings('ignore', category=DeprecationWarning, module='pickle')
 
 # Load .env file if python-dotenv is available (before importing Config)
 try:
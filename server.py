@@ -6,77 +6,94 @@ Runs on Raspberry Pi with BrickPi+ and Kinect.
 Accepts commands from clients and publishes telemetry/video.
 """
 import logging
-from queue import Queue
-
-import zmq
+from multiprocessing import Array, Event, Queue as ProcessQueue, Value
 
 from app.common.config import Config
 from app.common.logging_wrapper import setup_logging
+from app.common.serialization import FRAMES_VERSION, set_decodable_source
 from app.server.brick_pi_wrapper import BrickPiWrapper
+from app.server.command_mailbox import CommandMailbox
 from app.server.command_receiver import CommandReceiver
 from app.server.handshake_server import HandshakeServer
+from app.server.frame_ring import FrameRing
 from app.server.kinect_process import KinectProcess
+from app.server.telemetry_publisher import FRAME_SLOTS, telemetry_publisher
 
 
-def telemetry_publisher(localhost, brick_pi_port, kinect_port, publisher_port):
-    """
-    Aggregates data from BrickPi and Kinect, publishes to clients.
-
-    This is the main loop that runs on the server.
-    """
-    context = zmq.Context()
+def main():
     logger = logging.getLogger(__name__)
 
-    brick_pi_receiver = context.socket(zmq.PULL)
-    brick_pi_receiver.connect("tcp://{}:{}".format(localhost, brick_pi_port))
-
-    kinect_receiver = context.socket(zmq.PULL)
-    kinect_receiver.connect("tcp://{}:{}".format(localhost, kinect_port))
+    # Latest motor speed per actuator, from CommandReceiver to BrickPiWrapper
+    command_mailbox = CommandMailbox()
 
-    poller = zmq.Poller()
-    poller.register(brick_pi_receiver, zmq.POLLIN)
-    poller.register(kinect_receiver, zmq.POLLIN)
+    # Link bandwidth (Mbps) measured by BrickPiWrapper, used by the Kinect
+    # process to pick compressors in 'auto' mode
+    link_bandwidth = Value('d', 0.0)
 
-    publisher = context.socket(zmq.PUB)
-    publisher.bind('tcp://*:{}'.format(publisher_port))
-    logger.info("Telemetry publisher bound to :{}".format(publisher_port))
+    # Set by CommandReceiver when a client asks for a Kinect keyframe (and
+    # by the publisher when a client subscribes to a Kinect stream)
+    keyframe_request = Event()
 
-    while True:
-        try:
-            socks = dict(poller.poll())
-        except KeyboardInterrupt:
-            break
+    # Kinect topics (stream and pyramid level) clients are subscribed to, as
+    # a bitmask written by the publisher and read by the Kinect process
+    stream_demand = Value('i', 0)
 
-        if brick_pi_receiver in socks:
-            publisher.send(brick_pi_receiver.recv())
+    # Kinect frames sent and not yet published per topic, so the Kinect
+    # process skips frames instead of queueing them behind a slow client
+    frames_in_flight = Array('i', FRAME_SLOTS)
 
-        if kinect_receiver in socks:
-            publisher.send(kinect_receiver.recv())
+    # SetRegionOfInterest commands passed from CommandReceiver to the Kinect process
+    roi_requests = ProcessQueue()
 
-    publisher.close()
-    brick_pi_receiver.close()
-    kinect_receiver.close()
-    context.term()
+    # Live client sessions counted by the handshake server, and the codec
+    # ids all of them can decode (compressors outside it are not used)
+    client_count = Value('i', 0)
+    client_codecs = Value('i', 0)
+    set_decodable_source(lambda: client_codecs.value)
 
+    # Multipart Kinect frame version every client reads, negotiated by the
+    # handshake server and written by the Kinect process
+    frames_version = Value('i', FRAMES_VERSION)
 
-def main():
-    logger = logging.getLogger(__name__)
-
-    command_queue = Queue(maxsize=Config.COMMAND_QUEUE_SIZE)
+    # Encoded Kinect frames passed to the publisher in shared memory
+    frame_ring = None
+    if Config.KINECT_RING:
+        frame_ring = FrameRing(Config.KINECT_RING_SLOTS, Config.KINECT_RING_SLOT_BYTES)
 
     # Create components using centralized config
     brick_pi_wrapper = BrickPiWrapper(
         Config.LOCALHOST,
         Config.BRICKPI_PORT,
-        command_queue,
-        Config.BRICKPI_CLOCK
+        command_mailbox,
+        Config.BRICKPI_CLOCK,
+        link_bandwidth=link_bandwidth
+    )
+    kinect_process = KinectProcess(
+        Config.LOCALHOST,
+        Config.KINECT_PORT,
+        link_bandwidth=link_bandwidth,
+        keyframe_request=keyframe_request,
+        stream_demand=stream_demand,
+        frames_in_flight=frames_in_flight,
+        roi_requests=roi_requests,
+        frame_ring=frame_ring,
+        client_codecs=client_codecs,
+        frames_version=frames_version
+    )
+    command_receiver = CommandReceiver(
+        command_mailbox,
+        Config.COMMAND_PORT,
+        keyframe_request=keyframe_request,
+        roi_requests=roi_requests
     )
-    kinect_process = KinectProcess(Config.LOCALHOST, Config.KINECT_PORT)
-    command_receiver = CommandReceiver(command_queue, Config.COMMAND_PORT)
     handshake_server = HandshakeServer(
         Config.HELLO_PORT,
         brick_pi_wrapper,
-        kinect_process=kinect_process
+        kinect_process=kinect_process,
+        sleep_time=Config.HELLO_SLEEP,
+        client_count=client_count,
+        client_codecs=client_codecs,
+        frames_version=frames_version
     )
 
     # Start command receiver immediately (no client IP needed!)
@@ -87,12 +104,24 @@ def main():
     handshake_server.start()
 
     # Run main telemetry publisher loop
-    telemetry_publisher(
-        Config.LOCALHOST,
-        Config.BRICKPI_PORT,
-        Config.KINECT_PORT,
-        Config.TELEMETRY_PORT
-    )
+    try:
+        telemetry_publisher(
+            Config.LOCALHOST,
+            Config.BRICKPI_PORT,
+            Config.KINECT_PORT,
+            Config.TELEMETRY_PORT,
+            stream_demand=stream_demand,
+            keyframe_request=keyframe_request,
+            frames_in_flight=frames_in_flight,
+            frame_ring=frame_ring,
+            capture_port=Config.CAPTURE_PORT,
+            control_port=Config.CONTROL_PORT,
+            stream_port=Config.STREAM_PORT,
+            client_count=client_count
+        )
+    finally:
+        if frame_ring is not None:
+            frame_ring.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,156 @@
+"""
+Compressor registry of app/common/serialization.py: header byte round trip,
+legacy zlib payloads, AutoCompressor selection, missing optional codecs and
+compressors the receivers cannot decode.
+
+Run from the repository root: python -m testing.codecs.compressor_test
+"""
+import pickle
+import zlib
+
+import numpy as np
+
+from app.common.config import Config
+from app.common.serialization import (COMPRESSED_TAG, FALLBACK_COMPRESSOR, AutoCompressor, available_compressors,
+                                      codec_mask, compress, compress_stream, decompress, decompress_buffer,
+                                      get_compressor, set_bandwidth_source, set_decodable_source)
+from app.networking import GoForward
+
+# Optional codecs (registered only when their package is installed)
+OPTIONAL = ('lz4', 'zstd', 'zstd-1', 'zstd-3', 'zstd-9')
+
+# Compressor families for arbitrary bytes
+GENERAL = ('none', 'zlib', 'lz4', 'zstd')
+
+
+def sample():
+    return {'depth': np.arange(20000, dtype=np.uint16) % 2048, 'label': 'sample'}
+
+
+def general_compressors() -> list:
+    """Registered compressors that take any bytes (rvl only takes uint16 depth)."""
+    return [name for name in available_compressors() if name.split('-')[0] in GENERAL]
+
+
+def header_round_trip():
+    data = sample()
+    for name in general_compressors():
+        encoded = compress(data, name)
+        assert encoded[0] == COMPRESSED_TAG | get_compressor(name).codec_id, name
+        decoded = decompress(encoded)
+        assert decoded['label'] == 'sample' and np.array_equal(decoded['depth'], data['depth']), name
+    # Every zlib level shares one id: decompression does not need the level
+    assert len({get_compressor('zlib-{}'.format(level)).codec_id for level in range(1, 10)}) == 1
+    print("round trip through", ', '.join(general_compressors()))
+
+
+def legacy_zlib():
+    legacy = zlib.compress(pickle.dumps(GoForward(50), protocol=4))
+    assert legacy[0] == 0x78
+    packet = decompress(legacy)
+    assert type(packet) is GoForward and packet.value == 50
+    print("legacy zlib'd pickle (0x78) still decodes")
+
+
+def unknown_ids():
+    try:
+        decompress_buffer(13, b'')
+    except ValueError as error:
+        print("unknown compressor id:", error)
+    else:
+        raise AssertionError("compressor id 13 decoded")
+    try:
+        get_compressor('brotli')
+    except ValueError as error:
+        print("unknown compressor name:", error)
+    else:
+        raise AssertionError("unknown compressor found")
+
+
+def auto_selection():
+    compressible = bytes(2_000_000)
+    noise = np.random.default_rng(0).integers(0, 256, 2_000_000, dtype=np.uint8).tobytes()
+    try:
+        # Slow link: sending 2 MB uncompressed costs far more than zlib
+        set_bandwidth_source(lambda: 0.0)
+        auto = AutoCompressor(['none', 'zlib-1'], interval=3)
+        assert auto.compress(compressible)[0].name == 'zlib-1'
+        # Between probes the current compressor is reused without measuring
+        assert auto.compress(noise)[0].name == 'zlib-1'
+        assert auto.compress(noise)[0].name == 'zlib-1'
+
+        # Fast link, incompressible data: compressing only costs time
+        set_bandwidth_source(lambda: 1e6)
+        assert auto.compress(noise)[0].name == 'none'
+        compressor, output = auto.compress(noise)
+        assert compressor.name == 'none' and bytes(output) == noise
+    finally:
+        set_bandwidth_source(None)
+    print("auto: zlib-1 on a slow link, none for noise on a fast one")
+
+
+def missing_optional_codecs():
+    missing = [name for name in OPTIONAL if name not in available_compressors()] + ['not-installed']
+    for name in missing:
+        # Auto leaves them out; with no candidate left it uses zlib-1
+        assert AutoCompressor([name]).current.name == 'zlib-1', name
+        assert AutoCompressor([name, 'none']).current.name == 'none', name
+        try:
+            get_compressor(name)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("{} found".format(name))
+
+        # A stream policy naming one falls back instead of failing every send
+        policy = Config.COMPRESS_TELEMETRY
+        Config.COMPRESS_TELEMETRY = name
+        try:
+            compressor, payload = compress_stream('telemetry', b'abc' * 100)
+        finally:
+            Config.COMPRESS_TELEMETRY = policy
+        assert compressor.name == FALLBACK_COMPRESSOR, (name, compressor.name)
+        assert decompress_buffer(compressor.codec_id, payload) == b'abc' * 100
+    print("missing codecs skipped by auto, {} for a policy: {}".format(FALLBACK_COMPRESSOR, ', '.join(missing)))
+
+
+def undecodable_fallback():
+    # A client that only has none and zlib, as negotiated in the handshake
+    set_decodable_source(lambda: codec_mask(['none', 'zlib-1']))
+    policy = Config.COMPRESS_TELEMETRY
+    try:
+        for name in general_compressors():
+            if name.split('-')[0] in ('none', 'zlib'):
+                continue
+            Config.COMPRESS_TELEMETRY = name
+            compressor, payload = compress_stream('telemetry', b'abc' * 100)
+            assert compressor.name == FALLBACK_COMPRESSOR, (name, compressor.name)
+            assert decompress_buffer(compressor.codec_id, payload) == b'abc' * 100
+            assert AutoCompressor([name, 'none']).compress(b'abc' * 100)[0].name == 'none'
+            print("{} undecodable by a client: {} instead".format(name, FALLBACK_COMPRESSOR))
+
+        # No client connected yet (empty mask): anything goes
+        set_decodable_source(lambda: 0)
+        Config.COMPRESS_TELEMETRY = 'none'
+        assert compress_stream('telemetry', b'abc')[0].name == 'none'
+    finally:
+        Config.COMPRESS_TELEMETRY = policy
+        set_decodable_source(None)
+
+
+def stream_policy():
+    # Default policy sends small packets without compression
+    compressor, payload = compress_stream('telemetry', b'abc')
+    assert compressor.name == 'none' and payload == b'abc'
+    print("telemetry stream policy: none")
+
+
+if __name__ == '__main__':
+    header_round_trip()
+    legacy_zlib()
+    unknown_ids()
+    auto_selection()
+    missing_optional_codecs()
+    undecodable_fallback()
+    stream_policy()
+    print("OK")
@@ -0,0 +1,63 @@
+"""
+Round trip and edge cases of the lossless depth codec (app/common/depth_codec.py).
+
+Run from the repository root: python -m testing.codecs.depth_codec_test
+"""
+import numpy as np
+
+from app.common import depth_codec
+
+# Raw Kinect value of an invalid reading
+NO_DEPTH = 2047
+
+
+def kinect_like(height=480, width=640, seed=0):
+    """Smooth depth ramp with an object, invalid areas and some noise."""
+    rng = np.random.default_rng(seed)
+    rows = np.linspace(600, 1000, height, dtype=np.float64)[:, None]
+    depth = np.repeat(rows, width, axis=1)
+    depth[150:300, 200:350] = 450
+    depth += rng.integers(-2, 3, depth.shape)
+    depth[:, :40] = NO_DEPTH
+    depth[400:, 500:] = NO_DEPTH
+    return depth.astype(np.uint16)
+
+
+def round_trip(name, depth, mode=None):
+    data = depth_codec.encode(depth)
+    decoded = depth_codec.decode(data)
+    assert decoded.dtype == np.uint16, name
+    assert np.array_equal(decoded, depth.ravel()), name
+    if mode is not None:
+        assert data[0] == mode, "{}: mode {} instead of {}".format(name, data[0], mode)
+    print("{:<24} {:>8} -> {:>8} bytes (mode {})".format(name, depth.nbytes, len(data), data[0]))
+
+
+def explicit_modes():
+    depth = kinect_like()
+    assert np.array_equal(depth_codec.decode_rvl(depth_codec.encode_rvl(depth)), depth.ravel())
+    assert np.array_equal(depth_codec.decode_packed(depth_codec.encode_packed(depth)), depth.ravel())
+    print("encode_rvl / encode_packed round trip")
+
+
+def raw_buffer():
+    depth = kinect_like()
+    assert np.array_equal(depth_codec.decode(depth_codec.encode(depth.tobytes())), depth.ravel())
+    print("raw uint16 buffer round trip")
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(1)
+    round_trip("kinect-like", kinect_like(), depth_codec.MODE_RVL)
+    round_trip("all invalid", np.full((480, 640), NO_DEPTH, np.uint16), depth_codec.MODE_RVL)
+    round_trip("all zero", np.zeros((480, 640), np.uint16), depth_codec.MODE_RVL)
+    round_trip("11-bit noise", rng.integers(0, 2048, (480, 640)).astype(np.uint16), depth_codec.MODE_PACKED)
+    round_trip("16-bit noise", rng.integers(0, 65536, (120, 160)).astype(np.uint16))
+    round_trip("full scale", np.full((4, 4), 65535, np.uint16))
+    round_trip("alternating extremes", np.tile(np.array([0, 65535], np.uint16), 1000))
+    round_trip("single pixel", np.array([5], np.uint16))
+    round_trip("odd size", rng.integers(0, 2048, (7, 13)).astype(np.uint16))
+    round_trip("empty", np.zeros(0, np.uint16))
+    explicit_modes()
+    raw_buffer()
+    print("OK")
@@ -0,0 +1,129 @@
+"""
+Round trip of the multipart Kinect frames (app/common/serialization.py) for
+every header version, version negotiation and chunking.
+
+Run from the repository root: python -m testing.codecs.kinect_frames_test
+"""
+import numpy as np
+
+from app.common.serialization import (FRAMES_MIN_VERSION, FRAMES_VERSION, ChunkAssembler, compress, decode_frames,
+                                      decode_message, encode_frames, is_chunk, negotiate_frames_version,
+                                      split_message)
+from app.networking import KinectPacket
+
+# First version carrying each field (older headers decode it as the default)
+SINCE = {'level': 3, 'roi': 4, 'capture_fps': 5, 'video_timestamp': 6}
+
+
+def packet(sequence=7):
+    rng = np.random.default_rng(sequence)
+    return KinectPacket(
+        sequence,
+        rng.integers(0, 256, (240, 320, 3)).astype(np.uint8),
+        rng.integers(0, 2048, (240, 320)).astype(np.uint16),
+        tilt_state=1, tilt_degs=-4.5, timestamp=1234.5, level=2, roi=(64, 32),
+        capture_fps=14.5, skipped_frames=3, encode_ms=6.25,
+        video_timestamp=0x1_0000_0005, depth_timestamp=42)
+
+
+def check_version(version):
+    sent = packet()
+    received = decode_frames(encode_frames(sent, version=version))
+    assert received.sequence == sent.sequence and received.time == sent.time
+    assert received.tilt_state == sent.tilt_state and received.tilt_degs == sent.tilt_degs
+    assert received.video_frame.shape == sent.video_frame.shape
+    assert np.array_equal(received.video_frame, sent.video_frame)
+    assert received.depth.dtype == np.uint16
+    assert np.array_equal(received.depth, sent.depth)
+    new = version >= SINCE['level']
+    assert received.level == (2 if new else 1)
+    new = version >= SINCE['roi']
+    assert received.roi == ((64, 32) if new else None)
+    new = version >= SINCE['capture_fps']
+    assert (received.capture_fps, received.skipped_frames, received.encode_ms) == \
+        ((14.5, 3, 6.25) if new else (0.0, 0, 0.0))
+    new = version >= SINCE['video_timestamp']
+    # Device timestamps travel as 32 bits
+    assert (received.video_timestamp, received.depth_timestamp) == ((5, 42) if new else (0, 0))
+    print("version {}: round trip ok".format(version))
+
+
+def missing_streams():
+    sent = KinectPacket(1, None, np.zeros((4, 4), np.uint16), 0, 0.0)
+    received = decode_frames(encode_frames(sent))
+    assert received.video_frame is None and received.depth.shape == (4, 4)
+    print("packet without video: round trip ok")
+
+
+def both_wire_formats():
+    sent = packet(3)
+    assert decode_message(encode_frames(sent)).sequence == 3
+    assert decode_message([compress(sent)]).sequence == 3
+    print("decode_message reads multipart and pickled messages")
+
+
+def bytes_frames():
+    # recv_multipart(copy=True) hands over bytes instead of zmq.Frame
+    sent = packet()
+    frames = [bytes(memoryview(frame).cast('B')) for frame in encode_frames(sent)]
+    assert np.array_equal(decode_frames(frames).depth, sent.depth)
+    print("frames received as bytes decode")
+
+
+def bad_messages():
+    header, *buffers = encode_frames(packet())
+    bad = {'missing buffer': [header] + buffers[:-1]}
+    for version in (FRAMES_MIN_VERSION - 1, FRAMES_VERSION + 1):
+        bad['version {}'.format(version)] = [header[:1] + bytes([version]) + header[2:]] + buffers
+    for name, frames in bad.items():
+        try:
+            decode_frames(frames)
+        except ValueError as error:
+            print("{}: {}".format(name, error))
+        else:
+            raise AssertionError("{} decoded".format(name))
+
+
+def negotiation():
+    assert negotiate_frames_version([]) == FRAMES_VERSION
+    assert negotiate_frames_version([(2, 6)]) == min(6, FRAMES_VERSION)
+    assert negotiate_frames_version([(2, 6), (2, 4)]) == 4
+    assert negotiate_frames_version([(3, 99)]) == FRAMES_VERSION
+    assert negotiate_frames_version([(2, 3), (5, 6)]) is None
+    assert negotiate_frames_version([(FRAMES_VERSION + 1, FRAMES_VERSION + 2)]) is None
+    print("negotiation: newest common version, None without one")
+
+
+def chunking():
+    frames = encode_frames(packet())
+    total = sum(len(memoryview(frame).cast('B')) for frame in frames)
+    for chunk_bytes in (0, total, 1000, 4096, 65536):
+        chunks = split_message(frames, chunk_bytes, message_id=0x1_0003)
+        if len(chunks) == 1:
+            assert chunks[0] is frames
+            continue
+        assert all(is_chunk(chunk) for chunk in chunks)
+        assembler = ChunkAssembler()
+        results = [assembler.add(chunk) for chunk in chunks]
+        assert all(result is None for result in results[:-1])
+        received = decode_frames(results[-1])
+        assert np.array_equal(received.depth, packet().depth)
+        # A message missing a chunk is discarded, the next one still assembles
+        for chunk in chunks[:1] + chunks[2:]:
+            assert assembler.add(chunk) is None
+        assert assembler.add(chunks[0]) is None
+        assert [assembler.add(chunk) for chunk in chunks[1:]][-1] is not None
+        print("{} bytes in {} chunks of {}: reassembled".format(total, len(chunks), chunk_bytes))
+    assert not is_chunk(frames)
+
+
+if __name__ == '__main__':
+    for frames_version in range(FRAMES_MIN_VERSION, FRAMES_VERSION + 1):
+        check_version(frames_version)
+    missing_streams()
+    both_wire_formats()
+    bytes_frames()
+    bad_messages()
+    negotiation()
+    chunking()
+    print("OK")
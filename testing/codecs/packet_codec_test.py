@@ -0,0 +1,155 @@
+"""
+Round trip and edge cases of the fixed-layout packet codec (app/networking/codec.py).
+
+Run from the repository root: python -m testing.codecs.packet_codec_test
+"""
+import struct
+
+from app.common.serialization import compress, decompress
+from app.networking import (GO_FORWARD, MSG_COMMAND, MSG_STATS, MSG_TELEMETRY, MSG_VELOCITY, GoForward, LegoMotor,
+                            LegoSensor, StatsPacket, TelemetryPacket, TurnLeft, VelocityCommand, decode_packet,
+                            encode_packet, is_encoded)
+from app.networking.codec import COMMAND_CLASSES, OLDER_SCHEMAS, SCHEMAS
+
+
+def telemetry():
+    packet = TelemetryPacket(
+        123456,
+        left_motor=LegoMotor(port=0, speed=-200, desired_speed=-255, angle=-1234567),
+        right_motor=LegoMotor(port=3, speed=200, desired_speed=255, angle=7654321),
+        turret_motor=LegoMotor(),
+        ultrasound_sensor=LegoSensor(port=1),
+        color_sensor=LegoSensor(),
+        timestamp=1700000000.125)
+    packet.ultrasound_sensor.raw = 42
+    return packet
+
+
+def stats():
+    packet = StatsPacket(99, voltage=8.123, temperature=-3.25, timestamp=1700000000.5)
+    packet.system_stats.cpu_percent = 12.3
+    packet.system_stats.ram_percent = 45.6
+    packet.system_stats.ram_used_mb = 432.1
+    packet.system_stats.ram_total_mb = 926.0
+    packet.system_stats.net_bytes_sent = 2 ** 40
+    packet.system_stats.net_bytes_recv = 5
+    packet.system_stats.net_bandwidth_mbps = 3.75
+    return packet
+
+
+def telemetry_round_trip():
+    sent = telemetry()
+    data = encode_packet(sent)
+    received = decode_packet(data)
+    assert type(received) is TelemetryPacket
+    assert (received.sequence, received.time) == (sent.sequence, sent.time)
+    for name in ('left_motor', 'right_motor', 'turret_motor'):
+        a, b = getattr(sent, name), getattr(received, name)
+        assert (a.port, a.speed, a.desired_speed, a.angle) == (b.port, b.speed, b.desired_speed, b.angle), name
+    assert received.ultrasound_sensor.port == 1 and received.ultrasound_sensor.raw == 42
+    # Ports that are None travel as -1 and come back as None
+    assert received.turret_motor.port is None and received.color_sensor.port is None
+    print("telemetry: {} bytes, pickled {}".format(len(data), len(compress(sent))))
+
+
+def stats_round_trip():
+    sent = stats()
+    data = encode_packet(sent)
+    received = decode_packet(data)
+    assert type(received) is StatsPacket
+    assert (received.sequence, received.time) == (sent.sequence, sent.time)
+    # Fixed-point fields keep their resolution
+    assert abs(received.voltage - 8.123) < 1e-3 and abs(received.temperature - -3.25) < 0.1
+    system = received.system_stats
+    assert abs(system.cpu_percent - 12.3) < 0.1 and abs(system.ram_used_mb - 432.1) < 0.1
+    assert system.net_bytes_sent == 2 ** 40 and abs(system.net_bandwidth_mbps - 3.75) < 0.01
+    print("stats: {} bytes".format(len(data)))
+
+
+def command_round_trip():
+    for command, cls in COMMAND_CLASSES.items():
+        try:
+            sent = cls(-150)
+        except TypeError:
+            # TurretReset, RequestKeyframe: no value
+            sent = cls()
+        received = decode_packet(encode_packet(sent))
+        # CommandReceiver dispatches on the exact type
+        assert type(received) is cls, (received, cls)
+        assert (received.command, received.value, received.time) == (command, sent.value, sent.time)
+    print("commands: {} types keep their class, {} bytes each".format(
+        len(COMMAND_CLASSES), len(encode_packet(GoForward(100)))))
+
+
+def older_versions():
+    # Written by hand as a version 1 sender did: no time to live
+    command = decode_packet(struct.pack('!BBdBh', MSG_COMMAND, 1, 1700000000.25, GO_FORWARD, 150))
+    assert type(command) is GoForward and (command.value, command.time, command.ttl_ms) == (150, 1700000000.25, 0)
+    velocity = decode_packet(struct.pack('!BBdhhh', MSG_VELOCITY, 1, 1700000000.25, 5000, -10000, 0))
+    assert type(velocity) is VelocityCommand and velocity.ttl_ms == 0
+    assert (velocity.linear, velocity.angular, velocity.turret_rate) == (0.5, -1.0, 0.0)
+
+    # Version 1 telemetry carried the slow sensors, later stats lack the newer counters
+    sent = telemetry()
+    sent.voltage = 8.123
+    sent.system_stats = stats().system_stats
+    received = decode_packet(OLDER_SCHEMAS[MSG_TELEMETRY, 1].pack(sent))
+    assert type(received) is TelemetryPacket and received.sequence == sent.sequence
+    assert abs(received.voltage - 8.123) < 1e-3 and received.system_stats.net_bytes_sent == 2 ** 40
+    sizes = {}
+    for version in (1, 2, 3):
+        data = OLDER_SCHEMAS[MSG_STATS, version].pack(stats())
+        received = decode_packet(data)
+        assert type(received) is StatsPacket and abs(received.voltage - 8.123) < 1e-3
+        assert (received.tick_overruns, received.commands_expired, received.deadman_stops) == (0, 0, 0)
+        sizes[version] = len(data)
+    assert sizes == {1: 50, 2: 62, 3: 66}, sizes
+
+    # Newer than this side: rejected
+    data = bytearray(encode_packet(GoForward(1)))
+    data[1] = SCHEMAS[MSG_COMMAND].version + 1
+    try:
+        decode_packet(bytes(data))
+    except ValueError as error:
+        print("newer schema:", error)
+    else:
+        raise AssertionError("newer schema version decoded")
+    print("older schema versions of {} message types decode".format(len({key[0] for key in OLDER_SCHEMAS})))
+
+
+def legacy_pickle_still_decodes():
+    for sent in (telemetry(), stats(), TurnLeft(80)):
+        data = compress(sent)
+        assert not is_encoded(data)
+        received = decompress(data)
+        assert type(received) is type(sent) and received.sequence == sent.sequence
+    assert type(decompress(encode_packet(GoForward(1)))) is GoForward
+    print("decompress() reads binary and pickled packets")
+
+
+def rejects():
+    data = encode_packet(GoForward(1))
+    try:
+        decode_packet(bytes([0x7F]) + data[1:])
+    except ValueError as error:
+        print("unknown message type:", error)
+    else:
+        raise AssertionError("unknown message type decoded")
+    try:
+        encode_packet(object())
+    except TypeError as error:
+        print("no schema:", error)
+    else:
+        raise AssertionError("packet without a schema encoded")
+    # Type bytes never look like a zlib stream
+    assert all(message_type != 0x78 for message_type in SCHEMAS)
+
+
+if __name__ == '__main__':
+    telemetry_round_trip()
+    stats_round_trip()
+    command_round_trip()
+    older_versions()
+    legacy_pickle_still_decodes()
+    rejects()
+    print("OK")
@@ -0,0 +1,100 @@
+"""
+Depth min-pooling, video averaging and pyramid building of app/common/pyramid.py.
+
+Run from the repository root: python -m testing.codecs.pyramid_test
+"""
+import numpy as np
+
+from app.common.pyramid import build_pyramid, halve_depth, halve_video
+from app.networking import DEPTH_MM, DEPTH_RAW, VIDEO_BAYER, VIDEO_RGB
+
+# Raw Kinect value of an invalid reading
+NO_DEPTH = 2047
+
+
+def raw_depth():
+    depth = np.full((480, 640), 900, np.uint16)
+    # A thin pole one pixel wide, much nearer than the wall
+    depth[100:300, 321] = 400
+    # Invalid area, and a block half invalid
+    depth[400:, 600:] = NO_DEPTH
+    depth[0, 0] = depth[1, 1] = NO_DEPTH
+    levels = build_pyramid(depth, (1, 2, 4), lambda array: halve_depth(array, DEPTH_RAW))
+    assert sorted(levels) == [1, 2, 4]
+    assert levels[2].shape == (240, 320) and levels[4].shape == (120, 160)
+    # The pole survives every level
+    assert levels[4][30, 80] == 400 and (levels[4] == 400).sum() == 50
+    # Invalid only where the whole block was invalid
+    assert levels[2][0, 0] == 900
+    assert (levels[4][100:, 150:] == NO_DEPTH).all() and (levels[4] == NO_DEPTH).sum() == 20 * 10
+    print("raw depth: near pole kept, invalid only for fully invalid blocks")
+
+
+def millimetre_depth():
+    depth = np.array([[0, 0, 1500, 0],
+                      [0, 0, 0, 1200]], np.uint16)
+    assert halve_depth(depth, DEPTH_MM).tolist() == [[0, 1200]]
+    assert halve_depth(np.array([[65535, 3], [7, 0]], np.uint16), DEPTH_MM).tolist() == [[3]]
+    print("millimetre depth: 0 (no reading) ignored unless the block has nothing else")
+
+
+def rgb_video():
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, (480, 640, 3)).astype(np.uint8)
+    halved = halve_video(frame, VIDEO_RGB)
+    expected = frame.reshape(240, 2, 320, 2, 3).astype(np.float64).mean(axis=(1, 3))
+    assert halved.shape == (240, 320, 3) and halved.dtype == np.uint8
+    assert np.abs(halved - expected).max() <= 0.5
+    assert halve_video(np.full((2, 2, 3), 255, np.uint8), VIDEO_RGB).tolist() == [[[255, 255, 255]]]
+    print("rgb video: rounded 2x2 average")
+
+
+def bayer_video():
+    # GRBG mosaic with one constant value per phase, plus a gradient on green
+    frame = np.empty((480, 640), np.uint8)
+    frame[0::2, 0::2] = 100
+    frame[0::2, 1::2] = 200
+    frame[1::2, 0::2] = 50
+    frame[1::2, 1::2] = 100
+    frame[0::2, 0::2] += (np.arange(320) // 64).astype(np.uint8)[None, :]
+    halved = halve_video(frame, VIDEO_BAYER)
+    assert halved.shape == (240, 320)
+    # Still GRBG: every phase keeps its own value
+    assert (halved[0::2, 1::2] == 200).all() and (halved[1::2, 0::2] == 50).all()
+    assert (halved[1::2, 1::2] == 100).all()
+    assert halved[0::2, 0::2].min() >= 100 and halved[0::2, 0::2].max() <= 104
+    print("bayer video: mosaic phases averaged separately")
+
+
+def requested_levels_only():
+    calls = []
+
+    def halve(array):
+        calls.append(array.shape)
+        return halve_depth(array)
+
+    depth = np.zeros((480, 640), np.uint16)
+    assert sorted(build_pyramid(depth, (4,), halve)) == [4]
+    assert calls == [(480, 640), (240, 320)]
+    calls.clear()
+    assert sorted(build_pyramid(depth, (1,), halve)) == [1] and not calls
+    assert build_pyramid(depth, (), halve) == {}
+    print("only the levels up to the largest requested are computed")
+
+
+def odd_sizes():
+    assert halve_depth(np.zeros((7, 9), np.uint16)).shape == (3, 4)
+    assert halve_video(np.zeros((7, 9, 3), np.uint8), VIDEO_RGB).shape == (3, 4, 3)
+    # Bayer is cropped to whole 2x2 cells so the phase is kept
+    assert halve_video(np.zeros((10, 14), np.uint8), VIDEO_BAYER).shape == (4, 6)
+    print("odd sizes cropped")
+
+
+if __name__ == '__main__':
+    raw_depth()
+    millimetre_depth()
+    rgb_video()
+    bayer_video()
+    requested_levels_only()
+    odd_sizes()
+    print("OK")
@@ -0,0 +1,103 @@
+"""
+Keyframe + delta round trip and edge cases of app/common/temporal_codec.py.
+
+Run from the repository root: python -m testing.codecs.temporal_codec_test
+"""
+import zlib
+
+import numpy as np
+
+from app.common.temporal_codec import TemporalDecoder, TemporalEncoder, is_keyframe
+
+# Compressor id on the wire (zlib, as in serialization.py)
+ZLIB = 1
+
+
+def compress(array):
+    return ZLIB, zlib.compress(np.ascontiguousarray(array).tobytes(), 1)
+
+
+def decompress(codec_id, data):
+    assert codec_id == ZLIB
+    return zlib.decompress(data)
+
+
+def moving_frames(count, shape, dtype, seed=0):
+    """A static scene with one small block moving across it."""
+    rng = np.random.default_rng(seed)
+    scene = rng.integers(0, 200, shape).astype(dtype)
+    for index in range(count):
+        frame = scene.copy()
+        frame[10:20, 5 * index:5 * index + 10] = 255
+        yield frame
+
+
+def round_trip(name, shape, dtype, tile=16, interval=10, threshold=0):
+    encoder = TemporalEncoder(compress, interval, tile, threshold)
+    decoder = TemporalDecoder(decompress)
+    kinds = []
+    for sequence, frame in enumerate(moving_frames(25, shape, dtype)):
+        data = encoder.encode(frame, sequence)
+        kinds.append('K' if is_keyframe(data) else 'd')
+        decoded = decoder.decode(data, sequence, np.dtype(dtype), frame.shape)
+        assert decoded is not None, name
+        assert decoded.shape == frame.shape, name
+        error = np.abs(decoded.astype(np.int32) - frame.astype(np.int32)).max()
+        assert error <= threshold, "{}: frame {} off by {}".format(name, sequence, error)
+    # A keyframe every `interval` frames, deltas in between
+    assert ''.join(kinds) == ('K' + 'd' * (interval - 1)) * 2 + 'K' + 'd' * 4, name
+    print("{:<24} {}".format(name, ''.join(kinds)))
+
+
+def gap_waits_for_keyframe():
+    encoder = TemporalEncoder(compress, 100, 16)
+    decoder = TemporalDecoder(decompress)
+    frames = list(moving_frames(6, (48, 64), np.uint8))
+    payloads = [encoder.encode(frame, sequence) for sequence, frame in enumerate(frames[:4])]
+
+    assert decoder.decode(payloads[0], 0, np.dtype(np.uint8), frames[0].shape) is not None
+    # Frame 1 lost: the delta of frame 2 refers to it
+    assert decoder.decode(payloads[2], 2, np.dtype(np.uint8), frames[2].shape) is None
+    assert decoder.needs_keyframe and decoder.dropped == 1
+    assert decoder.decode(payloads[3], 3, np.dtype(np.uint8), frames[3].shape) is None
+    assert decoder.dropped == 2
+
+    encoder.force_keyframe()
+    data = encoder.encode(frames[4], 4)
+    assert is_keyframe(data)
+    assert np.array_equal(decoder.decode(data, 4, np.dtype(np.uint8), frames[4].shape), frames[4])
+    assert not decoder.needs_keyframe
+    data = encoder.encode(frames[5], 5)
+    assert not is_keyframe(data)
+    assert np.array_equal(decoder.decode(data, 5, np.dtype(np.uint8), frames[5].shape), frames[5])
+    print("lost delta waits for the forced keyframe")
+
+
+def shape_change_is_keyframe():
+    encoder = TemporalEncoder(compress, 100, 16)
+    encoder.encode(np.zeros((48, 64), np.uint16), 0)
+    assert is_keyframe(encoder.encode(np.zeros((24, 32), np.uint16), 1))
+    print("shape change starts a keyframe")
+
+
+def decoded_frames_stay_unchanged():
+    encoder = TemporalEncoder(compress, 100, 8)
+    decoder = TemporalDecoder(decompress)
+    frames = list(moving_frames(3, (32, 32), np.uint8))
+    decoded = [decoder.decode(encoder.encode(frame, sequence), sequence, np.dtype(np.uint8), frame.shape)
+               for sequence, frame in enumerate(frames)]
+    for frame, array in zip(frames, decoded):
+        assert np.array_equal(frame, array)
+    print("earlier decoded frames are not modified by later deltas")
+
+
+if __name__ == '__main__':
+    round_trip("depth uint16", (480, 640), np.uint16)
+    round_trip("video rgb uint8", (480, 640, 3), np.uint8)
+    round_trip("odd size (not tiles)", (37, 53), np.uint16, tile=8)
+    round_trip("lossy threshold 4", (120, 160), np.uint16, threshold=4)
+    round_trip("uint16 wraparound", (64, 64), np.uint16, tile=32)
+    gap_waits_for_keyframe()
+    shape_change_is_keyframe()
+    decoded_frames_stay_unchanged()
+    print("OK")
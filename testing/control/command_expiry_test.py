@@ -0,0 +1,66 @@
+"""
+Command time to live in app/server/command_receiver.py: late and
+future-skewed commands are counted and dropped, commands without a TTL are
+always applied, and a TTL never exceeds its 16-bit wire field.
+
+Run from the repository root: python -m testing.control.command_expiry_test
+"""
+import time
+
+from app.networking import GoForward, TurretLeft, VelocityCommand, decode_packet, encode_packet
+from app.networking.packets import MAX_TTL_MS
+from app.server.command_mailbox import CommandMailbox, LEFT_TRACK, RIGHT_TRACK, TURRET
+from app.server.command_receiver import CommandReceiver, is_expired
+
+
+def stamped(packet, sent, ttl_ms):
+    packet.stamp(sent, ttl_ms)
+    return packet
+
+
+def expiry():
+    now = 1000.0
+    assert not is_expired(stamped(GoForward(100), now - 0.4, 500), now)
+    assert is_expired(stamped(GoForward(100), now - 0.6, 500), now)
+    # Stamped in the future: a small clock offset error is tolerated, a wrong offset is not
+    assert not is_expired(stamped(GoForward(100), now + 0.4, 500), now)
+    assert is_expired(stamped(GoForward(100), now + 0.6, 500), now)
+    # Sent before the first heartbeat reply: no TTL, any age
+    unstamped = GoForward(100)
+    assert unstamped.ttl_ms == 0
+    assert not is_expired(unstamped, unstamped.time + 3600)
+    print("late and future-skewed commands expire, unstamped ones never do")
+
+
+def ttl_clamped():
+    for packet in (GoForward(100), VelocityCommand(0.5, 0.0)):
+        stamped(packet, 1000.0, 100000)
+        assert packet.ttl_ms == MAX_TTL_MS
+        # Still packs into the 16-bit field
+        assert decode_packet(encode_packet(packet)).ttl_ms == MAX_TTL_MS
+        assert stamped(packet, 1000.0, -5).ttl_ms == 0
+    assert not is_expired(stamped(GoForward(100), 1000.0, 100000), 1000.0 + 60)
+    assert is_expired(stamped(GoForward(100), 1000.0, 100000), 1000.0 + 70)
+    print("TTL above {} ms clamped".format(MAX_TTL_MS))
+
+
+def receiver():
+    mailbox = CommandMailbox()
+    commands = CommandReceiver(mailbox, port=0)
+    now = time.time()
+    commands.handle_command_packet(stamped(GoForward(100), now - 2.0, 500))
+    commands.handle_command_packet(stamped(TurretLeft(30), now + 2.0, 500))
+    assert mailbox.take() == {} and mailbox.expired == 2
+
+    commands.handle_command_packet(stamped(GoForward(100), now, 500))
+    commands.handle_command_packet(TurretLeft(30))
+    assert mailbox.take() == {LEFT_TRACK: -100, RIGHT_TRACK: 100, TURRET: 30}
+    assert mailbox.expired == 2
+    print("late and future-skewed commands counted and dropped, fresh and unstamped ones applied")
+
+
+if __name__ == '__main__':
+    expiry()
+    ttl_clamped()
+    receiver()
+    print("OK")
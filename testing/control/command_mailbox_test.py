@@ -0,0 +1,78 @@
+"""
+Latest-wins coalescing of app/server/command_mailbox.py, single-threaded and
+with a writer racing the control loop.
+
+Run from the repository root: python -m testing.control.command_mailbox_test
+"""
+import threading
+
+from app.server.command_mailbox import CommandMailbox, LEFT_TRACK, RIGHT_TRACK, TURRET
+
+
+def latest_wins():
+    mailbox = CommandMailbox()
+    assert mailbox.take() == {}
+    mailbox.post({LEFT_TRACK: 100, RIGHT_TRACK: 100})
+    mailbox.post({LEFT_TRACK: -50, RIGHT_TRACK: 50})
+    mailbox.post({TURRET: 30})
+    assert mailbox.take() == {LEFT_TRACK: -50, RIGHT_TRACK: 50, TURRET: 30}
+    assert mailbox.take() == {}
+    assert mailbox.coalesced == 2
+    assert mailbox.coalesced_per_actuator == {LEFT_TRACK: 1, RIGHT_TRACK: 1}
+    print("burst of three posts: one take, two coalesced")
+
+
+def other_actuators_untouched():
+    mailbox = CommandMailbox()
+    mailbox.post({LEFT_TRACK: 100, RIGHT_TRACK: 100})
+    mailbox.take()
+    mailbox.post({TURRET: -30})
+    assert mailbox.take() == {TURRET: -30}
+    assert mailbox.coalesced == 0
+    print("turret command leaves the tracks alone")
+
+
+def expired_counted():
+    mailbox = CommandMailbox()
+    mailbox.expire('GoForward')
+    mailbox.expire('GoForward')
+    assert mailbox.expired == 2 and mailbox.take() == {}
+    print("expired commands counted, nothing posted")
+
+
+def concurrent_writer():
+    mailbox = CommandMailbox()
+    posts = 20000
+    taken = []
+
+    def writer():
+        for speed in range(1, posts + 1):
+            mailbox.post({LEFT_TRACK: speed, RIGHT_TRACK: -speed})
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    while thread.is_alive():
+        pending = mailbox.take()
+        if pending:
+            taken.append(pending)
+    thread.join()
+    pending = mailbox.take()
+    if pending:
+        taken.append(pending)
+
+    # Tracks posted together are taken together, speeds only increase, the last one arrives
+    for pending in taken:
+        assert pending[LEFT_TRACK] == -pending[RIGHT_TRACK], pending
+    speeds = [pending[LEFT_TRACK] for pending in taken]
+    assert speeds == sorted(speeds) and speeds[-1] == posts
+    assert mailbox.coalesced_per_actuator.get(LEFT_TRACK, 0) == posts - len(taken)
+    print("{} posts against the control loop: {} taken, {} coalesced per track".format(
+        posts, len(taken), posts - len(taken)))
+
+
+if __name__ == '__main__':
+    latest_wins()
+    other_actuators_untouched()
+    expired_counted()
+    concurrent_writer()
+    print("OK")
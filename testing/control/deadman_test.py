@@ -0,0 +1,64 @@
+"""
+Wall-clock deadman of app/server/brick_pi_wrapper.py: actuators without a
+command for DEADMAN_MS stop, whatever the tick period.
+
+Needs the BrickPi library (no robot: the wrapper is never started).
+Run from the repository root: python -m testing.control.deadman_test
+"""
+from app.common.config import Config
+from app.server.brick_pi_wrapper import BrickPiWrapper
+from app.server.command_mailbox import CommandMailbox, LEFT_TRACK, RIGHT_TRACK, TURRET
+
+DEADMAN = Config.DEADMAN_MS / 1000.0
+
+
+def tick(wrapper, now) -> dict:
+    speeds = wrapper._next_speeds(now)
+    wrapper.update_values(speeds)
+    return speeds
+
+
+def stops_after_deadman(clock):
+    mailbox = CommandMailbox()
+    wrapper = BrickPiWrapper('127.0.0.1', 0, mailbox, clock=clock)
+    now = 100.0
+    mailbox.post({LEFT_TRACK: -100, RIGHT_TRACK: 100})
+    assert tick(wrapper, now) == {LEFT_TRACK: -100, RIGHT_TRACK: 100, TURRET: 0}
+
+    # Held on every tick within DEADMAN_MS of the command, stopped on the first one past it
+    ticks = 1
+    while True:
+        now += clock
+        speeds = tick(wrapper, now)
+        if now - 100.0 < DEADMAN:
+            assert speeds == {LEFT_TRACK: -100, RIGHT_TRACK: 100, TURRET: 0}, (now, speeds)
+            ticks += 1
+        else:
+            assert speeds == {LEFT_TRACK: 0, RIGHT_TRACK: 0, TURRET: 0}, (now, speeds)
+            break
+    # Only the two moving tracks count as stops
+    assert wrapper.stats_packet().deadman_stops == 2
+    print("tick {:.0f} ms: held for {} ticks, stopped after {:.0f} ms".format(
+        clock * 1000, ticks, (now - 100.0) * 1000))
+
+
+def new_command_rearms():
+    mailbox = CommandMailbox()
+    wrapper = BrickPiWrapper('127.0.0.1', 0, mailbox, clock=0.1)
+    mailbox.post({TURRET: 30})
+    tick(wrapper, 100.0)
+    mailbox.post({TURRET: 40})
+    tick(wrapper, 100.0 + DEADMAN * 0.9)
+    # Measured from the second command
+    assert tick(wrapper, 100.0 + DEADMAN * 1.5)[TURRET] == 40
+    assert tick(wrapper, 100.0 + DEADMAN * 2)[TURRET] == 0
+    assert wrapper.stats_packet().deadman_stops == 1
+    print("every command restarts the deadman")
+
+
+if __name__ == '__main__':
+    stops_after_deadman(0.01)
+    stops_after_deadman(0.1)
+    stops_after_deadman(0.25)
+    new_command_rearms()
+    print("OK")
@@ -0,0 +1,53 @@
+"""
+Motor speeds of app/server/differential_mixer.py against the discrete commands.
+
+Run from the repository root: python -m testing.control.differential_mixer_test
+"""
+from app.server.command_mailbox import LEFT_TRACK, RIGHT_TRACK, TURRET
+from app.server.differential_mixer import mix
+
+MAX_SPEED = 200
+
+
+def speeds(linear, angular, turret_rate=0.0):
+    result = mix(linear, angular, turret_rate, MAX_SPEED)
+    return result[LEFT_TRACK], result[RIGHT_TRACK], result[TURRET]
+
+
+def matches_discrete_commands():
+    # Same motor signs as CommandReceiver's GoForward, GoBackward, TurnLeft, TurnRight, TurretLeft
+    assert speeds(1, 0) == (-MAX_SPEED, MAX_SPEED, 0)
+    assert speeds(-1, 0) == (MAX_SPEED, -MAX_SPEED, 0)
+    assert speeds(0, 1) == (-MAX_SPEED, -MAX_SPEED, 0)
+    assert speeds(0, -1) == (MAX_SPEED, MAX_SPEED, 0)
+    assert speeds(0, 0, 1) == (0, 0, MAX_SPEED)
+    assert speeds(0, 0, -1) == (0, 0, -MAX_SPEED)
+    assert speeds(0, 0) == (0, 0, 0)
+    print("full-scale commands match the discrete ones")
+
+
+def desaturates_keeping_curvature():
+    # The right track would run at 1 + 0.5: both tracks scale by 1 / 1.5
+    left, right, _ = speeds(1, -0.5)
+    assert (left, right) == (-round(0.5 / 1.5 * MAX_SPEED), MAX_SPEED)
+    # Below saturation nothing is scaled
+    left, right, _ = speeds(0.5, 0.25)
+    assert (left, right) == (-round(0.75 * MAX_SPEED), round(0.25 * MAX_SPEED))
+    print("saturated turn scaled down, ratio kept:", speeds(1, -0.5))
+
+
+def clamps_out_of_range():
+    assert speeds(5, 0, -3) == speeds(1, 0, -1)
+    assert speeds(-2, 2) == speeds(-1, 1)
+    for linear in (-1, -0.6, -0.1, 0, 0.3, 1):
+        for angular in (-1, -0.4, 0, 0.7, 1):
+            left, right, _ = speeds(linear, angular)
+            assert abs(left) <= MAX_SPEED and abs(right) <= MAX_SPEED, (linear, angular)
+    print("inputs clamped to -1..1, speeds never exceed the maximum")
+
+
+if __name__ == '__main__':
+    matches_discrete_commands()
+    desaturates_keeping_curvature()
+    clamps_out_of_range()
+    print("OK")
@@ -0,0 +1,122 @@
+"""
+Sampling rates, snapshots and kept-open handles of app/server/sensor_sampler.py,
+with stand-ins for the thermal zone, the i2c bus and psutil.
+
+Run from the repository root: python -m testing.control.sensor_sampler_test
+"""
+import collections
+import logging
+import os
+import tempfile
+import time
+from multiprocessing import Value
+
+from app.server import sensor_sampler
+from app.server.sensor_sampler import SensorSampler
+
+Memory = collections.namedtuple('Memory', 'percent used total')
+NetIO = collections.namedtuple('NetIO', 'bytes_sent bytes_recv')
+
+
+class Bus:
+    """SMBus stand-in: 711 steps of the MCP3021 (12.926 V)."""
+    opened = 0
+    closed = 0
+
+    def __init__(self, number):
+        Bus.opened += 1
+
+    def read_word_data(self, address, command):
+        return (7 << 10) | 0b1011
+
+    def close(self):
+        Bus.closed += 1
+
+
+class SMBus2:
+    SMBus = Bus
+
+
+class PsUtil:
+    """psutil stand-in: 1 Mbit more traffic on wlan0 at every call."""
+
+    def __init__(self):
+        self.sent = 0
+
+    def cpu_percent(self, interval=None):
+        return 12.5
+
+    def virtual_memory(self):
+        return Memory(40.0, 400 * 2 ** 20, 1000 * 2 ** 20)
+
+    def net_io_counters(self, pernic=True):
+        self.sent += 125000
+        return {sensor_sampler.NET_INTERFACE: NetIO(self.sent, 0)}
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def sampling(thermal_zone):
+    bandwidth = Value('d', 0.0)
+    sampler = SensorSampler(bandwidth, temperature_interval=0.02, voltage_interval=0.05, system_stats_interval=0.05)
+    assert sampler.snapshot.generation == 0 and sampler.snapshot.voltage == 0
+
+    sampler.start()
+    wait_for(lambda: sampler.snapshot.generation >= 10)
+    snapshot = sampler.snapshot
+    assert snapshot.temperature == 48.5 and snapshot.voltage == 12.926, (snapshot.temperature, snapshot.voltage)
+    assert snapshot.system_stats.cpu_percent == 12.5 and snapshot.system_stats.ram_total_mb == 1000
+    assert snapshot.system_stats.net_bytes_sent > 0 and bandwidth.value > 0
+
+    # The thermal file stays open; a new snapshot replaces the old one, which keeps its values
+    with open(thermal_zone, 'w') as zone:
+        zone.write('51000\n')
+    wait_for(lambda: sampler.snapshot.temperature == 51.0)
+    assert snapshot.temperature == 48.5
+
+    sampler.stop()
+    sampler.join(1)
+    assert not sampler.is_alive()
+    # One bus for every voltage read, closed by stop()
+    assert (Bus.opened, Bus.closed) == (1, 1), (Bus.opened, Bus.closed)
+    print("{} snapshots, bus opened once".format(sampler.snapshot.generation))
+
+
+def disabled_samples():
+    before = Bus.opened
+    sampler = SensorSampler(temperature_interval=0.02, voltage_interval=0, system_stats_interval=0)
+    sampler.start()
+    wait_for(lambda: sampler.snapshot.generation >= 3)
+    sampler.stop()
+    sampler.join(1)
+    assert sampler.snapshot.voltage == 0 and Bus.opened == before
+    print("interval 0 never reads the sample")
+
+
+def no_native_thread_ids():
+    # Python < 3.8 has no threading.get_native_id(); the sampler keeps its priority
+    get_native_id = sensor_sampler.threading.get_native_id
+    del sensor_sampler.threading.get_native_id
+    try:
+        sensor_sampler._lower_priority(5, logging.getLogger(__name__))
+    finally:
+        sensor_sampler.threading.get_native_id = get_native_id
+    print("missing get_native_id skips the priority change")
+
+
+if __name__ == '__main__':
+    sensor_sampler.smbus2 = SMBus2
+    sensor_sampler.psutil = PsUtil()
+    with tempfile.TemporaryDirectory() as directory:
+        sensor_sampler.THERMAL_ZONE = os.path.join(directory, 'temp')
+        with open(sensor_sampler.THERMAL_ZONE, 'w') as zone:
+            zone.write('48500\n')
+        sampling(sensor_sampler.THERMAL_ZONE)
+        disabled_samples()
+    no_native_thread_ids()
+    print("OK")
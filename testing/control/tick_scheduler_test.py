@@ -0,0 +1,88 @@
+"""
+Deadline grid, overruns and jitter of app/server/tick_scheduler.py on a fake clock.
+
+Run from the repository root: python -m testing.control.tick_scheduler_test
+"""
+from app.server.tick_scheduler import TickScheduler
+
+
+class FakeClock:
+    """Clock that only moves when the loop sleeps or works."""
+
+    def __init__(self, start=100.0, oversleep=0.0):
+        self.now = start
+        self.oversleep = oversleep
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        assert seconds >= 0, seconds
+        self.now += seconds + self.oversleep
+
+    def work(self, seconds):
+        self.now += seconds
+
+
+def approx(a, b):
+    return abs(a - b) < 1e-9
+
+
+def no_drift():
+    clock = FakeClock()
+    scheduler = TickScheduler(0.02, clock, clock.sleep)
+    deadlines = []
+    for tick in range(100):
+        deadlines.append(scheduler.wait())
+        clock.work(0.003 + 0.01 * (tick % 3) / 2)
+    for index, deadline in enumerate(deadlines):
+        assert approx(deadline, 100.0 + index * 0.02), (index, deadline)
+    assert scheduler.overruns == 0 and scheduler.skipped == 0
+    assert approx(scheduler.jitter_ms, 0.0)
+    print("varying work stays on the grid:", deadlines[-1])
+
+
+def overrun_skips_missed_deadlines():
+    clock = FakeClock()
+    scheduler = TickScheduler(0.02, clock, clock.sleep)
+    scheduler.wait()
+    # Work for 2.5 periods: the next deadline is late, one more is missed
+    clock.work(0.05)
+    deadline = scheduler.wait()
+    assert scheduler.overruns == 1 and scheduler.skipped == 1
+    assert approx(deadline, 100.04)
+    assert approx(scheduler.max_jitter_ms, 10.0)
+    # Back on the grid, in phase
+    assert approx(scheduler.wait(), 100.06)
+    print("overrun of 2.5 periods: 1 overrun, 1 skipped, grid kept its phase")
+
+
+def overrun_by_less_than_a_period():
+    clock = FakeClock()
+    scheduler = TickScheduler(0.02, clock, clock.sleep)
+    scheduler.wait()
+    clock.work(0.025)
+    assert approx(scheduler.wait(), 100.02)
+    assert scheduler.overruns == 1 and scheduler.skipped == 0
+    print("short overrun starts the next tick at once")
+
+
+def jitter_window():
+    clock = FakeClock(oversleep=0.001)
+    scheduler = TickScheduler(0.01, clock, clock.sleep)
+    for _ in range(11):
+        scheduler.wait()
+    # The first tick starts the grid on time, the other ten wake 1 ms late
+    assert approx(scheduler.jitter_ms, 10 / 11)
+    assert approx(scheduler.max_jitter_ms, 1.0)
+    scheduler.reset_window()
+    assert scheduler.jitter_ms == 0.0 and scheduler.max_jitter_ms == 0.0
+    print("oversleeping by 1 ms: mean jitter", round(10 / 11, 3), "ms, window reset")
+
+
+if __name__ == '__main__':
+    no_drift()
+    overrun_skips_missed_deadlines()
+    overrun_by_less_than_a_period()
+    jitter_window()
+    print("OK")
@@ -0,0 +1,108 @@
+"""
+Ordering, per-topic serialisation and failure handling of
+app/server/encode_pipeline.py.
+
+Run from the repository root: python -m testing.streaming.encode_pipeline_test
+"""
+import logging
+import random
+import threading
+import time
+
+from app.server.encode_pipeline import EncodePipeline
+
+# The failure test logs an expected traceback
+quiet = logging.getLogger('encode_pipeline_test')
+quiet.addHandler(logging.NullHandler())
+quiet.propagate = False
+
+
+class Recorder:
+    """Delivery and discard callbacks, plus per-topic overlap checks."""
+
+    def __init__(self):
+        self.delivered = []
+        self.discarded = []
+        self.started = {}
+        self._lock = threading.Lock()
+        self._active = set()
+
+    def deliver(self, topic, frames):
+        self.delivered.append((topic, frames))
+
+    def discard(self, topic):
+        self.discarded.append(topic)
+
+    def job(self, topic, index, seconds, fail=False):
+        def encode():
+            with self._lock:
+                assert topic not in self._active, "two jobs of {} at once".format(topic)
+                self._active.add(topic)
+                self.started.setdefault(topic, []).append(index)
+            time.sleep(seconds)
+            with self._lock:
+                self._active.discard(topic)
+            if fail:
+                raise RuntimeError("encode {} {} failed".format(topic, index))
+            return [index]
+        return encode
+
+
+def delivered_in_submission_order():
+    recorder = Recorder()
+    pipeline = EncodePipeline(3, recorder.deliver, recorder.discard)
+    rng = random.Random(0)
+    submitted = []
+    for index in range(60):
+        topic = rng.choice((b'video/1', b'depth/1', b'depth/2'))
+        submitted.append((topic, [index]))
+        pipeline.submit(topic, recorder.job(topic, index, rng.uniform(0, 0.01)))
+    pipeline.close()
+    assert recorder.delivered == submitted
+    # Jobs of one topic started in capture order, never two at a time
+    for topic, indices in recorder.started.items():
+        assert indices == sorted(indices), topic
+    print("60 jobs over 3 topics delivered in submission order")
+
+
+def topics_encode_in_parallel():
+    recorder = Recorder()
+    pipeline = EncodePipeline(2, recorder.deliver)
+    start = time.perf_counter()
+    pipeline.submit(b'video/1', recorder.job(b'video/1', 0, 0.2))
+    pipeline.submit(b'depth/1', recorder.job(b'depth/1', 1, 0.2))
+    pipeline.close()
+    elapsed = time.perf_counter() - start
+    assert len(recorder.delivered) == 2 and elapsed < 0.35, elapsed
+    print("two topics on two workers: {:.2f} s for 2 x 0.2 s".format(elapsed))
+
+
+def failed_job_is_discarded():
+    recorder = Recorder()
+    pipeline = EncodePipeline(2, recorder.deliver, recorder.discard, quiet)
+    pipeline.submit(b'depth/1', recorder.job(b'depth/1', 0, 0.01))
+    pipeline.submit(b'depth/1', recorder.job(b'depth/1', 1, 0.01, fail=True))
+    pipeline.submit(b'depth/1', recorder.job(b'depth/1', 2, 0.01))
+    pipeline.close()
+    assert recorder.delivered == [(b'depth/1', [0]), (b'depth/1', [2])]
+    assert recorder.discarded == [b'depth/1']
+    print("failed job discarded, the next one still delivered")
+
+
+def inline_without_workers():
+    recorder = Recorder()
+    pipeline = EncodePipeline(0, recorder.deliver)
+    threads = []
+    pipeline.submit(b'video/1', lambda: threads.append(threading.get_ident()) or [0])
+    pipeline.close()
+    assert threads == [threading.get_ident()] and recorder.delivered == [(b'video/1', [0])]
+    assert len(pipeline) == 0
+    print("workers=0 encodes on the submitting thread")
+
+
+if __name__ == '__main__':
+    delivered_in_submission_order()
+    topics_encode_in_parallel()
+    failed_job_is_discarded()
+    inline_without_workers()
+    print("OK")
@@ -0,0 +1,108 @@
+"""
+Slot life cycle of app/server/frame_ring.py, in one process and across a
+spawned writer process.
+
+Run from the repository root: python -m testing.streaming.frame_ring_test
+"""
+import multiprocessing
+
+import numpy as np
+
+from app.common.serialization import decode_frames, encode_frames
+from app.networking import KinectPacket
+from app.server.frame_ring import FrameRing, is_ring_notification
+
+
+def depth_message(sequence):
+    depth = np.full((120, 160), sequence, np.uint16)
+    return encode_frames(KinectPacket(sequence, None, depth, 0, 0.0))
+
+
+def round_trip():
+    ring = FrameRing(4, 64 * 1024)
+    try:
+        slot = ring.write(depth_message(3))
+        notification = FrameRing.notification(slot)
+        assert is_ring_notification(notification) and FrameRing.notified_slot(notification) == slot
+        frames = ring.read(slot)
+        assert all(isinstance(frame, memoryview) for frame in frames)
+        assert decode_frames(frames).depth[0, 0] == 3
+        del frames
+        ring.release(slot)
+    finally:
+        ring.close()
+    # Kinect, zlib and compressed payloads are never taken for notifications
+    for first in (0xF1, 0x78, 0xC1):
+        assert not is_ring_notification(bytes([first, 0, 0]))
+    print("message written, notified, read in place and released")
+
+
+def full_and_oversized():
+    ring = FrameRing(2, 1024)
+    try:
+        assert ring.write([bytes(2000)]) is None
+        first, second = ring.write([b'a']), ring.write([b'b'])
+        assert {first, second} == {0, 1}
+        # Both slots busy: the writer sends inline instead
+        assert ring.write([b'c']) is None
+        ring.read(first)
+        ring.release(first)
+        assert ring.write([b'd']) == first
+    finally:
+        ring.close()
+    print("oversized message and full ring refused, released slot reused")
+
+
+def reclaim_after_writer_restart():
+    ring = FrameRing(3, 1024)
+    try:
+        written, sending = ring.write([b'lost']), ring.write([b'on the wire'])
+        frames = ring.read(sending)
+        ring.reclaim()
+        # The slot being sent is kept, the one whose notification was lost is free
+        assert ring.write([b'new']) not in (None, sending)
+        assert ring.write([b'new']) == written
+        assert ring.write([b'new']) is None
+        assert bytes(frames[0]) == b'on the wire'
+        del frames
+    finally:
+        ring.close()
+    print("reclaim frees written slots, keeps the one being sent")
+
+
+def _writer(ring, count, queue):
+    for sequence in range(count):
+        slot = None
+        while slot is None:
+            slot = ring.write(depth_message(sequence))
+        queue.put(FrameRing.notification(slot))
+
+
+def across_processes():
+    context = multiprocessing.get_context('spawn')
+    ring = FrameRing(4, 64 * 1024)
+    queue = context.Queue()
+    count = 50
+    try:
+        writer = context.Process(target=_writer, args=(ring, count, queue))
+        writer.start()
+        for sequence in range(count):
+            slot = FrameRing.notified_slot(queue.get(timeout=10))
+            frames = ring.read(slot)
+            packet = decode_frames(frames)
+            assert packet.sequence == sequence and packet.depth[-1, -1] == sequence
+            del frames, packet
+            ring.release(slot)
+        writer.join(10)
+        assert writer.exitcode == 0
+    finally:
+        ring.close()
+    print("{} messages through 4 slots from a spawned writer".format(count))
+
+
+if __name__ == '__main__':
+    round_trip()
+    full_and_oversized()
+    reclaim_after_writer_restart()
+    across_processes()
+    print("OK")
@@ -0,0 +1,122 @@
+"""
+Sessions, capability negotiation, expiry and rejected requests of
+app/server/handshake_server.py, with REQ clients on a local TCP port.
+
+Run from the repository root: python -m testing.streaming.handshake_server_test
+"""
+import socket as sockets
+import time
+from multiprocessing import Value
+
+import zmq
+
+from app.common.config import Config
+from app.common.serialization import available_compressors, compress, decompress
+from app.networking import HEARTBEAT_REJECTED, GoForward, HeartbeatRequest, HeartbeatResponse
+from app.server.handshake_server import HandshakeServer
+
+
+class Component:
+    """Stands in for BrickPiWrapper and KinectProcess (counts start())."""
+
+    def __init__(self):
+        self.starts = 0
+
+    def is_alive(self) -> bool:
+        return self.starts > 0
+
+    def start(self):
+        self.starts += 1
+
+
+def free_port() -> int:
+    with sockets.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def heartbeat(socket, sequence, session, capabilities=None) -> HeartbeatResponse:
+    socket.send(compress(HeartbeatRequest(sequence, True, {}, 0.2, session=session, capabilities=capabilities)))
+    assert socket.poll(2000), "no reply to heartbeat {}".format(sequence)
+    return decompress(socket.recv())
+
+
+def sessions_and_expiry(context):
+    Config.HANDSHAKE_SESSION_TIMEOUT = 0.6
+    brick_pi, kinect = Component(), Component()
+    client_count = Value('i', 0)
+    port = free_port()
+    server = HandshakeServer(port, brick_pi, kinect, sleep_time=0.2, client_count=client_count)
+    server.start()
+
+    clients = []
+    for session in range(1, 11):
+        socket = context.socket(zmq.REQ)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.connect('tcp://127.0.0.1:{}'.format(port))
+        clients.append((session, socket))
+
+    # Ten clients, each answered at once; components start with the first
+    for session, socket in clients:
+        response = heartbeat(socket, 0, session, {'compressors': ['zlib-1', 'no-such-codec'], 'chunks': True})
+        assert response.sequence == 1 and response.capabilities['compressors'] == ['zlib-1']
+        assert response.capabilities['chunks'] is True
+    assert (brick_pi.starts, kinect.starts) == (1, 1)
+    assert server.client_count == 10 and client_count.value == 10 and response.clients == 10
+
+    # A client without capabilities (older version) gets every compressor
+    older = context.socket(zmq.REQ)
+    older.setsockopt(zmq.LINGER, 0)
+    older.connect('tcp://127.0.0.1:{}'.format(port))
+    response = heartbeat(older, 0, 11)
+    assert response.capabilities['compressors'] == available_compressors()
+    assert response.capabilities['chunks'] is False and response.clients == 11
+    older.close(0)
+
+    # Only the first two keep sending heartbeats; the others expire
+    deadline = time.monotonic() + 1.5
+    sequence = 2
+    while time.monotonic() < deadline:
+        for session, socket in clients[:2]:
+            heartbeat(socket, sequence, session)
+        sequence += 1
+        time.sleep(0.1)
+    assert server.client_count == 2 and client_count.value == 2, server.client_count
+    assert sorted(session.session for session in server.sessions) == [1, 2]
+
+    server._running = False
+    server.join(2)
+    for _, socket in clients:
+        socket.close(0)
+    print("11 clients answered, components started once, 9 silent sessions expired")
+
+
+def bad_requests(context):
+    port = free_port()
+    server = HandshakeServer(port, Component(), Component(), sleep_time=0.2)
+    server.start()
+    socket = context.socket(zmq.REQ)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.connect('tcp://127.0.0.1:{}'.format(port))
+
+    # Every request gets a reply, or the REQ socket could never send again
+    for request in (compress(GoForward(100)), b'\x00not a packet'):
+        socket.send(request)
+        assert socket.poll(2000), "no reply to {!r}".format(request[:8])
+        assert socket.recv() == HEARTBEAT_REJECTED
+    assert server.client_count == 0
+    response = heartbeat(socket, 5, 1)
+    assert response.sequence == 6 and server.client_count == 1
+
+    server._running = False
+    server.join(2)
+    socket.close(0)
+    print("requests that are not heartbeats rejected, the client carries on")
+
+
+if __name__ == '__main__':
+    zmq_context = zmq.Context()
+    sessions_and_expiry(zmq_context)
+    bad_requests(zmq_context)
+    zmq_context.term()
+    print("OK")
@@ -0,0 +1,193 @@
+"""
+Credit pacing, keyframe resync and expiry of app/server/stream_sessions.py,
+with DEALER clients on an inproc ROUTER socket.
+
+Run from the repository root: python -m testing.streaming.stream_sessions_test
+"""
+import time
+
+import numpy as np
+import zmq
+
+from app.common.config import Config
+from app.common.serialization import decode_frames, encode, encode_frames, is_independent
+from app.networking import (STREAM_ACK, STREAM_BYE, STREAM_TOPICS, TOPIC_DEPTH, TOPIC_TELEMETRY, KinectPacket,
+                            TelemetryPacket, level_topic)
+from app.server.stream_sessions import StreamSessions
+
+DEPTH = level_topic(TOPIC_DEPTH)
+
+
+class Server:
+    """StreamSessions on an inproc ROUTER, counting frame ring slot references."""
+
+    def __init__(self, context, address):
+        self.socket = context.socket(zmq.ROUTER)
+        self.socket.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        self.socket.bind(address)
+        self.held = 0
+        self.sessions = StreamSessions(self.socket, self._hold, self._release)
+
+    def _hold(self, slot):
+        self.held += 1
+
+    def _release(self, slot, tracker):
+        self.held -= 1
+
+    def receive_all(self) -> bool:
+        added = False
+        while self.socket.poll(100):
+            added = self.sessions.receive() or added
+        return added
+
+    def send_all(self):
+        while self.sessions.send():
+            pass
+
+
+def client(context, address, topics, window):
+    socket = context.socket(zmq.DEALER)
+    socket.connect(address)
+    socket.send_multipart([STREAM_TOPICS] + list(topics))
+    socket.send_multipart([STREAM_ACK, b'0', str(window).encode()])
+    return socket
+
+
+def receive(socket) -> list:
+    messages = []
+    while socket.poll(50):
+        messages.append(socket.recv_multipart())
+    return messages
+
+
+def telemetry_message(sequence):
+    return [TOPIC_TELEMETRY, encode(TelemetryPacket(sequence))]
+
+
+def depth_messages(count, keyframe_every):
+    """Temporally coded depth messages (topic included), a keyframe every keyframe_every."""
+    temporal = {}
+    rng = np.random.default_rng(0)
+    depth = rng.integers(400, 1000, (120, 160)).astype(np.uint16)
+    messages = []
+    for sequence in range(count):
+        if sequence % keyframe_every == 0:
+            for encoder in temporal.values():
+                encoder.force_keyframe()
+        depth[sequence % 120, :] += 1
+        messages.append([DEPTH] + encode_frames(KinectPacket(sequence, None, depth.copy(), 0, 0.0), temporal))
+    return messages
+
+
+def offer(server, message, slot=None):
+    frames = message[1:]
+    server.sessions.offer(message[0], frames, [message], slot)
+
+
+def credit_pacing(context):
+    server = Server(context, 'inproc://credits')
+    fast = client(context, 'inproc://credits', [TOPIC_TELEMETRY], window=10)
+    slow = client(context, 'inproc://credits', [TOPIC_TELEMETRY], window=3)
+    assert server.receive_all() and len(server.sessions) == 2
+
+    for sequence in range(10):
+        offer(server, telemetry_message(sequence))
+    server.send_all()
+    assert len(receive(fast)) == 10
+    # The slow client gets its window, and more only after it reports progress
+    assert len(receive(slow)) == 3
+    server.send_all()
+    assert receive(slow) == []
+    slow.send_multipart([STREAM_ACK, b'3', b'3'])
+    server.receive_all()
+    server.send_all()
+    assert len(receive(slow)) == 3
+    # A larger window takes the rest at once
+    slow.send_multipart([STREAM_ACK, b'6', b'100'])
+    server.receive_all()
+    server.send_all()
+    assert len(receive(slow)) == 4 and not server.sessions.ready
+
+    for socket in (fast, slow):
+        socket.close(0)
+    server.socket.close(0)
+    print("slow client paced by its credits, fast one unaffected")
+
+
+def telemetry_first(context):
+    server = Server(context, 'inproc://order')
+    socket = client(context, 'inproc://order', [TOPIC_TELEMETRY, DEPTH], window=10)
+    server.receive_all()
+    depth = depth_messages(1, 1)[0]
+    offer(server, depth)
+    offer(server, telemetry_message(0))
+    server.send_all()
+    topics = [message[0] for message in receive(socket)]
+    assert topics == [TOPIC_TELEMETRY, DEPTH], topics
+    socket.close(0)
+    server.socket.close(0)
+    print("queued telemetry goes out before a queued frame")
+
+
+def keyframe_resync(context):
+    server = Server(context, 'inproc://resync')
+    socket = client(context, 'inproc://resync', [DEPTH], window=1)
+    server.receive_all()
+    messages = depth_messages(12, keyframe_every=8)
+    assert is_independent(messages[0][1:]) and not is_independent(messages[1][1:])
+
+    # No credits in use yet: the first keyframe goes out, the client then stalls
+    offer(server, messages[0], slot=0)
+    server.send_all()
+    for sequence in range(1, 8):
+        offer(server, messages[sequence], slot=sequence)
+    server.send_all()
+    assert [message[0] for message in receive(socket)] == [DEPTH]
+    # Deltas past KINECT_HWM were dropped, the topic waits for the next keyframe
+    assert server.held == 0
+    offer(server, messages[8], slot=8)
+    offer(server, messages[9], slot=9)
+    assert server.held == 2
+
+    socket.send_multipart([STREAM_ACK, b'1', b'10'])
+    server.receive_all()
+    server.send_all()
+    received = receive(socket)
+    sequences = [decode_frames(message[1:], {}).sequence for message in received]
+    assert sequences == [8, 9], sequences
+    assert is_independent(received[0][1:])
+    socket.close(0)
+    server.socket.close(0)
+    print("client behind: deltas dropped, stream resumes at keyframe 8")
+
+
+def expiry_and_bye(context):
+    server = Server(context, 'inproc://expiry')
+    quiet = client(context, 'inproc://expiry', [DEPTH], window=2)
+    leaving = client(context, 'inproc://expiry', [DEPTH], window=2)
+    server.receive_all()
+    offer(server, depth_messages(1, 1)[0], slot=0)
+    assert len(server.sessions) == 2 and server.held == 2
+
+    leaving.send_multipart([STREAM_BYE])
+    server.receive_all()
+    assert len(server.sessions) == 1 and server.held == 1
+
+    now = time.monotonic()
+    assert not server.sessions.expire(now + Config.STREAM_SESSION_TIMEOUT / 2)
+    assert server.sessions.expire(now + Config.STREAM_SESSION_TIMEOUT + 2)
+    assert len(server.sessions) == 0 and server.held == 0
+    for socket in (quiet, leaving):
+        socket.close(0)
+    server.socket.close(0)
+    print("BYE and silence close sessions and release their slots")
+
+
+if __name__ == '__main__':
+    zmq_context = zmq.Context()
+    credit_pacing(zmq_context)
+    telemetry_first(zmq_context)
+    keyframe_resync(zmq_context)
+    expiry_and_bye(zmq_context)
+    zmq_context.term()
+    print("OK")
@@ -0,0 +1,191 @@
+"""
+Delivery of app/server/telemetry_publisher.py to a subscriber that stops
+reading: telemetry is held back, never dropped, and KinectProcess skips
+captures until the subscriber catches up.
+
+Needs libfreenect's Python wrapper (no Kinect: a stand-in camera is used).
+Run from the repository root: python -m testing.streaming.telemetry_publisher_test
+"""
+import json
+import socket as sockets
+import threading
+import time
+from multiprocessing import Array, Value
+
+import numpy as np
+import zmq
+
+from app.common.config import Config
+from app.common.serialization import ChunkAssembler, decode_message, decompress, encode, encode_frames, is_chunk
+from app.networking import TOPIC_DEPTH, TOPIC_TELEMETRY, KinectPacket, TelemetryPacket, level_topic
+from app.server.kinect_process import KinectProcess
+from app.server.telemetry_publisher import (CONTROL_STATISTICS, CONTROL_TERMINATE, FRAME_SLOTS, telemetry_publisher,
+                                            topic_slot)
+
+DEPTH = level_topic(TOPIC_DEPTH)
+
+
+def free_port() -> int:
+    with sockets.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+class Camera:
+    """Stands in for the freenect module: a new noise depth frame on every read."""
+    DEPTH_11BIT = DEPTH_MM = DEPTH_REGISTERED = VIDEO_RGB = VIDEO_BAYER = 0
+
+    def __init__(self):
+        self.reads = 0
+
+    def sync_get_depth(self, device, depth_format):
+        self.reads += 1
+        return noise(self.reads), self.reads
+
+    def sync_stop(self):
+        pass
+
+    def close_device(self, device):
+        pass
+
+
+class Publisher:
+    """
+    telemetry_publisher() on a thread, fed by PUSH sockets as BrickPi and
+    Kinect (kinect=False: KinectProcess binds the Kinect port itself).
+    """
+
+    def __init__(self, context, kinect=True, **kwargs):
+        self.ports = {name: free_port() for name in ('brick_pi', 'kinect', 'publisher', 'control')}
+        self.brick_pi = context.socket(zmq.PUSH)
+        self.brick_pi.bind('tcp://127.0.0.1:{}'.format(self.ports['brick_pi']))
+        self.kinect = None
+        if kinect:
+            self.kinect = context.socket(zmq.PUSH)
+            self.kinect.bind('tcp://127.0.0.1:{}'.format(self.ports['kinect']))
+        self.control = context.socket(zmq.REQ)
+        self.control.connect('tcp://127.0.0.1:{}'.format(self.ports['control']))
+        self.thread = threading.Thread(target=telemetry_publisher, args=(
+            '127.0.0.1', self.ports['brick_pi'], self.ports['kinect'], self.ports['publisher']),
+            kwargs=dict(control_port=self.ports['control'], **kwargs), daemon=True)
+        self.thread.start()
+
+    def subscriber(self, context, topics):
+        """A client SUB socket as TelemetryClient sets it up, once the publisher sees its topics."""
+        socket = context.socket(zmq.SUB)
+        socket.setsockopt(zmq.RCVHWM, Config.TELEMETRY_RCVHWM)
+        socket.setsockopt(zmq.RCVBUF, Config.TELEMETRY_RCVBUF)
+        socket.setsockopt(zmq.LINGER, 0)
+        for topic in topics:
+            socket.setsockopt(zmq.SUBSCRIBE, topic)
+        socket.connect('tcp://127.0.0.1:{}'.format(self.ports['publisher']))
+        deadline = time.monotonic() + 2
+        while DEPTH in topics and DEPTH.decode() not in self.statistics()['subscribed']:
+            assert time.monotonic() < deadline, "subscription not seen"
+            time.sleep(0.01)
+        time.sleep(0.1)
+        return socket
+
+    def statistics(self) -> dict:
+        self.control.send(CONTROL_STATISTICS)
+        return json.loads(self.control.recv())
+
+    def close(self):
+        self.control.send(CONTROL_TERMINATE)
+        self.control.recv()
+        self.thread.join(2)
+        for socket in (self.brick_pi, self.kinect, self.control):
+            if socket is not None:
+                socket.close(0)
+
+
+def noise(seed):
+    """A depth frame of about 600 kB whatever the depth compressor."""
+    return np.random.default_rng(seed).integers(0, 2048, (480, 640)).astype(np.uint16)
+
+
+def depth_message(sequence) -> list:
+    return [DEPTH] + encode_frames(KinectPacket(sequence, None, noise(sequence), 0, 0.0))
+
+
+def drain(socket, idle_ms=300) -> list:
+    messages = []
+    while socket.poll(idle_ms):
+        messages.append(socket.recv_multipart())
+    return messages
+
+
+def telemetry_sequences(messages) -> list:
+    return [decompress(frames[1]).sequence for frames in messages if frames[0] == TOPIC_TELEMETRY]
+
+
+def lossless_telemetry(context):
+    publisher = Publisher(context)
+    slow = publisher.subscriber(context, [TOPIC_TELEMETRY, DEPTH])
+
+    # Depth frames fill the client's queue while it does not read,
+    # telemetry keeps arriving at the publisher
+    count = 500
+    for sequence in range(count):
+        publisher.brick_pi.send_multipart([TOPIC_TELEMETRY, encode(TelemetryPacket(sequence))])
+        if sequence < 20:
+            publisher.kinect.send_multipart(depth_message(sequence))
+        time.sleep(0.001)
+    time.sleep(0.3)
+    backlog = publisher.statistics()['backlog']
+    assert backlog > 0, "the slow client never filled up"
+
+    sequences = telemetry_sequences(drain(slow))
+    assert sequences == list(range(count)), (len(sequences), sequences[:5])
+    statistics = publisher.statistics()
+    assert statistics['dropped'] == 0 and statistics['backlog'] == 0
+    publisher.close()
+    slow.close(0)
+    print("{} telemetry packets past a stalled client ({} held back at once): none lost".format(count, backlog))
+
+
+def capture_backpressure(context):
+    demand = Value('i', 0)
+    in_flight = Array('i', FRAME_SLOTS)
+    publisher = Publisher(context, kinect=False, stream_demand=demand, frames_in_flight=in_flight)
+    camera = Camera()
+    kinect = KinectProcess('127.0.0.1', publisher.ports['kinect'], stream_demand=demand,
+                           frames_in_flight=in_flight)
+    kinect._freenect = camera
+    capture = threading.Thread(target=kinect.run, daemon=True)
+    capture.start()
+
+    # The subscriber reads nothing: once its queue is full, the depth
+    # frames in flight stay at KINECT_HWM and the camera is left alone
+    slow = publisher.subscriber(context, [DEPTH])
+    time.sleep(1.0)
+    reads = camera.reads
+    assert in_flight[topic_slot(DEPTH)] == Config.KINECT_HWM, in_flight[:]
+    time.sleep(0.5)
+    assert camera.reads == reads, (reads, camera.reads)
+
+    # Reading again frees the slots; the next packets report the skipped captures
+    assembler = ChunkAssembler()
+    packets = []
+    while len(packets) < 10:
+        assert slow.poll(2000), "delivery did not resume"
+        frames = slow.recv_multipart()[1:]
+        frames = assembler.add(frames) if is_chunk(frames) else frames
+        if frames is not None:
+            packets.append(decode_message(frames))
+    assert camera.reads > reads
+    skipped = packets[-1].skipped_frames
+    assert skipped > 0
+    kinect.running = False
+    capture.join(2)
+    publisher.close()
+    slow.close(0)
+    print("{} captures, then none while the subscriber stalled ({} skipped)".format(reads, skipped))
+
+
+if __name__ == '__main__':
+    zmq_context = zmq.Context()
+    lossless_telemetry(zmq_context)
+    capture_backpressure(zmq_context)
+    zmq_context.term()
+    print("OK")